@@ -0,0 +1,277 @@
+import argparse
+import bisect
+import csv
+import json
+import logging
+import os
+import time
+from datetime import datetime
+import numpy as np
+import pytz
+from calculator import (decimal_places, exponential_moving_average, rolling_means, round_array,
+                        round_array_by, rounded_bollinger_bands)
+from kline_frame import KlineFrame
+from signal_rules import (COMPILED_RETEST_RULES, COMPILED_SCAN_RULES, Features, above, evaluate_rules, retest_blockers,
+                          scalar_features)
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+# 回測：以本地 K 線歷史檔案重現 main.py 的訊號條件，整段歷史的每根 K 線一次以布林遮罩計算
+
+# 與 main.py 相同的掃描門檻，訊號輸出順序依 signal_rules 的宣告
+MIN_KLINE_COUNT = 234
+MIN_QUOTE_VOLUME = 10000
+SIGNAL_ORDER = tuple(rule.name for rule in COMPILED_SCAN_RULES) + tuple(rule.name for rule in COMPILED_RETEST_RULES)
+TRIGGER_SIGNAL_TYPES = ("長空", "長多") + tuple(rule.name for rule in COMPILED_RETEST_RULES)
+# 條件11/12：排程在 K 線開盤後約 5 分鐘執行，回溯過去 12 小時內的長空/長多記錄
+LOOKBACK_MS = 12 * 60 * 60 * 1000 - 5 * 60 * 1000
+
+def load_archive(path):
+    """
+    讀取本地 K 線歷史：單一檔案或目錄，支援 K 線快取的 JSON（幣安原始 K 線列表）
+    與 data.binance.vision 的 CSV（可含標題列），交易對名稱取自檔名開頭（BTCUSDT_15m.json、BTCUSDT-15m-2024-01.csv）
+    回傳 {交易對: KlineFrame}，同一交易對的多個檔案會依開盤時間合併去重
+    """
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(path, name) for name in os.listdir(path) if name.endswith((".json", ".csv"))
+    )
+    rows_by_symbol = {}
+    for file_path in files:
+        symbol = os.path.basename(file_path).replace("-", "_").split("_")[0].split(".")[0]
+        try:
+            if file_path.endswith(".json"):
+                with open(file_path, "r") as f:
+                    rows = json.load(f)
+            else:
+                with open(file_path, "r", newline="") as f:
+                    rows = [row for row in csv.reader(f) if row and row[0].strip().isdigit()]
+        except Exception as e:
+            logger.error(f"讀取 K 線歷史檔案 {file_path} 失敗: {e}")
+            continue
+        bars = rows_by_symbol.setdefault(symbol, {})
+        for row in rows:
+            bars[int(row[0])] = row
+    return {
+        symbol: KlineFrame.from_klines([bars[open_time] for open_time in sorted(bars)])
+        for symbol, bars in rows_by_symbol.items()
+    }
+
+def _shift(values, lag):
+    """將陣列向後平移 lag 格（前面補 NaN），shifted[t] == values[t - lag]"""
+    if lag == 0:
+        return values
+    shifted = np.full(len(values), np.nan)
+    shifted[lag:] = values[:-lag]
+    return shifted
+
+def _padded(values, length):
+    """將長度較短的滑動窗口結果靠右對齊到 length（前面補 NaN）"""
+    padded = np.full(length, np.nan)
+    if len(values):
+        padded[length - len(values):] = values
+    return padded
+
+def compute_indicators(klines):
+    """
+    計算整段歷史每根 K 線上的指標，數值依該根 K 線為最新一根時的精度（收盤價/成交額精度的1/100）四捨五入
+    EMA 從歷史第一根開始遞推並以最細的收盤價精度逐步四捨五入，與即時 500 根視窗的結果在暖機後一致，
+    只有最新收盤價的精度較粗（例如尾數為 0）時可能在最後一位小數不同
+    """
+    n = len(klines)
+    close = klines.close
+    quote_volume = klines.quote_volume
+    price_precision = decimal_places(close) + 2
+    volume_precision = decimal_places(quote_volume) + 2
+    finest = int(price_precision.max()) if n else 2
+
+    price_ma = {period: _padded(ma, n) for period, ma in rolling_means(close, [21, 34, 233]).items()}
+    vol21 = _padded(rolling_means(quote_volume, [21])[21], n)
+
+    short_ema = exponential_moving_average(close, 21, finest)
+    long_ema = exponential_moving_average(close, 34, finest)
+    dif = round_array(short_ema - long_ema, finest)
+    dea = exponential_moving_average(dif, 8, finest)
+    macd = round_array(2 * (dif - dea), finest)
+
+    up, mb, dn = (np.full(n, np.nan) for _ in range(3))
+    for decimals in np.unique(price_precision):
+        mask = price_precision == decimals
+        for target, band in zip((up, mb, dn), rounded_bollinger_bands(close, 21, 2, int(decimals))):
+            target[mask] = _padded(band, n)[mask]
+
+    def at(values, lag=0):
+        return round_array_by(_shift(values, lag), price_precision)
+
+    return {
+        "price_precision": price_precision,
+        "MA21": [at(price_ma[21], lag) for lag in range(5)],
+        "MA34": at(price_ma[34]),
+        "MA34_prev": at(price_ma[34], 1),
+        "MA233": at(price_ma[233]),
+        "MA233_prev": at(price_ma[233], 1),
+        "VOL21": round_array_by(vol21, volume_precision),
+        "DIF": at(dif),
+        "DEA": at(dea),
+        "MACD": at(macd),
+        "MACD_prev": at(macd, 1),
+        "MACD_raw": macd,
+        "BOLL_UP": up,
+        "BOLL_MB": mb,
+        "BOLL_DN": dn
+    }
+
+def signal_masks(klines, indicators):
+    """以 signal_rules 宣告的條件1-10 計算每根 K 線的布林遮罩，回傳 {訊號類型: 遮罩}（已套用 K 線數量與成交額門檻）"""
+    c = klines.close
+    features = Features({
+        "open": klines.open, "high": klines.high, "low": klines.low, "close": c, "quote_volume": klines.quote_volume,
+        # ma21[lag][t] 為第 t 根往前 lag 根的 MA21，歷史依時間順序為 ma21[4] ... ma21[0]
+        "MA21": indicators["MA21"][0],
+        "MA21_history": indicators["MA21"][::-1],
+        "close_history": [_shift(c, 2), _shift(c, 1), c]
+    })
+    features.update({
+        key: indicators[key] for key in ("MA34", "MA34_prev", "MA233", "MA233_prev", "VOL21", "DIF", "DEA",
+                                         "MACD", "MACD_prev", "BOLL_UP", "BOLL_MB", "BOLL_DN")
+    })
+    masks = evaluate_rules(features)
+    scanned = (np.arange(len(klines)) >= MIN_KLINE_COUNT - 1) & (klines.quote_volume >= MIN_QUOTE_VOLUME)
+    return {signal_type: mask & scanned for signal_type, mask in masks.items()}
+
+def retest_tables(macd_raw, decimals):
+    """
+    條件11/12 在同一價格精度下共用的查詢表：四捨五入後的 MACD，以及每個方向的
+    翻轉位置（第 i 根與前一根異號，已排序）與反向位置（第 i 根 MACD 與方向相反，已排序）
+    """
+    macd = round_array(macd_raw, decimals)
+    tables = {"MACD": macd}
+    for rule in COMPILED_RETEST_RULES:
+        crossings = np.flatnonzero(above(0, macd[:-1], rule.side) & above(macd[1:], 0, rule.side)) + 1
+        tables[rule.side] = (crossings.tolist(), np.flatnonzero(macd * rule.side < 0).tolist())
+    return tables
+
+def _retest_triggered(rule, record_index, t, tables):
+    """
+    條件11/12 對單筆記錄在第 t 根的判斷（門檻另外檢查），與 check_macd_conditions 相同：
+    自記錄開盤時間起的第一次翻轉在第 t 根以前，且之後未再反向；以 bisect 查詢，不必重新掃描回溯窗口
+    """
+    crossings, reversals = tables[rule.side]
+    index = bisect.bisect_right(crossings, record_index)
+    if index == len(crossings) or crossings[index] > t:
+        return False
+    # 即時視窗（最近 500 根）中 MA233 尚未形成的 K 線不檢查 MACD 是否再次反向
+    first_checked = max(crossings[index], max(0, t - 499) + MIN_KLINE_COUNT - 2)
+    index = bisect.bisect_left(reversals, first_checked)
+    return index == len(reversals) or reversals[index] > t
+
+def backtest_symbol(klines):
+    """回測單一交易對，回傳 [(開盤時間毫秒, [訊號類型...])]，條件11/12 的列與條件1-10 的列分開輸出"""
+    if len(klines) < MIN_KLINE_COUNT:
+        return []
+    indicators = compute_indicators(klines)
+    masks = signal_masks(klines, indicators)
+    open_time = klines.open_time
+    scan_hits = np.logical_or.reduce(list(masks.values()))
+
+    scan_rows = {}
+    for t in np.flatnonzero(scan_hits):
+        scan_rows[int(t)] = [signal_type for signal_type, mask in masks.items() if mask[t]]
+
+    # 條件11/12 依賴先前輸出的記錄（包含本身輸出的回測續弱/續強），只在有長空/長多記錄的回溯窗口內逐根檢查
+    long_bars = np.flatnonzero(masks["長空"] | masks["長多"])
+    candidates = set()
+    for r in long_bars:
+        end = np.searchsorted(open_time, open_time[r] + LOOKBACK_MS, side="right")
+        candidates.update(range(int(r) + 1, int(end)))
+
+    # 只有包含長空/長多/回測續弱/回測續強的記錄會進入回溯查詢：記錄依時間附加，回溯窗口以游標移除過期記錄，
+    # 各訊號類型的最後一筆記錄位置用於判斷記錄之後是否出現阻擋的訊號
+    records = []
+    window_start = 0
+    bars_by_type = {}
+    tables = {}
+    rows = []
+
+    def add_record(bar, types):
+        records.append((bar, types))
+        for signal_type in types:
+            bars_by_type.setdefault(signal_type, []).append(bar)
+
+    def blocked(bar, blockers):
+        # 記錄位置依時間附加，只需比較最後一筆
+        return any(bars_by_type.get(blocker, [-1])[-1] > bar for blocker in blockers)
+
+    scan_cursor = 0
+    scan_bars = [t for t in sorted(scan_rows) if any(signal_type in TRIGGER_SIGNAL_TYPES for signal_type in scan_rows[t])]
+    for t in sorted(candidates):
+        while scan_cursor < len(scan_bars) and scan_bars[scan_cursor] < t:
+            add_record(scan_bars[scan_cursor], scan_rows[scan_bars[scan_cursor]])
+            scan_cursor += 1
+        since = open_time[t] - LOOKBACK_MS
+        while window_start < len(records) and open_time[records[window_start][0]] < since:
+            window_start += 1
+        if np.isnan(indicators["MACD"][t]) or np.isnan(indicators["MA233"][t]):
+            continue
+        close_t = float(klines.close[t])
+        ma233_t = float(indicators["MA233"][t])
+        if close_t == 0 or np.isnan(ma233_t) or ma233_t == 0:
+            continue
+        decimals = int(indicators["price_precision"][t])
+        features = None
+        for rule in COMPILED_RETEST_RULES:
+            blockers = retest_blockers(rule)
+            window = [r for r, types in records[window_start:] if rule.params["record_type"] in types and not blocked(r, blockers)]
+            if not window:
+                continue
+            if decimals not in tables:
+                tables[decimals] = retest_tables(indicators["MACD_raw"], decimals)
+            if features is None:
+                features = scalar_features({"close": close_t, "MACD": float(tables[decimals]["MACD"][t]), "MA233": ma233_t})
+            # 門檻只取決於第 t 根，未滿足時不必逐筆檢查記錄
+            if rule.evaluate(features)[0] and any(_retest_triggered(rule, r, t, tables[decimals]) for r in window):
+                rows.append((int(open_time[t]), [rule.name]))
+                add_record(t, [rule.name])
+                break
+    rows.extend((int(open_time[t]), types) for t, types in scan_rows.items())
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+def run_backtest(archive):
+    """回測整個歷史檔案，回傳依開盤時間排序的 [(開盤時間毫秒, 交易對, [訊號類型...])]"""
+    table = []
+    for symbol, klines in archive.items():
+        table.extend((open_time, symbol, types) for open_time, types in backtest_symbol(klines))
+    table.sort(key=lambda row: (row[0], row[1]))
+    return table
+
+def main():
+    parser = argparse.ArgumentParser(description="以本地 K 線歷史回測訊號條件")
+    parser.add_argument("archive", help="K 線歷史檔案或目錄（JSON 或 CSV）")
+    parser.add_argument("--output", default="backtest_signals.csv", help="輸出的訊號表 CSV")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    archive = load_archive(args.archive)
+    total_bars = sum(len(klines) for klines in archive.values())
+    loaded = time.perf_counter()
+    table = run_backtest(archive)
+    elapsed = time.perf_counter() - loaded
+
+    taipei_tz = pytz.timezone('Asia/Taipei')
+    counts = {}
+    with open(args.output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["開盤時間", "交易對", "訊號"])
+        for open_time, symbol, types in table:
+            writer.writerow([datetime.fromtimestamp(open_time / 1000, tz=taipei_tz).strftime("%Y-%m-%d %H:%M:%S"), symbol, ", ".join(types)])
+            for signal_type in types:
+                counts[signal_type] = counts.get(signal_type, 0) + 1
+
+    print(f"交易對數量: {len(archive)}, K 線數量: {total_bars}, 讀取 {loaded - start:.2f} 秒, 回測 {elapsed:.2f} 秒")
+    for signal_type in SIGNAL_ORDER:
+        print(f"{signal_type}: {counts.get(signal_type, 0)}")
+    print(f"訊號表已輸出到 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import decimal
+import math
+import random
+import statistics
+import time
+import numpy as np
+from backtest import backtest_symbol
+from calculator import rolling_means, round_array, rounded_bollinger_bands
+from kline_frame import KlineFrame
+
+# 基準效能測試：比較逐點計算的舊版指標與向量化版本，並驗證輸出是否一致
+
+def get_precision(value):
+    d = decimal.Decimal(str(value))
+    return max(0, -d.as_tuple().exponent)
+
+def round_to_precision(value, reference_value):
+    if value is None:
+        return None
+    return round(float(value), get_precision(reference_value) + 2)
+
+def reference_moving_average(values, period):
+    """舊版逐點切片計算的移動平均"""
+    if len(values) < period:
+        return [None] * len(values)
+    reference_value = values[-1]
+    ma = []
+    for i in range(len(values)):
+        if i < period - 1:
+            ma.append(None)
+        else:
+            ma.append(round_to_precision(sum(values[i - period + 1:i + 1]) / period, reference_value))
+    return ma
+
+def reference_bollinger_bands(closes, period=21, bandwidth=2):
+    """舊版以 statistics.stdev 逐窗口計算的布林通道"""
+    reference_value = closes[-1]
+    up, mb, dn = [], [], []
+    for i in range(len(closes)):
+        if i < period - 1:
+            up.append(None)
+            mb.append(None)
+            dn.append(None)
+        else:
+            window = closes[i - period + 1:i + 1]
+            ma = sum(window) / period
+            std = statistics.stdev(window)
+            mb.append(round_to_precision(ma, reference_value))
+            up.append(round_to_precision(ma + bandwidth * std, reference_value))
+            dn.append(round_to_precision(ma - bandwidth * std, reference_value))
+    return up, mb, dn
+
+def vectorized_moving_averages(values, periods):
+    target_precision = get_precision(values[-1]) + 2
+    return {
+        period: [None] * (period - 1) + round_array(ma, target_precision).tolist()
+        for period, ma in rolling_means(values, periods).items()
+    }
+
+def vectorized_bollinger_bands(closes, period=21, bandwidth=2):
+    target_precision = get_precision(closes[-1]) + 2
+    padding = [None] * (period - 1)
+    return tuple(padding + band.tolist() for band in rounded_bollinger_bands(closes, period, bandwidth, target_precision))
+
+def generate_closes(seed, bars):
+    rng = random.Random(seed)
+    price = rng.uniform(1, 10) * 10 ** rng.choice([-4, -2, 0, 2, 4])
+    # 依價格量級決定報價小數位數（約 5~6 位有效數字，與幣安合約報價相近）
+    digits = max(1, rng.choice([4, 5]) - math.floor(math.log10(price)))
+    closes = []
+    for _ in range(bars):
+        price = max(price * (1 + rng.gauss(0, 0.006)), 10 ** -digits)
+        closes.append(float(f"{price:.{digits}f}"))
+    return closes
+
+def generate_klines(seed, bars, interval_ms=900_000):
+    """以 generate_closes 的收盤價組成幣安格式的 K 線（供回測基準使用）"""
+    rng = random.Random(seed)
+    closes = generate_closes(seed, bars)
+    klines = []
+    for i, close in enumerate(closes):
+        open_price = closes[i - 1] if i else close
+        high = max(open_price, close) * (1 + abs(rng.gauss(0, 0.003)))
+        low = min(open_price, close) * (1 - abs(rng.gauss(0, 0.003)))
+        quote_volume = rng.uniform(2e4, 2e5) * (6 if rng.random() < 0.08 else 1)
+        open_time = i * interval_ms
+        klines.append([open_time, str(open_price), f"{high:.10g}", f"{low:.10g}", str(close), "0", open_time + interval_ms - 1,
+                       f"{quote_volume:.4f}", 0, "0", "0", "0"])
+    return KlineFrame.from_klines(klines)
+
+def count_mismatches(expected, actual):
+    return sum(1 for a, b in zip(expected, actual) if a != b) + abs(len(expected) - len(actual))
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="指標計算基準效能測試")
+    parser.add_argument("--pairs", type=int, default=100, help="模擬的交易對數量")
+    parser.add_argument("--bars", type=int, default=500, help="每個交易對的 K 線數量")
+    parser.add_argument("--backtest-bars", type=int, default=5000, help="回測基準每個交易對的 K 線數量（0 為略過）")
+    args = parser.parse_args()
+
+    periods = [21, 34, 233]
+    totals = {"ma_reference": 0.0, "ma_vectorized": 0.0, "boll_reference": 0.0, "boll_vectorized": 0.0}
+    mismatches = {"ma": 0, "boll": 0}
+
+    for seed in range(args.pairs):
+        closes = generate_closes(seed, args.bars)
+
+        expected_ma = {}
+        for period in periods:
+            expected_ma[period], elapsed = timed(reference_moving_average, closes, period)
+            totals["ma_reference"] += elapsed
+        actual_ma, elapsed = timed(vectorized_moving_averages, closes, periods)
+        totals["ma_vectorized"] += elapsed
+        mismatches["ma"] += sum(count_mismatches(expected_ma[p], actual_ma[p]) for p in periods)
+
+        expected_boll, elapsed = timed(reference_bollinger_bands, closes)
+        totals["boll_reference"] += elapsed
+        actual_boll, elapsed = timed(vectorized_bollinger_bands, np.asarray(closes))
+        totals["boll_vectorized"] += elapsed
+        mismatches["boll"] += sum(count_mismatches(e, a) for e, a in zip(expected_boll, actual_boll))
+
+    print(f"交易對數量: {args.pairs}, 每個交易對 K 線數量: {args.bars}")
+    for name, label in (("ma", "MA21/MA34/MA233"), ("boll", "布林通道")):
+        reference = totals[f"{name}_reference"] / args.pairs * 1000
+        vectorized = totals[f"{name}_vectorized"] / args.pairs * 1000
+        print(f"{label}: 舊版 {reference:.3f} ms/交易對, 向量化 {vectorized:.3f} ms/交易對, "
+              f"加速 {reference / vectorized:.1f} 倍, 與舊版不一致的數值 {mismatches[name]} 筆")
+
+    if args.backtest_bars:
+        # 回測整段歷史（條件1-10 的布林遮罩與條件11/12 的回溯查詢）
+        elapsed, signals = 0.0, 0
+        for seed in range(args.pairs):
+            klines = generate_klines(seed, args.backtest_bars)
+            rows, seconds = timed(backtest_symbol, klines)
+            elapsed += seconds
+            signals += len(rows)
+        print(f"回測（每個交易對 {args.backtest_bars} 根 K 線）: {elapsed / args.pairs * 1000:.3f} ms/交易對, "
+              f"{elapsed / (args.pairs * args.backtest_bars) * 1e6:.2f} µs/K 線, 訊號列 {signals} 筆")
+
+if __name__ == "__main__":
+    main()
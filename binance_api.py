@@ -1,105 +1,254 @@
 import logging
-     import requests
-     from requests.adapters import HTTPAdapter
-     from urllib3.util.retry import Retry
-
-     logger = logging.getLogger(__name__)
-
-     FUTURES_API_URL = "https://fapi.binance.com"
-     PROXY_URL = "http://220.132.41.160:1088"  # 替換為您測試成功的代理 URL
-
-     def create_session():
-         session = requests.Session()
-         retries = Retry(
-             total=3,
-             backoff_factor=1,
-             status_forcelist=[429, 451, 500, 502, 503, 504],
-             allowed_methods=["GET"]
-         )
-         session.mount("https://", HTTPAdapter(max_retries=retries))
-         session.headers.update({
-             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-         })
-         session.proxies = {
-             "http": PROXY_URL,
-             "https": PROXY_URL
-         }
-         return session
-
-     def get_trading_pairs():
-         try:
-             logger.info("開始獲取 USDT 永續合約交易對")
-             session = create_session()
-             url = f"{FUTURES_API_URL}/fapi/v1/exchangeInfo"
-             response = session.get(url, timeout=10)
-             logger.info(f"API 回應狀態碼: {response.status_code}, 回應內容: {response.text[:200]}")
-             response.raise_for_status()
-             if 'application/json' not in response.headers.get('Content-Type', ''):
-                 logger.error(f"端點 {url} 回應非 JSON 格式: {response.text}")
-                 return []
-             data = response.json()
-             usdt_pairs = [
-                 symbol["symbol"]
-                 for symbol in data["symbols"]
-                 if symbol["quoteAsset"] == "USDT" and symbol["status"] == "TRADING" and symbol["contractType"] == "PERPETUAL"
-             ]
-             logger.info(f"從 {url} 成功獲取 {len(usdt_pairs)} 個 USDT 永續合約交易對")
-             return usdt_pairs
-         except requests.exceptions.RequestException as e:
-             logger.error(f"獲取交易對失敗: {e}, 狀態碼: {response.status_code if 'response' in locals() else '未知'}, 回應: {response.text if 'response' in locals() else '無'}")
-             return []
-         except Exception as e:
-             logger.error(f"獲取交易對時發生未知錯誤: {e}")
-             return []
-
-     def get_klines(symbol, interval="5m", limit=430):
-         try:
-             logger.info(f"獲取 {symbol} 的 {interval} K 線數據")
-             session = create_session()
-             url = f"{FUTURES_API_URL}/fapi/v1/klines"
-             params = {
-                 "symbol": symbol,
-                 "interval": interval,
-                 "limit": limit
-             }
-             response = session.get(url, params=params, timeout=10)
-             logger.info(f"API 回應狀態碼: {response.status_code}, 回應內容: {response.text[:200]}")
-             response.raise_for_status()
-             if 'application/json' not in response.headers.get('Content-Type', ''):
-                 logger.error(f"端點 {url} 回應非 JSON 格式: {response.text}")
-                 return []
-             klines = response.json()
-             if not klines or not isinstance(klines, list):
-                 logger.warning(f"從 {url} 獲取 {symbol} K 線返回空數據或格式不正確")
-                 return []
-             logger.info(f"從 {url} 成功獲取 {symbol} 的 {len(klines)} 條 K 線數據")
-             return klines
-         except requests.exceptions.RequestException as e:
-             logger.error(f"獲取 {symbol} K 線數據失敗: {e}, 狀態碼: {response.status_code if 'response' in locals() else '未知'}, 回應: {response.text if 'response' in locals() else '無'}")
-             return []
-         except Exception as e:
-             logger.error(f"獲取 {symbol} K 線數據時發生未知錯誤: {e}")
-             return []
-
-     def get_current_price(symbol):
-         try:
-             logger.info(f"獲取 {symbol} 的當前價格")
-             session = create_session()
-             url = f"{FUTURES_API_URL}/fapi/v1/ticker/price"
-             params = {"symbol": symbol}
-             response = session.get(url, params=params, timeout=10)
-             logger.info(f"API 回應狀態碼: {response.status_code}, 回應內容: {response.text[:200]}")
-             response.raise_for_status()
-             if 'application/json' not in response.headers.get('Content-Type', ''):
-                 logger.error(f"端點 {url} 回應非 JSON 格式: {response.text}")
-                 return None
-             data = response.json()
-             price = float(data["price"])
-             logger.info(f"從 {url} 獲取 {symbol} 當前價格: {price}")
-             return price
-         except requests.exceptions.RequestException as e:
-             logger.error(f"獲取 {symbol} 價格失敗: {e}, 狀態碼: {response.status_code if 'response' in locals() else '未知'}, 回應: {response.text if 'response' in locals() else '無'}")
-             return None
-         except Exception as e:
-             logger.error(f"獲取 {symbol} 價格時發生未知錯誤: {e}")
-             return None
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from rate_limiter import WeightRateLimiter
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+FUTURES_API_URL = os.environ.get("BINANCE_FUTURES_API_URL", "https://fapi.binance.com")
+PROXY_URL = os.environ.get("BINANCE_PROXY_URL", "http://220.132.41.160:1088")  # 替換為您測試成功的代理 URL
+PROXIES = {
+    "http": PROXY_URL,
+    "https": PROXY_URL
+} if PROXY_URL else None
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", os.environ.get("SCAN_CONCURRENCY", "10")))
+
+class ConnectionStats:
+    """統計連線建立次數與連線/TLS 握手耗時，用於觀察連線重用的效果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = 0
+        self.new_connections = 0
+        self.connect_seconds = 0.0
+
+    def begin_request(self):
+        self._local.connect_seconds = 0.0
+
+    def end_request(self):
+        with self._lock:
+            self.requests += 1
+        return getattr(self._local, "connect_seconds", 0.0)
+
+    def record_connect(self, seconds):
+        self._local.connect_seconds = getattr(self._local, "connect_seconds", 0.0) + seconds
+        with self._lock:
+            self.new_connections += 1
+            self.connect_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_requests": max(0, self.requests - self.new_connections),
+                "connect_seconds": round(self.connect_seconds, 4)
+            }
+
+connection_stats = ConnectionStats()
+
+def response_timings(response, request_seconds):
+    """
+    將一次請求的耗時（秒）拆為連線/TLS 握手（connect）、送出請求到收到回應標頭（ttfb）與下載回應內容（download）
+    request_seconds 為呼叫 session.get 的總耗時（非串流模式會包含下載內容）
+    """
+    connect = getattr(response, "connect_time", 0.0)
+    elapsed = getattr(response, "elapsed", None)
+    headers = elapsed.total_seconds() if elapsed is not None else request_seconds
+    return {
+        "connect": connect,
+        "ttfb": max(0.0, headers - connect),
+        "download": max(0.0, request_seconds - headers)
+    }
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        connection_stats.record_connect(time.perf_counter() - start)
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # HTTPS 的 connect 包含 TCP 連線、代理 CONNECT 通道與 TLS 握手
+        start = time.perf_counter()
+        super().connect()
+        connection_stats.record_connect(time.perf_counter() - start)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+TIMED_POOL_CLASSES = {
+    "http": TimedHTTPConnectionPool,
+    "https": TimedHTTPSConnectionPool
+}
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """記錄每個請求連線/TLS 耗時的連線池 Adapter，耗時寫入 response.connect_time"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+        return manager
+
+    def send(self, request, **kwargs):
+        connection_stats.begin_request()
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            connect_time = connection_stats.end_request()
+        response.connect_time = connect_time
+        return response
+
+def create_session(pool_size=HTTP_POOL_SIZE, use_proxy=True):
+    session = requests.Session()
+    # 429/418 不在連線層重試：回應交給限速器依 Retry-After 暫停，盲目重試會讓幣安升級為 418 封鎖 IP
+    # 重試用盡時回傳最後一個回應（而非拋出 RetryError），由呼叫端的 raise_for_status 處理
+    retries = Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[451, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+        # urllib3 對帶有 Retry-After 的 429/503 會另外重試，這裡關閉，Retry-After 只由限速器處理
+        respect_retry_after_header=False
+    )
+    adapter = TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+    })
+    if use_proxy and PROXIES:
+        session.proxies = dict(PROXIES)
+    return session
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+def get_session():
+    """取得行程內共用的長連線 Session（連線池大小與掃描並行數一致），所有幣安與 Telegram 請求共用"""
+    global _shared_session
+    if _shared_session is None:
+        with _shared_session_lock:
+            if _shared_session is None:
+                _shared_session = create_session(use_proxy=False)
+                logger.info(f"建立共用 HTTP Session，連線池大小 {HTTP_POOL_SIZE}")
+    return _shared_session
+
+# 幣安 USDⓈ-M 合約每分鐘請求權重上限（所有執行緒共用）
+rate_limiter = WeightRateLimiter(weight_limit=int(os.environ.get("BINANCE_WEIGHT_LIMIT", "2400")))
+
+EXCHANGE_INFO_WEIGHT = 1
+TICKER_PRICE_WEIGHT = 1
+# 不指定交易對的 /fapi/v1/ticker/24hr 一次回傳全市場，權重 40
+TICKER_24HR_WEIGHT = 40
+
+def get_klines_weight(limit):
+    """依 limit 計算 /fapi/v1/klines 的請求權重"""
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+def request_with_weight(session, url, weight, params=None, timeout=10, proxies=None):
+    """經由共用限速器發送 GET 請求，並依回應標頭校正剩餘權重"""
+    metrics.observe("rate_limit_wait", rate_limiter.acquire(weight), weight)
+    response = session.get(url, params=params, timeout=timeout, proxies=proxies)
+    rate_limiter.update_from_response(response)
+    return response
+
+def get_trading_pairs():
+    try:
+        logger.info("開始獲取 USDT 永續合約交易對")
+        session = get_session()
+        url = f"{FUTURES_API_URL}/fapi/v1/exchangeInfo"
+        response = request_with_weight(session, url, EXCHANGE_INFO_WEIGHT, proxies=PROXIES)
+        logger.info(f"API 回應狀態碼: {response.status_code}, 回應內容: {response.text[:200]}")
+        response.raise_for_status()
+        if 'application/json' not in response.headers.get('Content-Type', ''):
+            logger.error(f"端點 {url} 回應非 JSON 格式: {response.text}")
+            return []
+        data = response.json()
+        usdt_pairs = [
+            symbol["symbol"]
+            for symbol in data["symbols"]
+            if symbol["quoteAsset"] == "USDT" and symbol["status"] == "TRADING" and symbol["contractType"] == "PERPETUAL"
+        ]
+        logger.info(f"從 {url} 成功獲取 {len(usdt_pairs)} 個 USDT 永續合約交易對")
+        return usdt_pairs
+    except requests.exceptions.RequestException as e:
+        logger.error(f"獲取交易對失敗: {e}, 狀態碼: {response.status_code if 'response' in locals() else '未知'}, 回應: {response.text if 'response' in locals() else '無'}")
+        return []
+    except Exception as e:
+        logger.error(f"獲取交易對時發生未知錯誤: {e}")
+        return []
+
+def get_klines(symbol, interval="5m", limit=430):
+    try:
+        logger.info(f"獲取 {symbol} 的 {interval} K 線數據")
+        session = get_session()
+        url = f"{FUTURES_API_URL}/fapi/v1/klines"
+        params = {
+            "symbol": symbol,
+            "interval": interval,
+            "limit": limit
+        }
+        response = request_with_weight(session, url, get_klines_weight(limit), params=params, proxies=PROXIES)
+        logger.info(f"API 回應狀態碼: {response.status_code}, 回應內容: {response.text[:200]}")
+        response.raise_for_status()
+        if 'application/json' not in response.headers.get('Content-Type', ''):
+            logger.error(f"端點 {url} 回應非 JSON 格式: {response.text}")
+            return []
+        klines = response.json()
+        if not klines or not isinstance(klines, list):
+            logger.warning(f"從 {url} 獲取 {symbol} K 線返回空數據或格式不正確")
+            return []
+        logger.info(f"從 {url} 成功獲取 {symbol} 的 {len(klines)} 條 K 線數據")
+        return klines
+    except requests.exceptions.RequestException as e:
+        logger.error(f"獲取 {symbol} K 線數據失敗: {e}, 狀態碼: {response.status_code if 'response' in locals() else '未知'}, 回應: {response.text if 'response' in locals() else '無'}")
+        return []
+    except Exception as e:
+        logger.error(f"獲取 {symbol} K 線數據時發生未知錯誤: {e}")
+        return []
+
+def get_current_price(symbol):
+    try:
+        logger.info(f"獲取 {symbol} 的當前價格")
+        session = get_session()
+        url = f"{FUTURES_API_URL}/fapi/v1/ticker/price"
+        params = {"symbol": symbol}
+        response = request_with_weight(session, url, TICKER_PRICE_WEIGHT, params=params, proxies=PROXIES)
+        logger.info(f"API 回應狀態碼: {response.status_code}, 回應內容: {response.text[:200]}")
+        response.raise_for_status()
+        if 'application/json' not in response.headers.get('Content-Type', ''):
+            logger.error(f"端點 {url} 回應非 JSON 格式: {response.text}")
+            return None
+        data = response.json()
+        price = float(data["price"])
+        logger.info(f"從 {url} 獲取 {symbol} 當前價格: {price}")
+        return price
+    except requests.exceptions.RequestException as e:
+        logger.error(f"獲取 {symbol} 價格失敗: {e}, 狀態碼: {response.status_code if 'response' in locals() else '未知'}, 回應: {response.text if 'response' in locals() else '無'}")
+        return None
+    except Exception as e:
+        logger.error(f"獲取 {symbol} 價格時發生未知錯誤: {e}")
+        return None
@@ -1,5 +1,11 @@
 import logging
+import decimal
+import itertools
+import math
+import statistics
+from collections import deque
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 # 設定日誌記錄
 logger = logging.getLogger(__name__)
@@ -14,15 +20,15 @@ def calculate_moving_average(data, window):
             return [None] * len(data)
 
         # 驗證數據有效性
-        valid_data = [x for x in data if x is not None]
-        if not valid_data:
+        if all(x is None for x in data):
             logger.warning("數據中無有效值，無法計算移動平均")
             return [None] * len(data)
 
-        # 使用 numpy 計算移動平均
-        ret = np.convolve(valid_data, np.ones(window) / window, mode='valid')
+        # 使用 numpy 計算移動平均；None 以 NaN 保留原位置，包含 None 的窗口結果為 None，輸出與輸入逐一對齊
+        values = np.array([np.nan if x is None else x for x in data], dtype=np.float64)
+        ret = np.convolve(values, np.ones(window) / window, mode='valid')
         padding = [None] * (len(data) - len(ret))
-        result = padding + ret.tolist()
+        result = padding + [None if np.isnan(x) else x for x in ret.tolist()]
 
         return result
 
@@ -30,6 +36,825 @@ def calculate_moving_average(data, window):
         logger.error(f"計算移動平均時發生錯誤: {e}")
         return [None] * len(data)
 
+def rolling_sum(values, window):
+    """
+    計算滑動窗口總和（沿最後一軸，長度為 len(values) - window + 1；二維陣列則每列各自計算）
+    依窗口內由左至右的順序逐項累加，結果與 Python sum() 逐窗口計算完全相同（捨入到小數位數時才不會差一位）
+    運算量仍為 O(n·window)：每個窗口位移做一次整段的 NumPy 加法，只是省去逐點的 Python 迴圈；
+    累計和相減雖為 O(n)，但浮點結果與 sum() 不同，刻意不採用
+    """
+    values = np.asarray(values, dtype=np.float64)
+    count = values.shape[-1] - window + 1
+    if window <= 0 or count <= 0:
+        return np.empty(values.shape[:-1] + (0,), dtype=np.float64)
+    total = values[..., :count].copy()
+    for offset in range(1, window):
+        total += values[..., offset:offset + count]
+    return total
+
+def rolling_means(values, windows):
+    """一次計算多個窗口的移動平均，回傳 {窗口: 陣列}，各陣列長度為 len(values) - 窗口 + 1"""
+    values = np.asarray(values, dtype=np.float64)
+    return {window: rolling_sum(values, window) / window for window in windows}
+
+def rolling_std(values, window, mean=None):
+    """
+    以滑動視圖一次計算所有窗口的樣本標準差（與 statistics.stdev 相同定義，分母為 window - 1）
+    採兩段式計算（先減去窗口平均再平方），避免大數值時的抵銷誤差
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if window <= 1 or len(values) < window:
+        return np.zeros(max(len(values) - window + 1, 0), dtype=np.float64)
+    if mean is None:
+        mean = rolling_sum(values, window) / window
+    deviations = sliding_window_view(values, window) - mean[:, None]
+    # 修正式兩段演算法：扣除平均值本身的捨入誤差
+    correction = deviations.sum(axis=1)
+    sum_squares = np.einsum("ij,ij->i", deviations, deviations) - correction * correction / window
+    return np.sqrt(np.maximum(sum_squares, 0.0) / (window - 1))
+
+def bollinger_bands(values, period=21, bandwidth=2):
+    """計算布林通道，回傳 (上軌, 中軌, 下軌)，各陣列長度為 len(values) - period + 1"""
+    values = np.asarray(values, dtype=np.float64)
+    mb = rolling_sum(values, period) / period
+    std = rolling_std(values, period, mean=mb)
+    return mb + bandwidth * std, mb, mb - bandwidth * std
+
+def rounded_bollinger_bands(values, period=21, bandwidth=2, decimals=None):
+    """
+    計算布林通道並四捨五入到指定小數位數，結果與逐窗口使用 statistics.stdev 的舊版計算完全相同
+    向量化標準差與精確值最多相差數個 ulp，僅在縮放後接近捨入邊界的窗口改以 statistics.stdev 重新計算
+    """
+    values = np.asarray(values, dtype=np.float64)
+    up, mb, dn = bollinger_bands(values, period, bandwidth)
+    if decimals is None:
+        return up, mb, dn
+    scale = 10.0 ** decimals
+    for band, sign in ((up, 1), (dn, -1)):
+        scaled = band * scale
+        distance_to_half = np.abs(scaled - np.floor(scaled) - 0.5)
+        suspect = ((distance_to_half <= 8 * np.spacing(np.abs(scaled)) + 1e-9) |
+                   (np.spacing(np.abs(band)) * 8 >= 1.0 / scale))
+        for i in np.flatnonzero(suspect):
+            std = statistics.stdev(values[i:i + period].tolist())
+            band[i] = mb[i] + sign * bandwidth * std
+    return round_array(up, decimals), round_array(mb, decimals), round_array(dn, decimals)
+
+def round_array(values, decimals):
+    """
+    將整個陣列四捨五入到指定小數位數，結果與逐一呼叫 Python round(value, decimals) 完全相同
+    縮放後接近 .5 或超出可精確表示範圍的元素改以 round() 逐一處理
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if decimals > 22:
+        return np.array([round(float(v), decimals) for v in values], dtype=np.float64)
+    scale = 10.0 ** decimals
+    scaled = values * scale
+    result = np.rint(scaled) / scale
+    # 間距已大於 10^-decimals 的數值，round() 會原樣回傳
+    unchanged = np.spacing(np.abs(values)) >= 1.0 / scale
+    result[unchanged] = values[unchanged]
+    distance_to_half = np.abs(scaled - np.floor(scaled) - 0.5)
+    suspect = ~unchanged & ((distance_to_half <= 2 * np.spacing(np.abs(scaled)) + 1e-9) | ~np.isfinite(scaled))
+    if suspect.any():
+        for i in np.flatnonzero(suspect):
+            result[i] = round(float(values[i]), decimals)
+    return result
+
+def round_array_by(values, decimals):
+    """依逐元素的小數位數四捨五入（decimals 為可廣播到 values 形狀的整數陣列），同位數的元素一次處理"""
+    values = np.asarray(values, dtype=np.float64)
+    decimals = np.broadcast_to(np.asarray(decimals), values.shape)
+    result = values.copy()
+    # NaN（尚未形成的指標）原樣保留
+    finite = ~np.isnan(values)
+    for d in np.unique(decimals):
+        mask = (decimals == d) & finite
+        result[mask] = round_array(values[mask], int(d))
+    return result
+
+def decimal_places(values, max_decimals=17):
+    """
+    計算每個數值的小數位數，結果與逐一以 Decimal(str(value)) 取得的位數相同
+    取最小的 d 使 round(value, d) == value；整數值的 float 字串為 "100.0"，位數為 1
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), -1, dtype=np.int64)
+    for d in range(max_decimals + 1):
+        pending = result < 0
+        if not pending.any():
+            break
+        matched = pending & (round_array(values, d) == values)
+        result[matched] = d
+    result[(result == 0) & (np.abs(values) < 1e16)] = 1
+    for i in np.flatnonzero(result < 0):
+        exponent = decimal.Decimal(str(float(values[i]))).as_tuple().exponent
+        result[i] = max(0, -exponent) if isinstance(exponent, int) else 0
+    return result
+
+def exponential_moving_average(values, period, decimals=None):
+    """
+    指數移動平均（以第一個值為起點），指定 decimals 時每一步都以四捨五入後的值遞推
+    遞推依賴上一步的捨入結果，只能逐步計算
+    """
+    k = 2 / (period + 1)
+    values = np.asarray(values, dtype=np.float64).tolist()
+    if not values:
+        return np.empty(0, dtype=np.float64)
+    if decimals is None:
+        ema = [values[0]]
+        for value in values[1:]:
+            ema.append(value * k + ema[-1] * (1 - k))
+    else:
+        ema = [round(values[0], decimals)]
+        for value in values[1:]:
+            ema.append(round(value * k + ema[-1] * (1 - k), decimals))
+    return np.array(ema, dtype=np.float64)
+
+def exponential_moving_average_rows(values, period, decimals):
+    """
+    對二維陣列（交易對 × K 線）每一列同時計算 EMA，decimals 為每列的小數位數，每一步都以四捨五入後的值遞推
+    每列從第一個非 NaN 值開始（前面補 NaN 的較短歷史），逐欄遞推但每一步同時處理所有交易對
+    """
+    k = 2 / (period + 1)
+    values = np.asarray(values, dtype=np.float64)
+    decimals = np.asarray(decimals)
+    groups = [(decimals == d, int(d)) for d in np.unique(decimals)]
+    ema = np.full(values.shape, np.nan)
+    previous = np.full(values.shape[0], np.nan)
+    for column in range(values.shape[1]):
+        value = values[:, column]
+        current = np.where(np.isnan(previous), value, value * k + previous * (1 - k))
+        finite = ~np.isnan(current)
+        for mask, d in groups:
+            mask = mask & finite
+            current[mask] = round_array(current[mask], d)
+        ema[:, column] = current
+        previous = current
+    return ema
+
+def latest_bollinger_bands(values, period=21, bandwidth=2, decimals=None):
+    """
+    只計算二維陣列（交易對 × K 線）每一列最後一個窗口的布林通道，decimals 為每列的小數位數
+    接近捨入邊界的列與 rounded_bollinger_bands 相同改以 statistics.stdev 重新計算，回傳 (上軌, 中軌, 下軌)
+    """
+    window = np.asarray(values, dtype=np.float64)[:, -period:]
+    mb = rolling_sum(window, period)[:, 0] / period
+    deviations = window - mb[:, None]
+    correction = deviations.sum(axis=1)
+    sum_squares = np.einsum("ij,ij->i", deviations, deviations) - correction * correction / period
+    std = np.sqrt(np.maximum(sum_squares, 0.0) / (period - 1))
+    up, dn = mb + bandwidth * std, mb - bandwidth * std
+    if decimals is None:
+        return up, mb, dn
+    scale = 10.0 ** np.asarray(decimals, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        for band, sign in ((up, 1), (dn, -1)):
+            scaled = band * scale
+            distance_to_half = np.abs(scaled - np.floor(scaled) - 0.5)
+            suspect = ((distance_to_half <= 8 * np.spacing(np.abs(scaled)) + 1e-9) |
+                       (np.spacing(np.abs(band)) * 8 >= 1.0 / scale))
+            for i in np.flatnonzero(suspect & np.isfinite(band)):
+                band[i] = mb[i] + sign * bandwidth * statistics.stdev(window[i].tolist())
+    return round_array_by(up, decimals), round_array_by(mb, decimals), round_array_by(dn, decimals)
+
+class RollingSMA:
+    """
+    增量滑動窗口移動平均：以累計總和（Neumaier 補償求和）更新，新增或修正一根 K 線都是 O(1)
+    數值與逐窗口重新加總的結果可能相差數個 ulp，經四捨五入到指標精度後相同
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+        self.compensation = 0.0
+
+    def _add(self, value):
+        total = self.total + value
+        if abs(self.total) >= abs(value):
+            self.compensation += (self.total - total) + value
+        else:
+            self.compensation += (value - total) + self.total
+        self.total = total
+
+    def append(self, value):
+        """附加一根新 K 線的數值，回傳最新的移動平均"""
+        value = float(value)
+        self.values.append(value)
+        self._add(value)
+        if len(self.values) > self.window:
+            self._add(-self.values.popleft())
+        return self.value
+
+    def revise(self, value):
+        """修正最後一根（仍在形成中的）K 線的數值"""
+        if not self.values:
+            return self.append(value)
+        value = float(value)
+        self._add(-self.values[-1])
+        self._add(value)
+        self.values[-1] = value
+        return self.value
+
+    @property
+    def value(self):
+        if len(self.values) < self.window:
+            return None
+        return (self.total + self.compensation) / self.window
+
+    def to_state(self):
+        return {"window": self.window, "values": list(self.values), "total": self.total, "compensation": self.compensation}
+
+    @classmethod
+    def from_state(cls, state):
+        sma = cls(state["window"])
+        sma.values = deque(state["values"])
+        sma.total = state["total"]
+        sma.compensation = state["compensation"]
+        return sma
+
+class EMA:
+    """
+    增量指數移動平均（以第一個值為起點），保存上一根的值，修正最後一根時 O(1) 重新計算
+    指定 decimals 時每一步以四捨五入後的值遞推，與 exponential_moving_average 相同
+    """
+
+    def __init__(self, period, decimals=None):
+        self.period = period
+        self.decimals = decimals
+        self.k = 2 / (period + 1)
+        self.previous = None
+        self.current = None
+
+    def _step(self, value, previous):
+        result = value if previous is None else value * self.k + previous * (1 - self.k)
+        return result if self.decimals is None else round(result, self.decimals)
+
+    def append(self, value):
+        self.previous = self.current
+        self.current = self._step(float(value), self.previous)
+        return self.current
+
+    def revise(self, value):
+        if self.current is None:
+            return self.append(value)
+        self.current = self._step(float(value), self.previous)
+        return self.current
+
+    @property
+    def value(self):
+        return self.current
+
+    def to_state(self):
+        return {"period": self.period, "decimals": self.decimals, "previous": self.previous, "current": self.current}
+
+    @classmethod
+    def from_state(cls, state):
+        ema = cls(state["period"], state["decimals"])
+        ema.previous = state["previous"]
+        ema.current = state["current"]
+        return ema
+
+class MACD:
+    """增量 MACD：DIF = EMA(short) - EMA(long)，DEA = EMA(DIF, signal)，MACD = 2 * (DIF - DEA)"""
+
+    def __init__(self, short_period=21, long_period=34, signal_period=8, decimals=None):
+        self.decimals = decimals
+        self.short = EMA(short_period, decimals)
+        self.long = EMA(long_period, decimals)
+        self.signal = EMA(signal_period, decimals)
+
+    def _round(self, value):
+        return value if self.decimals is None else round(value, self.decimals)
+
+    def _update(self, value, revise):
+        method = "revise" if revise else "append"
+        dif = self._round(getattr(self.short, method)(value) - getattr(self.long, method)(value))
+        getattr(self.signal, method)(dif)
+        return self.value
+
+    def append(self, value):
+        return self._update(value, False)
+
+    def revise(self, value):
+        return self._update(value, True)
+
+    @property
+    def value(self):
+        """回傳 (DIF, DEA, MACD)，尚未有資料時為 (None, None, None)"""
+        if self.signal.current is None:
+            return None, None, None
+        dif = self._round(self.short.current - self.long.current)
+        dea = self.signal.current
+        return dif, dea, self._round(2 * (dif - dea))
+
+    @property
+    def previous_value(self):
+        """前一根 K 線的 MACD 柱值，尚未有兩根資料時為 None"""
+        if self.signal.previous is None:
+            return None
+        dif = self._round(self.short.previous - self.long.previous)
+        return self._round(2 * (dif - self.signal.previous))
+
+    def to_state(self):
+        return {"decimals": self.decimals, "short": self.short.to_state(), "long": self.long.to_state(), "signal": self.signal.to_state()}
+
+    @classmethod
+    def from_state(cls, state):
+        macd = cls(decimals=state["decimals"])
+        macd.short = EMA.from_state(state["short"])
+        macd.long = EMA.from_state(state["long"])
+        macd.signal = EMA.from_state(state["signal"])
+        return macd
+
+class RollingVariance:
+    """
+    增量滑動窗口平均與樣本變異數（Welford 演算法，移出最舊值與修正最後一根都是 O(1)），供布林通道使用
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _add(self, value):
+        count = len(self.values)
+        delta = value - self.mean
+        self.mean += delta / count
+        self.m2 += delta * (value - self.mean)
+
+    def _remove(self, value, count):
+        # count 為移除後的數量
+        if count == 0:
+            self.mean, self.m2 = 0.0, 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / count
+        self.m2 -= delta * (value - self.mean)
+
+    def _replace(self, old, new):
+        # 窗口大小不變：平均值平移 (new - old) / n，變異數依兩者相對新舊平均的偏差更新
+        mean = self.mean + (new - old) / len(self.values)
+        self.m2 += (new - old) * (new - mean + old - self.mean)
+        self.mean = mean
+
+    def append(self, value):
+        value = float(value)
+        if len(self.values) < self.window:
+            self.values.append(value)
+            self._add(value)
+        else:
+            oldest = self.values.popleft()
+            self.values.append(value)
+            self._replace(oldest, value)
+        return self.value
+
+    def revise(self, value):
+        if not self.values:
+            return self.append(value)
+        value = float(value)
+        self._replace(self.values[-1], value)
+        self.values[-1] = value
+        return self.value
+
+    @property
+    def value(self):
+        """回傳 (平均, 樣本變異數)，窗口未滿時為 (None, None)"""
+        if len(self.values) < self.window or self.window < 2:
+            return None, None
+        return self.mean, max(self.m2, 0.0) / (self.window - 1)
+
+    def bollinger(self, bandwidth=2):
+        """回傳 (上軌, 中軌, 下軌)，窗口未滿時為 (None, None, None)"""
+        mean, variance = self.value
+        if mean is None:
+            return None, None, None
+        std = variance ** 0.5
+        return mean + bandwidth * std, mean, mean - bandwidth * std
+
+    def to_state(self):
+        return {"window": self.window, "values": list(self.values), "mean": self.mean, "m2": self.m2}
+
+    @classmethod
+    def from_state(cls, state):
+        variance = cls(state["window"])
+        variance.values = deque(state["values"])
+        variance.mean = state["mean"]
+        variance.m2 = state["m2"]
+        return variance
+
+class DayAmplitude:
+    """
+    增量前一日振幅：依 K 線開盤時間的當地日期（預設台北時間 UTC+8）累計當日最高/最低價，
+    跨日時保存前一日的高低點；形成中的 K 線分開保存，修正時不必重新掃描當日 K 線
+    """
+
+    DAY_MS = 86_400_000
+
+    def __init__(self, utc_offset_ms=8 * 3_600_000):
+        self.utc_offset_ms = utc_offset_ms
+        self.day = None
+        self.closed_high = None
+        self.closed_low = None
+        self.open_time = None
+        self.open_high = None
+        self.open_low = None
+        self.previous_high = None
+        self.previous_low = None
+        self.previous_day = None
+
+    def _day(self, open_time):
+        return (int(open_time) + self.utc_offset_ms) // self.DAY_MS
+
+    def _fold_open_bar(self):
+        if self.open_high is None:
+            return
+        self.closed_high = self.open_high if self.closed_high is None else max(self.closed_high, self.open_high)
+        self.closed_low = self.open_low if self.closed_low is None else min(self.closed_low, self.open_low)
+
+    def update(self, open_time, high, low):
+        """套用一根 K 線：開盤時間相同時修正形成中的 K 線，較新時附加，回傳前一日振幅"""
+        open_time = int(open_time)
+        if self.open_time is not None and open_time < self.open_time:
+            return self.value
+        if open_time != self.open_time:
+            self._fold_open_bar()
+            day = self._day(open_time)
+            if day != self.day:
+                if self.day is not None:
+                    self.previous_day = self.day
+                    self.previous_high, self.previous_low = self.closed_high, self.closed_low
+                self.day = day
+                self.closed_high = self.closed_low = None
+            self.open_time = open_time
+        self.open_high, self.open_low = float(high), float(low)
+        return self.value
+
+    @property
+    def value(self):
+        """前一日振幅（百分比，小數點後2位）；前一日沒有 K 線或最低價為 0 時為 None"""
+        if self.previous_day is None or self.previous_day != self.day - 1 or not self.previous_low:
+            return None
+        return round((self.previous_high - self.previous_low) / self.previous_low * 100, 2)
+
+    def to_state(self):
+        return {key: getattr(self, key) for key in (
+            "utc_offset_ms", "day", "closed_high", "closed_low", "open_time", "open_high", "open_low",
+            "previous_high", "previous_low", "previous_day"
+        )}
+
+    @classmethod
+    def from_state(cls, state):
+        amplitude = cls(state["utc_offset_ms"])
+        for key, value in state.items():
+            setattr(amplitude, key, value)
+        return amplitude
+
+class IndicatorState:
+    """
+    單一交易對的增量指標狀態（MA21/34/233、VOL8/21、MACD、布林通道、前一日振幅），每根 K 線 O(1) 更新
+    累計值未四捨五入，rounded_values() 在讀取時依最新收盤價/成交額的精度四捨五入，結果與批次計算相同：
+    - 均線以累計總和計算，接近捨入邊界時改以保存的最近收盤價/成交額依序重新加總（與 rolling_sum 相同）
+    - MACD 依出現過的每個價格精度各保留一組逐步四捨五入的 EMA；捨入後的遞推會收斂，
+      與批次計算從 500 根視窗第一根開始遞推的結果相同。捨入單位相對價格極小（< 1e-9）時，
+      起點的差異在 500 根內無法收斂到捨入單位以下，批次結果取決於視窗起點，改以保存的 500 根收盤價重新遞推
+    - 布林通道以最近 21 根收盤價純 Python 計算，接近捨入邊界時改用 latest_bollinger_bands
+    讀取成本：一般情況 O(1)（與週期長度成正比的固定小窗口）；以下少見情況會退回較慢的路徑：
+    均線接近捨入邊界時重新加總 O(週期)、布林通道接近捨入邊界時呼叫 NumPy 批次函式，
+    以及捨入單位 < 收盤價 1e-9 的 MACD 以 O(WINDOW) 重新遞推（同一根 K 線的結果會快取，修正後才重算）
+    to_state()/from_state() 以純 Python 資料保存狀態，重新啟動後可直接接續而不必重播歷史
+    """
+
+    HISTORY = 5
+    # 保存的收盤價根數，與 K 線快取/批次計算的視窗相同
+    WINDOW = 500
+    # 捨入單位小於收盤價的此比例時，MACD 以保存的視窗重新遞推。
+    # 逐步四捨五入的 EMA 從不同起點開始，差距每根縮小為 (1 - k) 倍，直到小於捨入單位後兩條遞推完全一致；
+    # 起點差距約為價格本身，捨入單位只有價格的 1e-9 以下時，500 根內縮小不到捨入單位，
+    # 批次結果就取決於 500 根視窗的第一根，增量狀態只能跟著視窗重新遞推才會相同
+    MACD_WINDOW_RELATIVE = 1e-9
+    PRICE_PERIODS = (21, 34, 233)
+    VOLUME_PERIODS = (8, 21)
+    # 超過此根數未出現的價格精度不再保留其 MACD：批次計算只看最近 500 根，
+    # 之後若再出現該精度，批次會從視窗起點重新遞推，這裡也須以保存的收盤價重新建立，不能沿用舊的遞推
+    MACD_PRECISION_TTL = 500
+    # 布林通道一般路徑與 NumPy 批次結果可能相差數個 ulp，距離捨入邊界在此 ulp 倍數內時改用批次函式
+    BOLLINGER_TOLERANCE_ULPS = 512
+
+    def __init__(self):
+        self.open_time = None
+        self.price_ma = {period: RollingSMA(period) for period in self.PRICE_PERIODS}
+        self.volume_ma = {period: RollingSMA(period) for period in self.VOLUME_PERIODS}
+        self.macd = MACD()
+        # 每個價格精度一組逐步四捨五入的 MACD：批次計算依最新收盤價的精度四捨五入每一步，
+        # 精度改變時捨入後的遞推也不同，單一未四捨五入的 MACD 無法在讀取時還原
+        self.rounded_macd = {}
+        self.rounded_macd_used = {}
+        # _window_macd 的結果：(開盤時間, 收盤價, 小數位數) -> 數值，同一根 K 線重複讀取時不必重算
+        self.window_macd_cache = None
+        self.bar_count = 0
+        self.bollinger = RollingVariance(21)
+        self.day_amplitude = DayAmplitude()
+        # 最近的收盤價/成交額（均線接近捨入邊界時重新加總）與最近 HISTORY 根的未四捨五入均線
+        self.closes = deque(maxlen=self.WINDOW)
+        self.quote_volumes = deque(maxlen=max(self.VOLUME_PERIODS))
+        self.history = deque(maxlen=self.HISTORY)
+
+    @staticmethod
+    def target_decimals(value):
+        """指標的小數位數：參考值精度的1/100（與 main.get_target_precision 相同）"""
+        exponent = decimal.Decimal(str(float(value))).as_tuple().exponent
+        return max(0, -exponent) + 2
+
+    def _seed_rounded_macd(self, decimals):
+        # 新出現的價格精度：以保存的視窗收盤價重播逐步四捨五入的遞推，與批次計算從相同的起點開始
+        macd = MACD(decimals=decimals)
+        for close in self.closes:
+            macd.append(close)
+        self.rounded_macd[decimals] = macd
+        return macd
+
+    def update(self, kline):
+        """套用一根幣安原始 K 線：開盤時間與最後一根相同時修正，較新時附加，較舊時忽略；回傳是否有變動"""
+        open_time = int(kline[0])
+        if self.open_time is not None and open_time < self.open_time:
+            return False
+        revise = open_time == self.open_time
+        method = "revise" if revise else "append"
+        close, quote_volume = float(kline[4]), float(kline[7])
+        for sma in self.price_ma.values():
+            getattr(sma, method)(close)
+        for sma in self.volume_ma.values():
+            getattr(sma, method)(quote_volume)
+        getattr(self.macd, method)(close)
+        for macd in self.rounded_macd.values():
+            getattr(macd, method)(close)
+        getattr(self.bollinger, method)(close)
+        self.day_amplitude.update(open_time, kline[2], kline[3])
+
+        snapshot = {period: sma.value for period, sma in self.price_ma.items()}
+        for values, value in ((self.closes, close), (self.quote_volumes, quote_volume), (self.history, snapshot)):
+            if revise and values:
+                values[-1] = value
+            else:
+                values.append(value)
+        if not revise:
+            self.bar_count += 1
+        decimals = self.target_decimals(close)
+        if decimals not in self.rounded_macd:
+            self._seed_rounded_macd(decimals)
+        self.rounded_macd_used[decimals] = self.bar_count
+        for stale in [d for d, used in self.rounded_macd_used.items() if self.bar_count - used > self.MACD_PRECISION_TTL]:
+            del self.rounded_macd[stale], self.rounded_macd_used[stale]
+        self.open_time = open_time
+        return True
+
+    def _window_macd(self, decimals):
+        """
+        以保存的視窗收盤價重新計算逐步四捨五入的 MACD（與 calculate_macd 相同），回傳 (DIF, DEA, MACD, 前一根 MACD)
+        成本為 O(WINDOW)，結果依 (開盤時間, 收盤價, 小數位數) 快取
+        """
+        key = (self.open_time, self.closes[-1], decimals)
+        if self.window_macd_cache is not None and self.window_macd_cache[0] == key:
+            return self.window_macd_cache[1]
+        closes = list(self.closes)
+        short = exponential_moving_average(closes, self.macd.short.period, decimals)
+        long = exponential_moving_average(closes, self.macd.long.period, decimals)
+        dif = round_array(short - long, decimals)
+        dea = exponential_moving_average(dif, self.macd.signal.period, decimals)
+        macd = round_array(2 * (dif - dea), decimals)
+        result = float(dif[-1]), float(dea[-1]), float(macd[-1]), float(macd[-2]) if len(macd) > 1 else None
+        self.window_macd_cache = (key, result)
+        return result
+
+    def _rounded_mean(self, approx, series, period, lag, decimals):
+        """
+        將累計總和的平均四捨五入到 decimals 位；接近捨入邊界（或數值間距已大於捨入單位）時，
+        改以 series 中往前 lag 根的窗口依序重新加總，與 rolling_sum 的結果相同
+        """
+        if approx is None:
+            return None
+        scale = 10.0 ** decimals
+        scaled = approx * scale
+        distance_to_half = abs(scaled - math.floor(scaled) - 0.5)
+        if distance_to_half <= 512 * math.ulp(abs(scaled)) + 1e-9 or math.ulp(abs(approx)) * 512 >= 1.0 / scale:
+            # 只在此時取出窗口，以 islice 從 deque 取 period 個值，不複製整個 series
+            end = len(series) - lag
+            if end - period >= 0:
+                window = itertools.islice(series, end - period, end)
+                total = next(window)
+                for value in window:
+                    total += value
+                approx = total / period
+        return round(approx, decimals)
+
+    def _rounded_bollinger(self, decimals):
+        """
+        最近 21 根收盤價的布林通道四捨五入到 decimals 位，回傳 (上軌, 中軌, 下軌)
+        中軌與 rolling_sum 相同由左至右加總；上下軌以純 Python 計算，與 NumPy 的加總順序不同而可能差數個 ulp，
+        因此距離捨入邊界在 BOLLINGER_TOLERANCE_ULPS 內時改用 latest_bollinger_bands，結果與批次計算相同
+        """
+        window = self.bollinger.values
+        period = len(window)
+        total = 0.0
+        for value in window:
+            total += value
+        mb = total / period
+        correction = sum_squares = 0.0
+        for value in window:
+            deviation = value - mb
+            correction += deviation
+            sum_squares += deviation * deviation
+        std = math.sqrt(max(sum_squares - correction * correction / period, 0.0) / (period - 1))
+        up, dn = mb + 2 * std, mb - 2 * std
+        scale = 10.0 ** decimals
+        for band in (up, dn):
+            scaled = band * scale
+            if not math.isfinite(scaled):
+                break
+            tolerance = self.BOLLINGER_TOLERANCE_ULPS * math.ulp(abs(scaled)) + 1e-9
+            if abs(scaled - math.floor(scaled) - 0.5) <= tolerance or \
+                    math.ulp(abs(band)) * self.BOLLINGER_TOLERANCE_ULPS >= 1.0 / scale:
+                break
+        else:
+            return round(up, decimals), round(mb, decimals), round(dn, decimals)
+        bands = latest_bollinger_bands([list(window)], period, 2, [decimals])
+        return tuple(float(band[0]) for band in bands)
+
+    def rounded_values(self):
+        """
+        最新一根 K 線的指標（與 calculate_indicator_bundle 的最後幾個值相同，鍵值與 signal_rules 的特徵一致），
+        另含前一根的 MA34/MA233/MACD（_prev）、由舊到新的 MA21_history 與 close_history；尚無資料時回傳 None
+        """
+        if not self.history:
+            return None
+        latest_close = self.closes[-1]
+        decimals = self.target_decimals(latest_close)
+        volume_decimals = self.target_decimals(self.quote_volumes[-1])
+        count = len(self.history)
+
+        def price_ma(period, lag=0):
+            if lag >= count:
+                return None
+            return self._rounded_mean(self.history[count - 1 - lag][period], self.closes, period, lag, decimals)
+
+        dif = dea = macd = macd_prev = None
+        # calculate_macd 在 K 線少於 34 根（MA34 尚未形成）時全部為 None
+        rounded_macd = self.rounded_macd.get(decimals)
+        # 捨入單位相對價格極小時遞推不會收斂（見 MACD_WINDOW_RELATIVE），只能從視窗起點重新計算
+        if self.price_ma[34].value is not None and 10.0 ** -decimals < abs(latest_close) * self.MACD_WINDOW_RELATIVE:
+            dif, dea, macd, macd_prev = self._window_macd(decimals)
+        elif self.price_ma[34].value is not None and rounded_macd is not None:
+            dif, dea, macd = rounded_macd.value
+            macd_prev = rounded_macd.previous_value
+        up = mb = dn = None
+        if len(self.bollinger.values) == self.bollinger.window:
+            up, mb, dn = self._rounded_bollinger(decimals)
+        return {
+            "MA21": price_ma(21),
+            "MA21_history": [price_ma(21, lag) for lag in reversed(range(count))],
+            "MA34": price_ma(34),
+            "MA34_prev": price_ma(34, 1),
+            "MA233": price_ma(233),
+            "MA233_prev": price_ma(233, 1),
+            "VOL8": self._rounded_mean(self.volume_ma[8].value, self.quote_volumes, 8, 0, volume_decimals),
+            "VOL21": self._rounded_mean(self.volume_ma[21].value, self.quote_volumes, 21, 0, volume_decimals),
+            "DIF": dif,
+            "DEA": dea,
+            "MACD": macd,
+            "MACD_prev": macd_prev,
+            "BOLL_UP": up,
+            "BOLL_MB": mb,
+            "BOLL_DN": dn,
+            "close_history": [self.closes[i] for i in range(-min(3, len(self.closes)), 0)],
+            "previous_day_amplitude": self.day_amplitude.value
+        }
+
+    def values(self):
+        """未四捨五入的最新指標"""
+        dif, dea, macd = self.macd.value
+        up, mb, dn = self.bollinger.bollinger(2)
+        return {
+            "open_time": self.open_time,
+            "MA21": self.price_ma[21].value,
+            "MA34": self.price_ma[34].value,
+            "MA233": self.price_ma[233].value,
+            "VOL8": self.volume_ma[8].value,
+            "VOL21": self.volume_ma[21].value,
+            "DIF": dif,
+            "DEA": dea,
+            "MACD": macd,
+            "BOLL_UP": up,
+            "BOLL_MB": mb,
+            "BOLL_DN": dn,
+            "previous_day_amplitude": self.day_amplitude.value
+        }
+
+    def to_state(self):
+        return {
+            "open_time": self.open_time,
+            "price_ma": {str(period): sma.to_state() for period, sma in self.price_ma.items()},
+            "volume_ma": {str(period): sma.to_state() for period, sma in self.volume_ma.items()},
+            "macd": self.macd.to_state(),
+            "rounded_macd": {str(decimals): macd.to_state() for decimals, macd in self.rounded_macd.items()},
+            "rounded_macd_used": {str(decimals): used for decimals, used in self.rounded_macd_used.items()},
+            "bar_count": self.bar_count,
+            "bollinger": self.bollinger.to_state(),
+            "day_amplitude": self.day_amplitude.to_state(),
+            "closes": list(self.closes),
+            "quote_volumes": list(self.quote_volumes),
+            "history": [{str(period): value for period, value in snapshot.items()} for snapshot in self.history]
+        }
+
+    @classmethod
+    def from_klines(cls, klines):
+        """
+        以 K 線視窗（KlineFrame）一次建立狀態，結果與逐根 update() 相同（累計總和改以窗口重新加總），
+        不必在 Python 迴圈中逐根更新每個指標
+        """
+        indicator_state = cls()
+        if not len(klines):
+            return indicator_state
+        close, quote_volume = klines.close, klines.quote_volume
+        for sma, values in [(sma, close) for sma in indicator_state.price_ma.values()] + \
+                           [(sma, quote_volume) for sma in indicator_state.volume_ma.values()]:
+            window = values[-sma.window:].tolist()
+            sma.values = deque(window)
+            sma.total = math.fsum(window)
+
+        def seed_macd(macd, decimals=None):
+            short = exponential_moving_average(close, macd.short.period, decimals)
+            long = exponential_moving_average(close, macd.long.period, decimals)
+            dif = short - long if decimals is None else round_array(short - long, decimals)
+            signal = exponential_moving_average(dif, macd.signal.period, decimals)
+            for ema, series in ((macd.short, short), (macd.long, long), (macd.signal, signal)):
+                ema.current = float(series[-1])
+                ema.previous = float(series[-2]) if len(series) > 1 else None
+            return macd
+
+        seed_macd(indicator_state.macd)
+        # 視窗內出現過的每個價格精度各建立一組逐步四捨五入的 MACD（與批次計算相同）
+        precisions = decimal_places(close) + 2
+        indicator_state.bar_count = len(klines)
+        for decimals in np.unique(precisions):
+            indicator_state.rounded_macd[int(decimals)] = seed_macd(MACD(decimals=int(decimals)), int(decimals))
+            indicator_state.rounded_macd_used[int(decimals)] = int(np.flatnonzero(precisions == decimals)[-1]) + 1
+        bollinger = indicator_state.bollinger
+        window = close[-bollinger.window:]
+        bollinger.values = deque(window.tolist())
+        bollinger.mean = float(window.mean())
+        bollinger.m2 = float(((window - bollinger.mean) ** 2).sum())
+        indicator_state.closes.extend(close[-indicator_state.closes.maxlen:].tolist())
+        indicator_state.quote_volumes.extend(quote_volume[-indicator_state.quote_volumes.maxlen:].tolist())
+
+        # 最近 HISTORY 根的均線：以各自窗口在尾段重新加總
+        count = min(len(klines), cls.HISTORY)
+        means = {}
+        for period in cls.PRICE_PERIODS:
+            tail = rolling_sum(close[-(period + count - 1):], period) / period
+            means[period] = [None] * (count - len(tail)) + tail.tolist()
+        for i in range(count):
+            indicator_state.history.append({period: means[period][i] for period in cls.PRICE_PERIODS})
+
+        amplitude = indicator_state.day_amplitude
+        days = (klines.open_time + amplitude.utc_offset_ms) // DayAmplitude.DAY_MS
+        amplitude.day = int(days[-1])
+        amplitude.open_time = int(klines.open_time[-1])
+        amplitude.open_high, amplitude.open_low = float(klines.high[-1]), float(klines.low[-1])
+        today = days[:-1] == amplitude.day
+        if today.any():
+            amplitude.closed_high = float(klines.high[:-1][today].max())
+            amplitude.closed_low = float(klines.low[:-1][today].min())
+        earlier = days < amplitude.day
+        if earlier.any():
+            previous = days == days[earlier].max()
+            amplitude.previous_day = int(days[earlier].max())
+            amplitude.previous_high = float(klines.high[previous].max())
+            amplitude.previous_low = float(klines.low[previous].min())
+        indicator_state.open_time = int(klines.open_time[-1])
+        return indicator_state
+
+    @classmethod
+    def from_state(cls, state):
+        indicator_state = cls()
+        indicator_state.open_time = state["open_time"]
+        indicator_state.price_ma = {int(period): RollingSMA.from_state(s) for period, s in state["price_ma"].items()}
+        indicator_state.volume_ma = {int(period): RollingSMA.from_state(s) for period, s in state["volume_ma"].items()}
+        indicator_state.macd = MACD.from_state(state["macd"])
+        indicator_state.rounded_macd = {int(decimals): MACD.from_state(s) for decimals, s in state["rounded_macd"].items()}
+        indicator_state.rounded_macd_used = {int(decimals): used for decimals, used in state["rounded_macd_used"].items()}
+        indicator_state.bar_count = state["bar_count"]
+        indicator_state.bollinger = RollingVariance.from_state(state["bollinger"])
+        indicator_state.day_amplitude = DayAmplitude.from_state(state["day_amplitude"])
+        indicator_state.closes.extend(state["closes"])
+        indicator_state.quote_volumes.extend(state["quote_volumes"])
+        indicator_state.history.extend(
+            {int(period): value for period, value in snapshot.items()} for snapshot in state["history"]
+        )
+        return indicator_state
+
 def calculate_price_indicators(klines):
     """
     計算價格相關指標 (使用1小時K線)
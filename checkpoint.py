@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import time
+import numpy as np
+from calculator import IndicatorState
+from kline_frame import COLUMNS, INT_COLUMNS
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 2
+# 增量指標中可由 K 線視窗還原的滑動窗口數值不寫入 JSON，載入時從 K 線陣列取回
+WINDOW_STATES = (("price_ma", 4), ("volume_ma", 7))
+# 保存的最近收盤價/成交額（欄位名稱與索引），K 線視窗沒有涵蓋的前段仍寫入 JSON
+TAIL_STATES = (("closes", "close", 4), ("quote_volumes", "quote_volume", 7))
+
+def _compact_state(state, klines):
+    """移除指標狀態中與 K 線視窗（KlineFrame）重複的滑動窗口數值，只保留累計總和、EMA 與日振幅等純量"""
+    state = json.loads(json.dumps(state))
+    for group, _ in WINDOW_STATES:
+        for sma in state[group].values():
+            del sma["values"]
+    del state["bollinger"]["values"]
+    end = int(np.searchsorted(klines.open_time, state["open_time"], side="right"))
+    aligned = end > 0 and int(klines.open_time[end - 1]) == state["open_time"]
+    for name, column, _ in TAIL_STATES:
+        values = state[name]
+        covered = min(len(values), end) if aligned else 0
+        if covered and getattr(klines, column)[end - covered:end].tolist() != values[len(values) - covered:]:
+            covered = 0
+        state[name] = {"head": values[:len(values) - covered], "count": len(values)}
+    return state
+
+def _expand_state(state, klines):
+    """以 K 線陣列（bars × 欄位）補回滑動窗口數值並建立 IndicatorState（串流模式的 K 線可能多出未收盤的一根）"""
+    end = int(np.searchsorted(klines[:, 0], state["open_time"], side="right"))
+    if end == 0 or klines[end - 1, 0] != state["open_time"]:
+        raise ValueError("K 線視窗不包含指標狀態的最後一根 K 線")
+    klines = klines[:end]
+    for group, index in WINDOW_STATES:
+        for sma in state[group].values():
+            sma["values"] = klines[len(klines) - min(len(klines), sma["window"]):, index].tolist()
+    bollinger = state["bollinger"]
+    bollinger["values"] = klines[len(klines) - min(len(klines), bollinger["window"]):, 4].tolist()
+    for name, _, index in TAIL_STATES:
+        head, count = state[name]["head"], state[name]["count"]
+        state[name] = head + klines[len(klines) - (count - len(head)):, index].tolist()
+    return IndicatorState.from_state(state)
+
+def frame_rows(klines):
+    """將 K 線陣列（bars × 欄位，欄位順序同 KlineFrame）轉回幣安原始 K 線列表格式"""
+    int_indices = [COLUMNS.index(name) for name in INT_COLUMNS]
+    rows = []
+    for values in klines.tolist():
+        row = [int(value) if i in int_indices else value for i, value in enumerate(values)]
+        row.append("0")
+        rows.append(row)
+    return rows
+
+class Checkpoint:
+    """
+    每次執行結束時寫入的暖啟動檢查點：
+    klines.npy 為 (交易對 × K 線 × 欄位) 的 float64 陣列（較短的歷史在前面補 NaN），啟動時以記憶體映射載入；
+    checkpoint.json 保存交易對順序、各自的 K 線數量、增量指標狀態與近期訊號記錄
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.klines_path = os.path.join(directory, "klines.npy")
+        self.meta_path = os.path.join(directory, "checkpoint.json")
+
+    def save(self, klines_by_symbol, indicator_states, signal_records, interval="15m"):
+        """寫入檢查點（先寫暫存檔再取代），回傳是否成功"""
+        symbols = [symbol for symbol, klines in klines_by_symbol.items() if len(klines)]
+        length = max((len(klines_by_symbol[symbol]) for symbol in symbols), default=0)
+        array = np.full((len(symbols), length, len(COLUMNS)), np.nan)
+        for row, symbol in enumerate(symbols):
+            klines = klines_by_symbol[symbol]
+            for column, name in enumerate(COLUMNS):
+                array[row, length - len(klines):, column] = getattr(klines, name)
+        meta = {
+            "version": CHECKPOINT_VERSION,
+            "saved_at": int(time.time() * 1000),
+            "interval": interval,
+            "shape": list(array.shape),
+            "symbols": symbols,
+            "lengths": [len(klines_by_symbol[symbol]) for symbol in symbols],
+            "indicator_states": {
+                symbol: _compact_state(indicator_states[symbol].to_state(), klines_by_symbol[symbol])
+                for symbol in symbols if symbol in indicator_states
+            },
+            "signals": signal_records
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_klines_path = f"{self.klines_path}.tmp"
+            with open(tmp_klines_path, "wb") as f:
+                np.save(f, array)
+            tmp_meta_path = f"{self.meta_path}.tmp"
+            with open(tmp_meta_path, "w") as f:
+                json.dump(meta, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_klines_path, self.klines_path)
+            os.replace(tmp_meta_path, self.meta_path)
+        except Exception as e:
+            logger.error(f"寫入暖啟動檢查點 {self.directory} 失敗: {e}")
+            return False
+        logger.info(f"已寫入暖啟動檢查點：{len(symbols)} 個交易對，{array.nbytes / 1024 / 1024:.1f} MB")
+        return True
+
+    def load(self):
+        """
+        以記憶體映射載入檢查點，回傳 {"saved_at", "interval", "klines": {交易對: 陣列視圖},
+        "indicator_states": {交易對: IndicatorState}, "signals": [...]}；沒有或格式不符時回傳 None
+        """
+        if not os.path.exists(self.meta_path) or not os.path.exists(self.klines_path):
+            return None
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            array = np.load(self.klines_path, mmap_mode="r")
+            if meta.get("version") != CHECKPOINT_VERSION or list(array.shape) != meta["shape"]:
+                logger.warning(f"暖啟動檢查點 {self.directory} 版本或大小不符，略過")
+                return None
+        except Exception as e:
+            logger.warning(f"讀取暖啟動檢查點 {self.directory} 失敗: {e}")
+            return None
+
+        length = array.shape[1] if array.ndim == 3 else 0
+        klines = {
+            symbol: array[row, length - count:]
+            for row, (symbol, count) in enumerate(zip(meta["symbols"], meta["lengths"]))
+        }
+        indicator_states = {}
+        for symbol, state in meta["indicator_states"].items():
+            try:
+                indicator_states[symbol] = _expand_state(state, klines[symbol])
+            except Exception as e:
+                logger.warning(f"還原 {symbol} 的指標狀態失敗: {e}")
+        return {
+            "saved_at": meta["saved_at"],
+            "interval": meta["interval"],
+            "klines": klines,
+            "indicator_states": indicator_states,
+            "signals": meta["signals"]
+        }
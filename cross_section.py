@@ -0,0 +1,126 @@
+import logging
+import numpy as np
+from calculator import (decimal_places, exponential_moving_average_rows, latest_bollinger_bands, rolling_sum,
+                        round_array_by)
+from signal_rules import Features, evaluate_rules
+from metrics import registry as metrics
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+# 截面計算：每次掃描將所有交易對的最近 K 線堆疊為 (交易對 × K 線) 矩陣，
+# 指標與條件1-10 對整個交易對集合一次以向量運算完成，結果與逐一呼叫 check_signals 相同
+
+PRICE_COLUMNS = ("open", "high", "low", "close", "quote_volume")
+
+def stack_klines(frames, length=None):
+    """
+    將多個 KlineFrame 以最後一根 K 線對齊堆疊為 {欄位: (交易對 × K 線) 矩陣}
+    歷史較短的交易對在前面補 NaN，length 預設為最長的歷史長度
+    """
+    length = length or max((len(klines) for klines in frames), default=0)
+    matrices = {name: np.full((len(frames), length), np.nan) for name in PRICE_COLUMNS}
+    for row, klines in enumerate(frames):
+        count = min(len(klines), length)
+        if not count:
+            continue
+        for name, matrix in matrices.items():
+            matrix[row, length - count:] = getattr(klines, name)[-count:]
+    return matrices
+
+def _tail_means(values, window, count, decimals):
+    """每列最後 count 個窗口的移動平均（依時間順序），以每列的小數位數四捨五入"""
+    tail = values[:, -(window + count - 1):]
+    if tail.shape[1] < window + count - 1:
+        return np.full((values.shape[0], count), np.nan)
+    return round_array_by(rolling_sum(tail, window) / window, decimals[:, None])
+
+def latest_indicators(matrices):
+    """
+    計算每個交易對最新一根 K 線所需的指標（與 calculate_indicator_bundle 的最後幾個值相同）
+    價格類指標以最新收盤價精度的1/100、成交額均線以最新成交額精度的1/100 四捨五入
+    """
+    close = matrices["close"]
+    quote_volume = matrices["quote_volume"]
+    price_precision = decimal_places(close[:, -1]) + 2
+    volume_precision = decimal_places(quote_volume[:, -1]) + 2
+
+    # MACD 需從每個交易對的第一根 K 線開始逐步遞推，每一步同時處理所有交易對
+    short_ema = exponential_moving_average_rows(close, 21, price_precision)
+    long_ema = exponential_moving_average_rows(close, 34, price_precision)
+    dif = round_array_by(short_ema - long_ema, price_precision[:, None])
+    dea = exponential_moving_average_rows(dif, 8, price_precision)
+    macd = round_array_by(2 * (dif[:, -2:] - dea[:, -2:]), price_precision[:, None])
+    # calculate_macd 在 K 線少於 34 根時全部為 None
+    too_short = np.isnan(close[:, -34]) if close.shape[1] >= 34 else np.ones(len(close), dtype=bool)
+    macd[too_short] = np.nan
+
+    up, mb, dn = latest_bollinger_bands(close, 21, 2, price_precision)
+    ma34 = _tail_means(close, 34, 2, price_precision)
+    ma233 = _tail_means(close, 233, 2, price_precision)
+    return {
+        "price_precision": price_precision,
+        "MA21": _tail_means(close, 21, 5, price_precision),
+        "MA34": ma34[:, 1],
+        "MA34_prev": ma34[:, 0],
+        "MA233": ma233[:, 1],
+        "MA233_prev": ma233[:, 0],
+        "VOL8": _tail_means(quote_volume, 8, 1, volume_precision)[:, 0],
+        "VOL21": _tail_means(quote_volume, 21, 1, volume_precision)[:, 0],
+        "DIF": np.where(too_short, np.nan, dif[:, -1]),
+        "DEA": np.where(too_short, np.nan, dea[:, -1]),
+        "MACD": macd[:, 1],
+        "MACD_prev": macd[:, 0],
+        "BOLL_UP": up,
+        "BOLL_MB": mb,
+        "BOLL_DN": dn
+    }
+
+def signal_masks(matrices, indicators):
+    """以 signal_rules 宣告的條件1-10 計算所有交易對最新一根 K 線的布林遮罩，回傳依宣告順序排列的 {訊號類型: 遮罩}"""
+    closes = matrices["close"]
+    features = Features({name: matrices[name][:, -1] for name in PRICE_COLUMNS})
+    features.update({
+        key: indicators[key] for key in ("MA34", "MA34_prev", "MA233", "MA233_prev", "VOL21", "DIF", "DEA",
+                                         "MACD", "MACD_prev", "BOLL_UP", "BOLL_MB", "BOLL_DN")
+    })
+    features["MA21"] = indicators["MA21"][:, -1]
+    features["MA21_history"] = [indicators["MA21"][:, i] for i in range(indicators["MA21"].shape[1])]
+    features["close_history"] = [closes[:, -3], closes[:, -2], closes[:, -1]]
+    return evaluate_rules(features)
+
+def _value(array, row):
+    value = float(array[row])
+    return None if np.isnan(value) else value
+
+def evaluate_universe(klines_by_pair):
+    """
+    對 {交易對: KlineFrame} 一次計算所有交易對最新一根 K 線的條件1-10
+    回傳 {交易對: {"signal_types": [...], "MA21", "MA34", "MA34_prev", "MA233", "MA233_prev", "VOL8", "VOL21"}}
+    （均線為最新值，NaN 以 None 表示，與 calculate_indicator_bundle 的列表元素相同）
+    """
+    pairs = [pair for pair, klines in klines_by_pair.items() if len(klines)]
+    if not pairs:
+        return {}
+    with metrics.timer("indicators", len(pairs)):
+        matrices = stack_klines([klines_by_pair[pair] for pair in pairs])
+        indicators = latest_indicators(matrices)
+    with metrics.timer("rules", len(pairs)):
+        masks = signal_masks(matrices, indicators)
+
+    hits = np.column_stack(list(masks.values()))
+    signal_types = list(masks)
+    results = {}
+    for row, pair in enumerate(pairs):
+        results[pair] = {
+            "signal_types": [signal_types[i] for i in np.flatnonzero(hits[row])],
+            "MA21": _value(indicators["MA21"][:, -1], row),
+            "MA34": _value(indicators["MA34"], row),
+            "MA34_prev": _value(indicators["MA34_prev"], row),
+            "MA233": _value(indicators["MA233"], row),
+            "MA233_prev": _value(indicators["MA233_prev"], row),
+            "VOL8": _value(indicators["VOL8"], row),
+            "VOL21": _value(indicators["VOL21"], row)
+        }
+    logger.info(f"截面計算完成：{len(pairs)} 個交易對，{int(hits.any(axis=1).sum())} 個觸發條件1-10")
+    return results
@@ -0,0 +1,48 @@
+import logging
+import numpy as np
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+# 幣安 K 線欄位（依 API 回應的索引順序）
+COLUMNS = (
+    "open_time", "open", "high", "low", "close", "volume",
+    "close_time", "quote_volume", "trades", "taker_buy_volume", "taker_buy_quote_volume"
+)
+INT_COLUMNS = ("open_time", "close_time", "trades")
+
+class KlineFrame:
+    """
+    以欄位為單位保存 K 線的連續陣列（時間與筆數為 int64，其餘為 float64）
+    在抓取後只解析一次，之後所有指標與訊號計算直接使用這些陣列
+    """
+
+    __slots__ = COLUMNS
+
+    def __init__(self, **columns):
+        for name in COLUMNS:
+            dtype = np.int64 if name in INT_COLUMNS else np.float64
+            setattr(self, name, np.ascontiguousarray(columns.get(name, ()), dtype=dtype))
+
+    @classmethod
+    def from_klines(cls, klines):
+        """將幣安原始 K 線（字串列表的列表）解析為 KlineFrame"""
+        if not klines:
+            return cls.empty()
+        raw = np.array([k[:len(COLUMNS)] for k in klines], dtype=np.float64)
+        return cls(**{name: raw[:, i] for i, name in enumerate(COLUMNS)})
+
+    @classmethod
+    def empty(cls):
+        return cls()
+
+    def __len__(self):
+        return len(self.open_time)
+
+    def column(self, index):
+        """依幣安 K 線欄位索引取得對應陣列（例如 4 為收盤價、7 為成交額）"""
+        return getattr(self, COLUMNS[index])
+
+    def row(self, index):
+        """取得單根 K 線的原生 Python 數值（時間與筆數為 int，其餘為 float）"""
+        return [getattr(self, name)[index].item() for name in COLUMNS]
@@ -0,0 +1,183 @@
+import logging
+import os
+import json
+import threading
+import time
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "3m": 180_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "1h": 3_600_000,
+    "2h": 7_200_000,
+    "4h": 14_400_000,
+    "6h": 21_600_000,
+    "8h": 28_800_000,
+    "12h": 43_200_000,
+    "1d": 86_400_000
+}
+
+# 增量請求的 K 線上限（limit < 100 時請求權重為 1）
+INCREMENTAL_LIMIT = 99
+
+class KlineStore:
+    """
+    依交易對/週期保存滾動 K 線歷史的本地快取
+    每次只以 startTime 抓取最後一根已保存 K 線之後的資料，並覆蓋仍在形成中的最後一根
+    """
+
+    def __init__(self, directory, max_bars=500):
+        self.directory = directory
+        self.max_bars = max_bars
+        self._data = {}
+        self._preloaded = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _path(self, symbol, interval):
+        return os.path.join(self.directory, f"{symbol}_{interval}.json")
+
+    def _load(self, symbol, interval):
+        path = self._path(symbol, interval)
+        if not os.path.exists(path):
+            return []
+        try:
+            with open(path, 'r') as f:
+                klines = json.load(f)
+            if not isinstance(klines, list):
+                return []
+            return klines
+        except Exception as e:
+            logger.warning(f"讀取 {path} K 線快取失敗: {e}")
+            return []
+
+    def preload(self, symbol, interval, loader):
+        """
+        登記尚未載入的 K 線來源（例如記憶體映射的暖啟動檢查點），第一次 get 時才呼叫 loader() 轉為 K 線列表
+        優先於磁碟上的 JSON 快取；記憶體中已有資料時忽略
+        """
+        with self._lock:
+            if (symbol, interval) not in self._data:
+                self._preloaded[(symbol, interval)] = loader
+
+    def get(self, symbol, interval):
+        """取得快取中的 K 線（記憶體中沒有時從暖啟動檢查點或磁碟載入）"""
+        key = (symbol, interval)
+        with self._lock:
+            if key in self._data:
+                return self._data[key]
+            loader = self._preloaded.pop(key, None)
+        klines = loader() if loader else self._load(symbol, interval)
+        with self._lock:
+            return self._data.setdefault(key, klines)
+
+    def put(self, symbol, interval, klines):
+        with self._lock:
+            self._preloaded.pop((symbol, interval), None)
+            self._data[(symbol, interval)] = klines[-self.max_bars:]
+            self._dirty.add((symbol, interval))
+
+    def merge(self, symbol, interval, klines, keep_older=True):
+        """
+        依開盤時間合併 REST 抓取的 K 線並回傳合併後的列表（在鎖內完成，不會覆蓋抓取期間串流寫入的較新 K 線）：
+        同一根 K 線保留成交筆數較多（較新）的版本；keep_older=False 時捨棄早於抓取範圍的舊 K 線
+        """
+        key = (symbol, interval)
+        self.get(symbol, interval)
+        first_open_time = int(klines[0][0])
+        with self._lock:
+            merged = {
+                int(k[0]): k for k in self._data.get(key, [])
+                if keep_older or int(k[0]) >= first_open_time
+            }
+            for kline in klines:
+                current = merged.get(int(kline[0]))
+                if current is None or int(kline[8]) >= int(current[8]):
+                    merged[int(kline[0])] = kline
+            updated = [merged[open_time] for open_time in sorted(merged)][-self.max_bars:]
+            self._data[key] = updated
+            self._dirty.add(key)
+        return updated
+
+    def apply_kline(self, symbol, interval, kline):
+        """
+        套用單根即時 K 線（例如 WebSocket 推送）：開盤時間相同時覆蓋最後一根，較新時附加在最後
+        回傳 False 表示與既有資料不連續（中間有缺漏的 K 線），需要以 REST 重新補齊
+        """
+        key = (symbol, interval)
+        open_time = int(kline[0])
+        interval_ms = INTERVAL_MS.get(interval)
+        with self._lock:
+            if key not in self._data and key in self._preloaded:
+                self._data[key] = self._preloaded.pop(key)()
+            cached = self._data.get(key, [])
+            contiguous = True
+            if cached and int(cached[-1][0]) == open_time:
+                updated = cached[:-1] + [kline]
+            elif not cached or open_time > int(cached[-1][0]):
+                contiguous = bool(cached) and (interval_ms is None or open_time - int(cached[-1][0]) == interval_ms)
+                updated = cached[-(self.max_bars - 1):] + [kline]
+            else:
+                return True
+            # 以新列表取代而非原地修改，避免其他執行緒讀到一半被改動的資料
+            self._data[key] = updated
+            self._dirty.add(key)
+        return contiguous
+
+    def update(self, symbol, interval, fetch_func, limit=None):
+        """
+        更新並回傳最新的 limit 根 K 線
+        fetch_func(symbol, interval, limit, start_time) 需回傳幣安原始 K 線列表，失敗時回傳空列表
+        """
+        limit = min(limit or self.max_bars, self.max_bars)
+        cached = self.get(symbol, interval)
+        interval_ms = INTERVAL_MS.get(interval)
+
+        if cached and interval_ms:
+            last_open_time = int(cached[-1][0])
+            missing_bars = (int(time.time() * 1000) - last_open_time) // interval_ms + 1
+            if missing_bars < INCREMENTAL_LIMIT:
+                new_klines = fetch_func(symbol, interval, INCREMENTAL_LIMIT, last_open_time)
+                if not new_klines:
+                    return []
+                if len(new_klines) < INCREMENTAL_LIMIT and int(new_klines[0][0]) <= last_open_time + interval_ms:
+                    merged = self.merge(symbol, interval, new_klines)
+                    logger.debug(f"{symbol} {interval} 增量更新 {len(new_klines)} 根 K 線")
+                    return merged[-limit:]
+                logger.info(f"{symbol} {interval} 增量資料不連續，改為完整抓取")
+
+        klines = fetch_func(symbol, interval, self.max_bars, None)
+        if not klines:
+            return []
+        return self.merge(symbol, interval, klines, keep_older=False)[-limit:]
+
+    def save(self):
+        """將本次有變動的 K 線寫回磁碟"""
+        with self._lock:
+            dirty = [(key, self._data[key]) for key in self._dirty]
+            self._dirty = set()
+        if not dirty:
+            return 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except Exception as e:
+            logger.error(f"建立 K 線快取目錄 {self.directory} 失敗: {e}")
+            return 0
+        saved = 0
+        for (symbol, interval), klines in dirty:
+            path = self._path(symbol, interval)
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(klines, f, separators=(",", ":"))
+                os.replace(tmp_path, path)
+                saved += 1
+            except Exception as e:
+                logger.error(f"寫入 {path} K 線快取失敗: {e}")
+        logger.info(f"已保存 {saved} 個交易對的 K 線快取到 {self.directory}")
+        return saved
@@ -2,6 +2,8 @@ import os
 import time
 import logging
 import json
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import pytz
 import requests
@@ -9,10 +11,25 @@ import schedule
 import backoff
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-import statistics
 import math
 import decimal
+import numpy as np
 from logging.handlers import TimedRotatingFileHandler
+from scanner import scan_pairs
+from streaming import KlineStream
+from sheet_handler import BufferedSheetWriter, trim_oldest_rows
+from signal_store import SignalStore, SignalIndex
+from sheet_wal import SheetWriteLog
+from notification import TELEGRAM_API_URL, TelegramNotifier
+from kline_store import INTERVAL_MS, KlineStore
+from symbol_metadata import SymbolMetadataCache
+from kline_frame import KlineFrame
+from cross_section import evaluate_universe
+from checkpoint import Checkpoint, frame_rows
+from signal_rules import COMPILED_RETEST_RULES, evaluate_rules, retest_blockers, retest_crossing, scalar_features, triggered
+from calculator import IndicatorState, rolling_means, round_array, rounded_bollinger_bands
+from metrics import registry as metrics, start_metrics_server, summarize_report, write_report
+from binance_api import FUTURES_API_URL, EXCHANGE_INFO_WEIGHT, TICKER_24HR_WEIGHT, rate_limiter, get_klines_weight, get_session, connection_stats, response_timings
 
 # 程式版本資訊
 ARTIFACT_ID = "c89b936b-1b27-4f92-8325-b7ab87f11249"
@@ -42,11 +59,54 @@ TELEGRAM_TOKEN = '7499365215:AAFRLQfvmrVI_nIyD_5SYpuHMDkM_t0AWEk'
 TELEGRAM_CHAT_ID = '7283738727'
 SPREADSHEET_ID = "1Bny_4th50YM2mKSTZDbH7Zqd9Uhl6PHMCCveFMgqMrE"
 LOCAL_DATA_FILE = os.path.join(os.path.dirname(__file__), "failed_sheet_updates.json")
+SHEET_WAL_FILE = os.path.join(os.path.dirname(__file__), "failed_sheet_updates.jsonl")
+SHEET_REPLAY_INTERVAL = int(os.environ.get("SHEET_REPLAY_INTERVAL", "300"))
 CREDENTIALS_FILE = os.path.join(os.path.dirname(__file__), "credentials.json")
+SCAN_CONCURRENCY = int(os.environ.get("SCAN_CONCURRENCY", "10"))
+INDICATOR_CACHE_SIZE = int(os.environ.get("INDICATOR_CACHE_SIZE", "128"))
+STREAMING_MODE = os.environ.get("STREAMING_MODE", "0") == "1"
+KLINE_CACHE_DIR = os.path.join(os.path.dirname(__file__), "kline_cache")
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", os.path.join(os.path.dirname(__file__), "checkpoint"))
+# 暖啟動檢查點保存的近期訊號記錄範圍（與條件11/12 的回溯時間相同）
+CHECKPOINT_SIGNAL_HOURS = 12
+# /metrics 與 /report 服務的埠號（Cloud Run 以 PORT 指定），每次執行的耗時報告寫入 RUN_REPORT_FILE
+METRICS_PORT = int(os.environ.get("METRICS_PORT", os.environ.get("PORT", "8080")))
+RUN_REPORT_FILE = os.environ.get("RUN_REPORT_FILE", os.path.join(os.path.dirname(__file__), "run_report.json"))
+SYMBOL_METADATA_FILE = os.path.join(os.path.dirname(__file__), "symbol_metadata.json")
+SYMBOL_METADATA_TTL = int(os.environ.get("SYMBOL_METADATA_TTL", "3600"))
+SIGNAL_DB_FILE = os.path.join(os.path.dirname(__file__), "signals.db")
+SIGNAL_RETENTION_DAYS = 7
+SHEET_MAX_ROWS = 3200
+# 掃描條件：K 線數量不足或最新 K 線成交額過低的交易對不會產生訊號
+MIN_KLINE_COUNT = 234
+MIN_QUOTE_VOLUME = 10000
+RECORD_HEADERS = [
+    "交易對", "開盤時間", "開盤價", "最高價", "最低價", "收盤價",
+    "成交量", "收盤時間", "成交額", "成交筆數", "主動買入成交量", "主動買入成交額"
+]
+TRIGGER_SIGNAL_TYPES = ["長空", "長多", "空方回測續弱", "多方回測續強"]
+# 訊號資料庫 meta 表中記錄已從 15min 工作表匯入的鍵
+SHEET_IMPORTED_META = "sheet_imported_at"
+
+# K 線請求遭限速（418/429）時等待限速解除後重送的次數
+THROTTLE_RETRIES = 2
 
 # 全域變數
 run_count = 0
 new_entries = 0
+kline_store = KlineStore(KLINE_CACHE_DIR, max_bars=500)
+signal_store = SignalStore(SIGNAL_DB_FILE)
+symbol_metadata = SymbolMetadataCache(SYMBOL_METADATA_FILE, lambda: fetch_exchange_info(), ttl=SYMBOL_METADATA_TTL)
+sheet_write_log = SheetWriteLog(SHEET_WAL_FILE)
+telegram_notifier = TelegramNotifier(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID)
+indicator_cache = OrderedDict()
+checkpoint = Checkpoint(CHECKPOINT_DIR)
+indicator_states = {}
+metrics.gauge("binance_used_weight", "Last X-MBX-USED-WEIGHT-1M reported by Binance.", lambda: rate_limiter.snapshot()["used_weight"])
+metrics.gauge("binance_rate_limit_tokens", "Request weight currently available in the shared rate limiter.", lambda: rate_limiter.snapshot()["tokens"])
+metrics.gauge("http_connections_opened_total", "HTTP connections opened (requests minus this is connection reuse).", lambda: connection_stats.snapshot()["new_connections"], "counter")
+metrics.gauge("http_requests_total", "HTTP requests sent.", lambda: connection_stats.snapshot()["requests"], "counter")
+metrics.gauge("last_run_duration_seconds", "Wall time of the most recent main_task run.", lambda: metrics.last_report and metrics.last_report["elapsed_seconds"])
 
 # 載入 Google Sheet 憑證
 logger.info(f"當前工作目錄: {os.getcwd()}")
@@ -65,20 +125,22 @@ def get_precision(value):
     d = decimal.Decimal(str(value))
     return max(0, -d.as_tuple().exponent)
 
+def get_target_precision(reference_value):
+    """指標輸出的小數位數：參考值精度的1/100（每個 K 線快照只需以 Decimal 計算一次）"""
+    return get_precision(reference_value) + 2
+
 def round_to_precision(value, reference_value):
     """將數值四捨五入到參考值精度的1/100"""
     if value is None:
         return None
-    precision = get_precision(reference_value)
-    target_precision = precision + 2
-    return round(float(value), target_precision)
+    return round(float(value), get_target_precision(reference_value))
 
 def send_telegram_message(token, chat_id, message):
     """發送 Telegram 訊息"""
     try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
+        url = f"{TELEGRAM_API_URL}/bot{token}/sendMessage"
         params = {"chat_id": chat_id, "text": message}
-        response = requests.post(url, json=params)
+        response = get_session().post(url, json=params, timeout=10)
         response.raise_for_status()
         logger.info(f"Telegram 訊息發送成功: {message}")
         return True
@@ -117,24 +179,17 @@ def update_sheet(sheet_client, spreadsheet_id, sheet_name, data):
         logger.error(f"更新 Google Sheet {sheet_name} 失敗: {e}")
         return False
 
-def cleanup_old_data(sheet_client, spreadsheet_id, sheet_name, rows_to_delete):
-    """清理舊數據，保留第一列標題列，從第二列開始刪除指定行數"""
+def cleanup_old_data(sheet_writer, sheet_name, rows_to_delete):
+    """清理舊數據，保留第一列標題列，以單次範圍刪除移除第二列起的指定行數"""
     try:
-        spreadsheet = sheet_client.open_by_key(spreadsheet_id)
-        worksheet = spreadsheet.worksheet(sheet_name)
-        all_values = worksheet.get_all_values()
-        total_rows = len(all_values)
-        
-        if total_rows > 3200:
-            headers = all_values[0]
-            rows_to_keep = all_values[1:][rows_to_delete:] if rows_to_delete < total_rows - 1 else []
-            worksheet.clear()
-            worksheet.append_row(headers)
-            if rows_to_keep:
-                worksheet.append_rows(rows_to_keep)
-            logger.info(f"成功清理 {sheet_name} 舊數據，保留標題列，刪除第2~{rows_to_delete + 1}列（共 {rows_to_delete} 行），保留 {len(rows_to_keep)} 行數據")
+        stats = trim_oldest_rows(sheet_writer, sheet_name, rows_to_delete, SHEET_MAX_ROWS)
+        saved_bytes = f"{stats['saved_bytes']} 位元組" if stats["saved_bytes"] is not None else "未知位元組"
+        if stats["deleted_rows"]:
+            logger.info(f"成功清理 {sheet_name} 舊數據，保留標題列，刪除第2~{stats['deleted_rows'] + 1}列（共 {stats['deleted_rows']} 行），保留 {stats['total_rows'] - 1 - stats['deleted_rows']} 行數據")
         else:
-            logger.info(f"{sheet_name} 總行數 {total_rows} 未超過 3200，無需清理")
+            logger.info(f"{sheet_name} 總行數 {stats['total_rows']} 未超過 {SHEET_MAX_ROWS}，無需清理")
+        logger.info(f"{sheet_name} 清理使用 {stats['api_calls']} 次 API 呼叫，相較整表下載重寫節省 {stats['saved_api_calls']} 次呼叫與約 {saved_bytes}")
+        return stats
     except Exception as e:
         logger.error(f"清理 {sheet_name} 舊數據失敗: {e}")
 
@@ -163,37 +218,27 @@ def test_google_sheet_update(sheet_client, spreadsheet_id):
         logger.error("Google Sheet 更新測試失敗（test 工作表）")
     return success
 
-def clear_record_sheet(sheet_client, spreadsheet_id):
-    """清空 record 工作表，保留標題列"""
+def fetch_exchange_info():
+    """獲取 /fapi/v1/exchangeInfo 的完整內容，失敗時回傳 None"""
     try:
-        spreadsheet = sheet_client.open_by_key(spreadsheet_id)
-        worksheet = spreadsheet.worksheet("record")
-        headers = [
-            "交易對", "開盤時間", "開盤價", "最高價", "最低價", "收盤價",
-            "成交量", "收盤時間", "成交額", "成交筆數", "主動買入成交量", "主動買入成交額"
-        ]
-        worksheet.clear()
-        worksheet.append_row(headers)
-        logger.info("成功清空 record 工作表並保留標題列")
-    except gspread.exceptions.WorksheetNotFound:
-        logger.warning("record 工作表不存在，創建新工作表並添加標題列")
-        spreadsheet.add_worksheet(title="record", rows=1200, cols=20)
-        worksheet = spreadsheet.worksheet("record")
-        worksheet.append_row(headers)
+        url = f"{FUTURES_API_URL}/fapi/v1/exchangeInfo"
+        metrics.observe("rate_limit_wait", rate_limiter.acquire(EXCHANGE_INFO_WEIGHT), EXCHANGE_INFO_WEIGHT)
+        with metrics.timer("exchange_info"):
+            response = get_session().get(url, timeout=10)
+            rate_limiter.update_from_response(response)
+            response.raise_for_status()
+            return response.json()
     except Exception as e:
-        logger.error(f"清空 record 工作表時發生錯誤: {e}")
+        logger.error(f"獲取交易對資訊失敗: {e}")
+        return None
 
 def get_trading_pairs():
-    """獲取永續合約 USDT 交易對，僅保留 TRADING 狀態"""
+    """獲取永續合約 USDT 交易對，僅保留 TRADING 狀態（讀取交易對資訊快取）"""
     try:
-        url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
         usdt_pairs = [
-            symbol["symbol"]
-            for symbol in data["symbols"]
-            if symbol["symbol"].endswith("USDT") and symbol["status"] == "TRADING"
+            symbol
+            for symbol, info in symbol_metadata.symbols().items()
+            if symbol.endswith("USDT") and info["status"] == "TRADING"
         ]
         logger.info(f"獲取 {len(usdt_pairs)} 個 USDT 永續合約交易對（僅 TRADING 狀態）")
         return usdt_pairs
@@ -201,97 +246,184 @@ def get_trading_pairs():
         logger.error(f"獲取交易對失敗: {e}")
         return []
 
-def get_klines(symbol, interval="15m", limit=500):
-    """獲取 K 線數據"""
+def get_24hr_tickers():
+    """以單次請求獲取全市場合約 24 小時行情，回傳 {交易對: 行情}，失敗時回傳空字典"""
+    try:
+        url = f"{FUTURES_API_URL}/fapi/v1/ticker/24hr"
+        metrics.observe("rate_limit_wait", rate_limiter.acquire(TICKER_24HR_WEIGHT), TICKER_24HR_WEIGHT)
+        response = get_session().get(url, timeout=10)
+        rate_limiter.update_from_response(response)
+        response.raise_for_status()
+        tickers = {ticker["symbol"]: ticker for ticker in response.json()}
+        logger.info(f"獲取 {len(tickers)} 個交易對的 24 小時行情")
+        return tickers
+    except Exception as e:
+        logger.error(f"獲取 24 小時行情失敗: {e}")
+        return {}
+
+def prefilter_trading_pairs(trading_pairs, tickers, onboard_dates, now_ms, interval="15m"):
+    """
+    在抓取 K 線前剔除必定會被跳過的交易對，保留原本順序
+    24 小時成交額包含最新一根 K 線，低於 MIN_QUOTE_VOLUME 時最新 K 線的成交額也必定不足；
+    上架時間不足 MIN_KLINE_COUNT 根 K 線的交易對也無法計算 MA233
+    沒有行情或上架時間資料的交易對一律保留
+    """
+    interval_ms = INTERVAL_MS[interval]
+    candidates = []
+    illiquid = 0
+    too_new = 0
+    for trading_pair in trading_pairs:
+        ticker = tickers.get(trading_pair)
+        if ticker is not None and float(ticker.get("quoteVolume", MIN_QUOTE_VOLUME)) < MIN_QUOTE_VOLUME:
+            illiquid += 1
+            continue
+        onboard_date = onboard_dates.get(trading_pair)
+        if onboard_date is not None and (now_ms - onboard_date) // interval_ms + 1 < MIN_KLINE_COUNT:
+            too_new += 1
+            continue
+        candidates.append(trading_pair)
+    logger.info(f"預先篩選保留 {len(candidates)}/{len(trading_pairs)} 個交易對（24 小時成交額不足 {illiquid} 個，上架時間不足 {too_new} 個）")
+    return candidates
+
+def get_klines(symbol, interval="15m", limit=500, start_time=None):
+    """獲取 K 線數據，指定 start_time（毫秒）時只抓取該時間之後的 K 線"""
     try:
-        url = "https://fapi.binance.com/fapi/v1/klines"
+        url = f"{FUTURES_API_URL}/fapi/v1/klines"
         params = {"symbol": symbol, "interval": interval, "limit": limit}
         full_url = f"{url}?symbol={symbol}&interval={interval}&limit={limit}"
+        if start_time is not None:
+            params["startTime"] = start_time
+            full_url += f"&startTime={start_time}"
         logger.info(f"發送 K 線請求: {full_url}")
-        response = requests.get(url, params=params)
+        weight = get_klines_weight(limit)
+        for attempt in range(THROTTLE_RETRIES + 1):
+            metrics.observe("rate_limit_wait", rate_limiter.acquire(weight), weight)
+            start = time.perf_counter()
+            response = get_session().get(url, params=params, timeout=10)
+            for stage, seconds in response_timings(response, time.perf_counter() - start).items():
+                metrics.observe(f"kline_{stage}", seconds)
+            rate_limiter.update_from_response(response)
+            if response.status_code not in (418, 429) or attempt == THROTTLE_RETRIES:
+                break
+            # 限速器已依 Retry-After 暫停，下一次 acquire 會等到解除後再重送，避免在途的交易對被略過
+            metrics.error("kline_fetch")
+            logger.warning(f"{symbol} 的 K 線請求遭幣安限速（HTTP {response.status_code}），等待限速解除後重試（{attempt + 1}/{THROTTLE_RETRIES}）")
         response.raise_for_status()
-        klines = response.json()
+        with metrics.timer("kline_parse"):
+            klines = response.json()
         if not klines:
             logger.warning(f"獲取 {symbol} 的 {interval} K 線數據為空")
         else:
-            logger.info(f"成功獲取 {symbol} 的 {interval} K 線數據，數量: {len(klines)}")
+            logger.info(f"成功獲取 {symbol} 的 {interval} K 線數據，數量: {len(klines)}，連線/TLS 耗時: {getattr(response, 'connect_time', 0.0):.4f} 秒")
         return klines
     except requests.exceptions.HTTPError as e:
         logger.error(f"獲取 {symbol} 的 {interval} K 線數據時發生 HTTP 錯誤: {e}, 回應: {response.text}")
+        metrics.error("kline_fetch")
         return []
     except requests.exceptions.RequestException as e:
         logger.error(f"獲取 {symbol} 的 {interval} K 線數據時發生網路錯誤: {e}")
+        metrics.error("kline_fetch")
         return []
     except Exception as e:
         logger.error(f"獲取 {symbol} 的 {interval} K 線數據時發生錯誤: {e}")
+        metrics.error("kline_fetch")
         return []
 
+def calculate_moving_averages(klines, periods, index=4, target_precision=None):
+    """一次計算多個週期的移動平均（klines 為 KlineFrame，index 為幣安 K 線欄位索引），回傳 {週期: 列表}，精度限制到最新值的1/100"""
+    values = klines.column(index)
+    result = {period: [None] * len(values) for period in periods if len(values) < period}
+    valid_periods = [period for period in periods if period not in result]
+    if valid_periods:
+        if target_precision is None:
+            target_precision = get_target_precision(float(values[-1]))
+        for period, ma in rolling_means(values, valid_periods).items():
+            result[period] = [None] * (period - 1) + round_array(ma, target_precision).tolist()
+    return result
+
 def calculate_indicators(klines, period, index=4):
-    """計算移動平均，限制精度到收盤價的1/100"""
-    values = [float(k[index]) for k in klines]
-    if len(values) < period:
-        return [None] * len(values)
-    ma = []
-    reference_value = values[-1]
-    for i in range(len(values)):
-        if i < period - 1:
-            ma.append(None)
-        else:
-            avg = sum(values[i - period + 1:i + 1]) / period
-            ma.append(round_to_precision(avg, reference_value))
-    return ma
+    """計算移動平均（klines 為 KlineFrame，index 為幣安 K 線欄位索引），限制精度到收盤價的1/100"""
+    return calculate_moving_averages(klines, [period], index)[period]
 
-def calculate_macd(klines, short_period=21, long_period=34, signal_period=8):
+def calculate_macd(klines, short_period=21, long_period=34, signal_period=8, target_precision=None):
     """計算 MACD 指標，限制精度到收盤價的1/100"""
-    closes = [float(k[4]) for k in klines]
-    reference_value = closes[-1]
+    closes = klines.close.tolist()
     if len(closes) < long_period:
         return [None] * len(closes), [None] * len(closes), [None] * len(closes)
+    if target_precision is None:
+        target_precision = get_target_precision(closes[-1])
     
     def ema(data, period):
-        ema = []
+        # 每一步都以上一步四捨五入後的值遞推，無法向量化，只在迴圈中使用內建 round
         k = 2 / (period + 1)
-        for i in range(len(data)):
-            if i == 0:
-                ema.append(round_to_precision(data[i], reference_value))
-            else:
-                value = data[i] * k + ema[-1] * (1 - k)
-                ema.append(round_to_precision(value, reference_value))
+        ema = [round(data[0], target_precision)]
+        for value in data[1:]:
+            ema.append(round(value * k + ema[-1] * (1 - k), target_precision))
         return ema
     
-    short_ema = ema(closes, short_period)
-    long_ema = ema(closes, long_period)
-    dif = [round_to_precision(short_ema[i] - long_ema[i], reference_value) for i in range(len(closes))]
-    dea = ema(dif, signal_period)
-    macd = [round_to_precision(2 * (dif[i] - dea[i]), reference_value) for i in range(len(closes))]
+    short_ema = np.array(ema(closes, short_period))
+    long_ema = np.array(ema(closes, long_period))
+    dif = round_array(short_ema - long_ema, target_precision)
+    dea = np.array(ema(dif.tolist(), signal_period))
+    macd = round_array(2 * (dif - dea), target_precision)
     
-    return dif, dea, macd
+    return dif.tolist(), dea.tolist(), macd.tolist()
 
-def calculate_bollinger_bands(klines, period=21, bandwidth=2):
-    """計算布林區間，限制精度到收盤價的1/100"""
-    closes = [float(k[4]) for k in klines]
-    reference_value = closes[-1]
+def calculate_bollinger_bands(klines, period=21, bandwidth=2, target_precision=None):
+    """計算布林區間（整段序列一次完成滾動平均與標準差），限制精度到收盤價的1/100"""
+    closes = klines.close
     if len(closes) < period:
         return [None] * len(closes), [None] * len(closes), [None] * len(closes)
     
-    mb = []
-    up = []
-    dn = []
-    
-    for i in range(len(closes)):
-        if i < period - 1:
-            mb.append(None)
-            up.append(None)
-            dn.append(None)
-        else:
-            window = closes[i - period + 1:i + 1]
-            ma = sum(window) / period
-            std = statistics.stdev(window) if len(window) > 1 else 0
-            mb.append(round_to_precision(ma, reference_value))
-            up.append(round_to_precision(ma + bandwidth * std, reference_value))
-            dn.append(round_to_precision(ma - bandwidth * std, reference_value))
+    if target_precision is None:
+        target_precision = get_target_precision(float(closes[-1]))
+    padding = [None] * (period - 1)
+    up, mb, dn = rounded_bollinger_bands(closes, period, bandwidth, target_precision)
     
-    return up, mb, dn
+    return padding + up.tolist(), padding + mb.tolist(), padding + dn.tolist()
+
+def calculate_indicator_bundle(klines):
+    """一次計算單個 K 線快照所需的全部指標：MA21/34/233、VOL8/21、DIF/DEA/MACD 與布林通道"""
+    # 價格類指標共用同一個精度（收盤價精度的1/100），每個快照只解析一次
+    price_precision = get_target_precision(float(klines.close[-1])) if len(klines) else None
+    price_ma = calculate_moving_averages(klines, [21, 34, 233], target_precision=price_precision)
+    volume_ma = calculate_moving_averages(klines, [8, 21], index=7)
+    dif, dea, macd = calculate_macd(klines, target_precision=price_precision)
+    up, mb, dn = calculate_bollinger_bands(klines, target_precision=price_precision)
+    return {
+        "close": klines.close,
+        "quote_volume": klines.quote_volume,
+        "MA21": price_ma[21],
+        "MA34": price_ma[34],
+        "MA233": price_ma[233],
+        "VOL8": volume_ma[8],
+        "VOL21": volume_ma[21],
+        "DIF": dif,
+        "DEA": dea,
+        "MACD": macd,
+        "BOLL_UP": up,
+        "BOLL_MB": mb,
+        "BOLL_DN": dn
+    }
+
+def get_indicator_bundle(trading_pair, klines, interval="15m"):
+    """取得指標組合，依 (交易對, 週期, 最新開盤時間) 快取，同一 K 線快照的重複檢查不再重新計算"""
+    key = (trading_pair, interval, int(klines.open_time[-1]))
+    # 最新一根 K 線仍在形成中，開盤時間相同時以其價量確認快照未變動
+    fingerprint = (
+        len(klines), int(klines.open_time[0]), float(klines.open[-1]), float(klines.high[-1]),
+        float(klines.low[-1]), float(klines.close[-1]), float(klines.quote_volume[-1])
+    )
+    cached = indicator_cache.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        indicator_cache.move_to_end(key)
+        return cached[1]
+    with metrics.timer("indicators", 1):
+        bundle = calculate_indicator_bundle(klines)
+    indicator_cache[key] = (fingerprint, bundle)
+    while len(indicator_cache) > INDICATOR_CACHE_SIZE:
+        indicator_cache.popitem(last=False)
+    return bundle
 
 def calculate_ma233_angle(ma233, kline_open_time_ms, interval):
     """計算 MA233 的角度（度數），使用正規化處理，限制角度到小數點後2位，X軸基於時間區間"""
@@ -354,20 +486,19 @@ def calculate_previous_day_amplitude(klines, current_time):
         taipei_tz = pytz.timezone('Asia/Taipei')
         current_date = current_time.date()
         previous_day = current_date - timedelta(days=1)
+        day_start = taipei_tz.localize(datetime.combine(previous_day, datetime.min.time()))
+        day_end = taipei_tz.localize(datetime.combine(current_date, datetime.min.time()))
+        day_start_ms = int(day_start.timestamp() * 1000)
+        day_end_ms = int(day_end.timestamp() * 1000)
         
-        previous_day_klines = [
-            k for k in klines
-            if datetime.fromtimestamp(int(k[0]) / 1000, tz=pytz.UTC).astimezone(taipei_tz).date() == previous_day
-        ]
+        previous_day_mask = (klines.open_time >= day_start_ms) & (klines.open_time < day_end_ms)
         
-        if not previous_day_klines:
+        if not previous_day_mask.any():
             logger.warning("無前一日 K 線資料，無法計算振幅")
             return None
         
-        high_prices = [float(k[2]) for k in previous_day_klines]
-        low_prices = [float(k[3]) for k in previous_day_klines]
-        previous_day_high = max(high_prices)
-        previous_day_low = min(low_prices)
+        previous_day_high = float(klines.high[previous_day_mask].max())
+        previous_day_low = float(klines.low[previous_day_mask].min())
         
         if previous_day_low == 0:
             logger.error("前一日最低價為 0，無法計算振幅")
@@ -384,7 +515,7 @@ def timestamp_to_taipei(timestamp_ms):
     return datetime.fromtimestamp(timestamp_ms / 1000, tz=pytz.UTC).astimezone(pytz.timezone('Asia/Taipei')).strftime("%Y-%m-%d %H:%M:%S")
 
 def check_signals(trading_pair, price_data, volume_data, current_price, klines, interval="15m"):
-    """檢查訊號：基於成交額、K 線型態、MA34/MA233 條件及 MACD，條件2和3依賴條件1，其他條件獨立"""
+    """檢查訊號：依 signal_rules 宣告的條件1-10（條件2和3依賴條件1，其他條件獨立）判斷最新一根 K 線"""
     signals, signal_types = [], []
     taipei_time = datetime.now(pytz.timezone('Asia/Taipei'))
     ma233_angle = None
@@ -392,160 +523,113 @@ def check_signals(trading_pair, price_data, volume_data, current_price, klines,
     price_change_pct = None
     previous_day_amplitude = None
     
-    if not volume_data["quote_volume"]:
+    if len(volume_data["quote_volume"]) == 0:
         logger.warning(f"{trading_pair} 的成交額數據為空，無法檢查訊號")
         return signals, signal_types, ma233_angle, ma_angle, price_change_pct, previous_day_amplitude
     
-    current_quote_volume = float(volume_data["quote_volume"][-1])
-    vol21_current = volume_data["VOL21"][-1]
-    
-    condition_1_triggered = False
-    if vol21_current is not None and current_quote_volume > 3 * vol21_current:
-        signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 量增"
-        signals.append(signal)
-        signal_types.append("量增")
-        logger.info(f"{trading_pair}: 成交額 {current_quote_volume} > 3 * VOL21 {vol21_current}")
-        condition_1_triggered = True
-    
-    dif, dea, macd = calculate_macd(klines)
-    
-    ma21_current = price_data["MA21"][-1]
+    indicators = get_indicator_bundle(trading_pair, klines, interval)
     ma34_current = price_data["MA34"][-1]
-    ma233_current = price_data["MA233"][-1]
-    ma34_prev = price_data["MA34"][-2] if len(price_data["MA34"]) >= 2 else None
-    ma233_prev = price_data["MA233"][-2] if len(price_data["MA233"]) >= 2 else None
-    
-    open_price = float(klines[-1][1])
-    high_price = float(klines[-1][2])
-    low_price = float(klines[-1][3])
-    close_price = float(klines[-1][4])
+    close_price = float(klines.close[-1])
     
     if ma34_current is not None and ma34_current != 0:
         price_change_pct = (close_price - ma34_current) / ma34_current * 100
         price_change_pct = round(price_change_pct, 2)
     previous_day_amplitude = calculate_previous_day_amplitude(klines, taipei_time)
     
-    if condition_1_triggered:
-        min_open_close = min(open_price, close_price)
-        price_diff = abs(close_price - open_price)
-        if (min_open_close - low_price) > 2 * price_diff and \
-           ma21_current is not None and close_price > ma21_current and \
-           macd[-1] is not None and macd[-1] > 0 and \
-           dif[-1] is not None and dea[-1] is not None and dif[-1] > dea[-1] > 0:
-            ma21_last_5 = price_data["MA21"][-5:]
-            if len(ma21_last_5) == 5 and all(ma21_last_5[i] <= ma21_last_5[i + 1] for i in range(len(ma21_last_5) - 1)):
-                signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 短多"
-                signals.append(signal)
-                signal_types.append("短多")
-                logger.info(f"{trading_pair}: 短多條件觸發")
-        
-        max_open_close = max(open_price, close_price)
-        if (high_price - max_open_close) > 2 * price_diff and \
-           ma21_current is not None and close_price < ma21_current and \
-           macd[-1] is not None and macd[-1] < 0 and \
-           dif[-1] is not None and dea[-1] is not None and dif[-1] < dea[-1] < 0:
-            ma21_last_5 = price_data["MA21"][-5:]
-            if len(ma21_last_5) == 5 and all(ma21_last_5[i] >= ma21_last_5[i + 1] for i in range(len(ma21_last_5) - 1)):
-                signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 短空"
-                signals.append(signal)
-                signal_types.append("短空")
-                logger.info(f"{trading_pair}: 短空條件觸發")
-    
-    if (ma34_current is not None and ma233_current is not None and
-        ma34_prev is not None and ma233_prev is not None and
-        ma34_prev >= ma233_prev and ma34_current < ma233_current and
-        dif[-1] is not None and dea[-1] is not None and dif[-1] < dea[-1] < 0):
-        signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 長空"
-        signals.append(signal)
-        signal_types.append("長空")
-        logger.info(f"{trading_pair}: 長空條件觸發（MA34/MA233 死亡交叉）")
-        ma233_angle = calculate_ma233_angle(price_data["MA233"], klines[-1][0], interval)
-        ma_angle = calculate_ma_angle(price_data["MA34"], price_data["MA233"], klines[-1][0], interval)
-    
-    if (ma34_current is not None and ma233_current is not None and
-        ma34_prev is not None and ma233_prev is not None and
-        ma34_prev <= ma233_prev and ma34_current > ma233_current and
-        dif[-1] is not None and dea[-1] is not None and dif[-1] > dea[-1] > 0):
-        signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 長多"
-        signals.append(signal)
-        signal_types.append("長多")
-        logger.info(f"{trading_pair}: 長多條件觸發（MA34/MA233 黃金交叉）")
-        ma233_angle = calculate_ma233_angle(price_data["MA233"], klines[-1][0], interval)
-        ma_angle = calculate_ma_angle(price_data["MA34"], price_data["MA233"], klines[-1][0], interval)
+    features = scalar_features({
+        "open": float(klines.open[-1]),
+        "high": float(klines.high[-1]),
+        "low": float(klines.low[-1]),
+        "close": close_price,
+        "close_history": klines.close[-3:].tolist(),
+        "quote_volume": float(volume_data["quote_volume"][-1]),
+        "VOL21": volume_data["VOL21"][-1],
+        "MA21": price_data["MA21"][-1],
+        "MA21_history": price_data["MA21"][-5:],
+        "MA34": ma34_current,
+        "MA34_prev": price_data["MA34"][-2] if len(price_data["MA34"]) >= 2 else None,
+        "MA233": price_data["MA233"][-1],
+        "MA233_prev": price_data["MA233"][-2] if len(price_data["MA233"]) >= 2 else None,
+        "DIF": indicators["DIF"][-1],
+        "DEA": indicators["DEA"][-1],
+        "MACD": indicators["MACD"][-1],
+        "MACD_prev": indicators["MACD"][-2] if len(indicators["MACD"]) >= 2 else None,
+        "BOLL_UP": indicators["BOLL_UP"][-1],
+        "BOLL_MB": indicators["BOLL_MB"][-1],
+        "BOLL_DN": indicators["BOLL_DN"][-1]
+    })
+    with metrics.timer("rules", 1):
+        signal_types_triggered = triggered(evaluate_rules(features))
+    for signal_type in signal_types_triggered:
+        signals.append(f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: {signal_type}")
+        signal_types.append(signal_type)
+        logger.info(f"{trading_pair}: {signal_type}條件觸發")
     
-    if (dif[-1] is not None and dea[-1] is not None and macd[-1] is not None and
-        macd[-2] is not None and macd[-2] < 0 and macd[-1] > 0 and
-        0 < dif[-1]/close_price < 0.005 and
-        ma21_current is not None and close_price > ma21_current and
-        close_price > open_price and
-        all(float(klines[i][4]) <= float(klines[i+1][4]) for i in range(-3, -1))):
-        signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: MACD轉強"
-        signals.append(signal)
-        signal_types.append("MACD轉強")
-        logger.info(f"{trading_pair}: MACD 轉強條件觸發")
-    
-    if (dif[-1] is not None and dea[-1] is not None and macd[-1] is not None and
-        macd[-2] is not None and macd[-2] > 0 and macd[-1] < 0 and
-        -0.005 < dif[-1]/close_price < 0 and
-        ma21_current is not None and close_price < ma21_current and
-        close_price < open_price and
-        all(float(klines[i][4]) >= float(klines[i+1][4]) for i in range(-3, -1))):
-        signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: MACD轉弱"
-        signals.append(signal)
-        signal_types.append("MACD轉弱")
-        logger.info(f"{trading_pair}: MACD 轉弱條件觸發")
-    
-    if low_price > 0:
-        amplitude = (high_price - low_price) / low_price
-        if amplitude > 0.03:
-            signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 振幅"
-            signals.append(signal)
-            signal_types.append("振幅")
-            logger.info(f"{trading_pair}: 振幅條件觸發，振幅={amplitude:.4f}")
-    
-    up, mb, dn = calculate_bollinger_bands(klines)
-    if (dn[-1] is not None and mb[-1] is not None and
-        dn[-1] < mb[-1] * 0.86 and
-        close_price > open_price):
-        ma21_last_5 = price_data["MA21"][-5:]
-        if len(ma21_last_5) == 5 and all(ma21_last_5[i] >= ma21_last_5[i + 1] for i in range(len(ma21_last_5) - 1)):
-            signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 布林反轉向上"
-            signals.append(signal)
-            signal_types.append("布林反轉向上")
-            logger.info(f"{trading_pair}: 布林反轉向上條件觸發")
-    
-    if (up[-1] is not None and mb[-1] is not None and
-        up[-1] > mb[-1] * 1.14 and
-        close_price < open_price):
-        ma21_last_5 = price_data["MA21"][-5:]
-        if len(ma21_last_5) == 5 and all(ma21_last_5[i] <= ma21_last_5[i + 1] for i in range(len(ma21_last_5) - 1)):
-            signal = f"{taipei_time.strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 布林反轉向下"
-            signals.append(signal)
-            signal_types.append("布林反轉向下")
-            logger.info(f"{trading_pair}: 布林反轉向下條件觸發")
+    if "長空" in signal_types or "長多" in signal_types:
+        ma233_angle = calculate_ma233_angle(price_data["MA233"], int(klines.open_time[-1]), interval)
+        ma_angle = calculate_ma_angle(price_data["MA34"], price_data["MA233"], int(klines.open_time[-1]), interval)
 
     return signals, signal_types, ma233_angle, ma_angle, price_change_pct, previous_day_amplitude
 
 def save_to_local_file(data, sheet_name):
     """將未能寫入 Google Sheet 的數據保存到本地檔案"""
+    save_rows_to_local_file([data], sheet_name)
+
+def save_rows_to_local_file(rows, sheet_name):
+    """將未能寫入 Google Sheet 的多列數據附加到本地預寫日誌，待 API 恢復後由背景重播"""
     try:
-        data_entry = {
-            "timestamp": datetime.now(pytz.timezone('Asia/Taipei')).strftime("%Y-%m-%d %H:%M:%S"),
-            "sheet_name": sheet_name,
-            "data": data
-        }
-        if os.path.exists(LOCAL_DATA_FILE):
-            with open(LOCAL_DATA_FILE, 'r') as f:
-                existing_data = json.load(f)
-        else:
-            existing_data = []
-        existing_data.append(data_entry)
-        with open(LOCAL_DATA_FILE, 'w') as f:
-            json.dump(existing_data, f, indent=2)
-        logger.info(f"已將數據保存到本地檔案 {LOCAL_DATA_FILE}")
+        timestamp = datetime.now(pytz.timezone('Asia/Taipei')).strftime("%Y-%m-%d %H:%M:%S")
+        sheet_write_log.append(sheet_name, rows, timestamp=timestamp)
+        logger.info(f"已將 {len(rows)} 列數據保存到本地日誌 {SHEET_WAL_FILE}")
     except Exception as e:
         logger.error(f"保存數據到本地檔案時發生錯誤: {e}")
 
+def replay_failed_sheet_updates():
+    """將本地日誌中尚未寫入的資料列以批次 append_rows 重播到 Google Sheet"""
+    if not sheet_write_log.has_pending():
+        return 0
+    sheet_client = setup_sheet_client(GOOGLE_SHEET_CREDS_JSON)
+    if not sheet_client:
+        logger.warning("無法設置 Google Sheet 客戶端，稍後再重播本地日誌")
+        return 0
+    sheet_writer = BufferedSheetWriter(sheet_client, SPREADSHEET_ID, max_retries=1)
+
+    def append_rows(sheet_name, rows):
+        if sheet_name == "record":
+            # record 為每次執行整表覆寫的快照，過期資料不再重播
+            logger.info(f"略過 {len(rows)} 列過期的 record 快照資料")
+            return True
+        for row in rows:
+            sheet_writer.append(sheet_name, row)
+        return sheet_writer.flush(sheet_name)
+
+    def rows_in_sheet(sheet_name, rows):
+        # 上次重播在寫入後、確認前中斷的資料列：以前三欄（K 線時間、交易對、訊號）比對工作表是否已有該列，
+        # 讀回的數值欄位可能因工作表格式化而與寫入時不同，不列入比對
+        if sheet_name == "record":
+            return [True] * len(rows)
+        try:
+            values = sheet_writer.read_values(sheet_name, "A:C")
+        except gspread.exceptions.WorksheetNotFound:
+            return [False] * len(rows)
+        except Exception as e:
+            logger.error(f"讀取 Google Sheet {sheet_name} 以比對重播資料時發生錯誤: {e}")
+            return None
+        existing = {tuple(str(value) for value in row[:3]) for row in values}
+        return [tuple(str(value) for value in row[:3]) in existing for row in rows]
+
+    return sheet_write_log.replay(append_rows, exists_func=rows_in_sheet)
+
+def run_sheet_replayer(interval=SHEET_REPLAY_INTERVAL):
+    """背景執行緒：定期將本地日誌同步為磁碟並重播到 Google Sheet"""
+    while True:
+        time.sleep(interval)
+        try:
+            sheet_write_log.sync()
+            replay_failed_sheet_updates()
+        except Exception as e:
+            logger.error(f"重播本地日誌時發生錯誤: {e}")
+
 @backoff.on_exception(backoff.expo, Exception, max_tries=3, max_time=60)
 def update_sheet_with_retry(sheet_client, spreadsheet_id, sheet_name, data):
     """帶重試機制的 Google Sheet 更新"""
@@ -560,50 +644,61 @@ def update_sheet_with_retry(sheet_client, spreadsheet_id, sheet_name, data):
         save_to_local_file(data, sheet_name)
         raise
 
-def get_triggered_pairs(sheet_client, spreadsheet_id, time_window_hours=12):
-    """從Google Sheet的15min工作表獲取開盤時間在指定時間窗口內且觸發特定訊號的交易對"""
+def import_signals_from_sheet(sheet_writer):
+    """本地訊號資料庫為空時（例如首次部署），從 15min 工作表匯入既有記錄；讀取工作表失敗時回傳 None"""
     try:
-        spreadsheet = sheet_client.open_by_key(spreadsheet_id)
-        worksheet = spreadsheet.worksheet("15min")
+        worksheet = sheet_writer.worksheet("15min", create=False)
         all_values = worksheet.get_all_values()
-        if len(all_values) <= 1:
-            logger.info("15min工作表無數據，無法獲取觸發交易對")
-            return []
+    except Exception as e:
+        logger.error(f"獲取15min工作表數據失敗: {e}")
+        return None
+
+    taipei_tz = pytz.timezone('Asia/Taipei')
+    records = []
+    for row in all_values[1:]:
+        try:
+            open_time = taipei_tz.localize(datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S"))
+            records.append((row[1], int(open_time.timestamp() * 1000), row[2].split(", ")))
+        except Exception as e:
+            logger.warning(f"處理15min工作表行數據時發生錯誤: {e}")
+            continue
+    imported = signal_store.record_many(records)
+    logger.info(f"從15min工作表匯入 {imported} 筆訊號記錄到本地訊號資料庫")
+    return imported
+
+def get_triggered_pairs(sheet_writer, time_window_hours=12):
+    """從本地訊號資料庫獲取開盤時間在指定時間窗口內且觸發特定訊號的交易對"""
+    try:
+        # 工作表只在第一次匯入（即使沒有任何記錄），之後不再下載；已有記錄的資料庫視為已匯入
+        if signal_store.get_meta(SHEET_IMPORTED_META) is None:
+            if not signal_store.is_empty() or import_signals_from_sheet(sheet_writer) is not None:
+                signal_store.set_meta(SHEET_IMPORTED_META, int(time.time() * 1000))
 
-        headers = all_values[0]
-        data_rows = all_values[1:]
         taipei_tz = pytz.timezone('Asia/Taipei')
         current_time = datetime.now(taipei_tz)
         time_threshold = current_time - timedelta(hours=time_window_hours)
+        records = signal_store.query(int(time_threshold.timestamp() * 1000), TRIGGER_SIGNAL_TYPES)
 
         triggered_pairs = []
-        for row in data_rows:
-            try:
-                open_time_str = row[0]
-                open_time = datetime.strptime(open_time_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=taipei_tz)
-                if open_time < time_threshold:
-                    continue
-                trading_pair = row[1]
-                signal_types = row[2].split(", ")
-                if any(signal in ["長空", "長多", "空方回測續弱", "多方回測續強"] for signal in signal_types):
-                    triggered_pairs.append({
-                        "trading_pair": trading_pair,
-                        "open_time": open_time,
-                        "signal_types": signal_types
-                    })
-            except Exception as e:
-                logger.warning(f"處理15min工作表行數據時發生錯誤: {e}")
+        for record in records:
+            # 與工作表記錄相同，以台北時間字串（秒級）還原開盤時間
+            open_time = datetime.strptime(timestamp_to_taipei(record["open_time"]), "%Y-%m-%d %H:%M:%S").replace(tzinfo=taipei_tz)
+            if open_time < time_threshold:
                 continue
+            triggered_pairs.append({
+                "trading_pair": record["trading_pair"],
+                "open_time": open_time,
+                "signal_types": record["signal_types"]
+            })
 
-        triggered_pairs.sort(key=lambda x: x["open_time"])
         logger.info(f"篩選到 {len(triggered_pairs)} 個符合條件的交易對（開盤時間在過去 {time_window_hours} 小時內，包含長空、長多、空方回測續弱或多方回測續強）")
         return triggered_pairs
     except Exception as e:
-        logger.error(f"獲取15min工作表數據失敗: {e}")
+        logger.error(f"獲取本地訊號記錄失敗: {e}")
         return []
 
-def check_macd_conditions(trading_pair, klines, open_time, signal_types, temporary_db):
-    """檢查條件11（空方回測續弱）和條件12（多方回測續強），檢查每一筆長空或長多記錄"""
+def check_macd_conditions(trading_pair, klines, signal_index):
+    """依 signal_rules 宣告的條件11（空方回測續弱）和條件12（多方回測續強）檢查每一筆長空或長多記錄"""
     signals = []
     signal_types_out = []
     taipei_tz = pytz.timezone('Asia/Taipei')
@@ -614,238 +709,214 @@ def check_macd_conditions(trading_pair, klines, open_time, signal_types, tempora
         logger.error(f"{trading_pair}: K 線資料為空，無法進行 MACD 條件檢查")
         return signals, signal_types_out
 
-    def has_subsequent_signals(trading_pair, open_time, target_signals):
-        for record in temporary_db:
-            if (record["trading_pair"] == trading_pair and
-                record["open_time"] > open_time and
-                any(signal in target_signals for signal in record["signal_types"])):
-                return True, record
-        return False, None
-
-    # 條件11：空方回測續弱（檢查每一筆長空記錄）
-    long_short_records = [r for r in temporary_db if r["trading_pair"] == trading_pair and "長空" in r["signal_types"]]
-    if long_short_records:
-        logger.info(f"{trading_pair}: 找到 {len(long_short_records)} 筆長空記錄，開始逐一檢查條件11")
-        for record in long_short_records:
+    indicators = get_indicator_bundle(trading_pair, klines)
+    macd, ma233 = indicators["MACD"], indicators["MA233"]
+    open_time_latest = int(klines.open_time[-1])
+
+    for rule in COMPILED_RETEST_RULES:
+        record_type = rule.params["record_type"]
+        records = signal_index.records(trading_pair, record_type)
+        if not records:
+            continue
+        logger.info(f"{trading_pair}: 找到 {len(records)} 筆{record_type}記錄，開始逐一檢查{rule.name}")
+        for record in records:
             record_open_time = record["open_time"]
             record_open_time_ms = int(record_open_time.astimezone(pytz.UTC).timestamp() * 1000)
-            logger.info(f"{trading_pair}: 檢查長空記錄，開盤時間: {record_open_time}")
+            logger.info(f"{trading_pair}: 檢查{record_type}記錄，開盤時間: {record_open_time}")
             
-            has_signal, subsequent_record = has_subsequent_signals(
-                trading_pair, record_open_time, ["空方回測續弱", "長多", "長空"]
-            )
-            if has_signal:
-                logger.info(f"{trading_pair}: 找到後續觸發記錄（{subsequent_record['signal_types']} at {subsequent_record['open_time']}），跳過條件11檢查")
+            subsequent_record = signal_index.first_after(trading_pair, record_open_time, retest_blockers(rule))
+            if subsequent_record is not None:
+                logger.info(f"{trading_pair}: 找到後續觸發記錄（{subsequent_record['signal_types']} at {subsequent_record['open_time']}），跳過{rule.name}檢查")
                 continue
             
-            logger.info(f"{trading_pair}: 無後續觸發記錄，執行條件11檢查")
-            dif, dea, macd = calculate_macd(klines)
             if not macd or macd[-1] is None:
-                logger.error(f"{trading_pair}: MACD 計算結果無效（長度: {len(macd) if macd else 0}, 最新值: {macd[-1] if macd and macd[-1] is not None else None}），跳過條件11檢查，K線數量: {len(klines)}, 最新K線時間: {timestamp_to_taipei(klines[-1][0]) if klines else '無'}")
+                logger.error(f"{trading_pair}: MACD 計算結果無效（長度: {len(macd) if macd else 0}），跳過{rule.name}檢查，K線數量: {len(klines)}, 最新K線時間: {timestamp_to_taipei(open_time_latest)}")
                 continue
-            
-            logger.info(f"{trading_pair}: MACD 計算成功，數據長度: {len(macd)}, 最新值: {macd[-1]:.6f}")
-            
-            ma233 = calculate_indicators(klines, 233)
             if not ma233 or ma233[-1] is None:
-                logger.error(f"{trading_pair}: MA233 計算結果無效（長度: {len(ma233) if ma233 else 0}, 最新值: {ma233[-1] if ma233 and ma233[-1] is not None else None}），跳過條件11檢查")
+                logger.error(f"{trading_pair}: MA233 計算結果無效（長度: {len(ma233) if ma233 else 0}），跳過{rule.name}檢查")
                 continue
             
-            macd_from_open = []
-            indices_from_open = []
-            for i, k in enumerate(klines):
-                if int(k[0]) >= record_open_time_ms and macd[i] is not None:
-                    macd_from_open.append(macd[i])
-                    indices_from_open.append(i)
-            
-            if len(macd_from_open) < 2:
-                logger.error(f"{trading_pair}: 從開盤時間 {record_open_time} 起的 MACD 數據不足（數量: {len(macd_from_open)}），無法檢查條件11")
+            indices_from_open = [
+                i for i, kline_open_time in enumerate(klines.open_time)
+                if kline_open_time >= record_open_time_ms and macd[i] is not None
+            ]
+            if len(indices_from_open) < 2:
+                logger.error(f"{trading_pair}: 從開盤時間 {record_open_time} 起的 MACD 數據不足（數量: {len(indices_from_open)}），無法檢查{rule.name}")
                 continue
-            logger.info(f"{trading_pair}: 篩選到 {len(macd_from_open)} 筆從開盤時間 {record_open_time} 起的 MACD 數據")
-            
-            negative_to_positive_idx = None
-            for i in range(1, len(macd_from_open)):
-                if macd_from_open[i-1] < 0 and macd_from_open[i] > 0:
-                    negative_to_positive_idx = indices_from_open[i]
-                    logger.info(f"{trading_pair}: 找到 MACD 負值轉正值，索引: {negative_to_positive_idx}, 時間: {timestamp_to_taipei(klines[negative_to_positive_idx][0])}, MACD[{i-1}]: {macd_from_open[i-1]:.6f}, MACD[{i}]: {macd_from_open[i]:.6f}")
-                    break
             
-            if negative_to_positive_idx is None:
-                logger.info(f"{trading_pair}: 未找到 MACD 負值轉正值，條件11未觸發（開盤時間: {record_open_time}）")
+            crossing = retest_crossing([macd[i] for i in indices_from_open], rule.side)
+            if crossing is None:
+                logger.info(f"{trading_pair}: 未找到 MACD {'負值轉正值' if rule.side > 0 else '正值轉負值'}，{rule.name}未觸發（開盤時間: {record_open_time}）")
                 continue
+            logger.info(f"{trading_pair}: 找到 MACD {'負值轉正值' if rule.side > 0 else '正值轉負值'}，時間: {timestamp_to_taipei(int(klines.open_time[indices_from_open[crossing]]))}")
             
-            logger.info(f"{trading_pair}: 從索引 {negative_to_positive_idx} 開始檢查 MACD/收盤價 > 0.001 且 收盤價/MA233 > 0.96")
-            for i in range(indices_from_open.index(negative_to_positive_idx), len(macd_from_open)):
-                global_idx = indices_from_open[i]
-                try:
-                    close_price = float(klines[global_idx][4])
-                    ma233_value = ma233[global_idx]
-                    macd_value = macd[global_idx]
-                    
-                    if (macd_value is None or close_price == 0 or 
-                        ma233_value is None or ma233_value == 0):
-                        logger.debug(f"{trading_pair}: 條件11檢查索引 {global_idx} 跳過，MACD: {macd_value}, 收盤價: {close_price}, MA233: {ma233_value}")
-                        continue
-                    
-                    if macd_value < 0:
-                        price_ma233_ratio = close_price / ma233_value
-                        logger.info(f"{trading_pair}: 條件11檢查終止，MACD 再次轉負，索引: {global_idx}, 時間: {timestamp_to_taipei(klines[global_idx][0])}, MACD: {macd_value:.6f}, 收盤價: {close_price:.6f}, 收盤價/MA233: {price_ma233_ratio:.6f}")
-                        break
-                    
-                    macd_ratio = macd_value / close_price
-                    price_ma233_ratio = close_price / ma233_value
-                    open_time_current = klines[global_idx][0]
-                    open_time_latest = klines[-1][0]
-                    
-                    logger.debug(f"{trading_pair}: 條件11檢查索引 {global_idx}, MACD: {macd_value:.6f}, 收盤價: {close_price:.6f}, MA233: {ma233_value:.6f}, MACD/收盤價: {macd_ratio:.6f}, 收盤價/MA233: {price_ma233_ratio:.6f}, 開盤時間: {timestamp_to_taipei(open_time_current)}")
-                    
-                    if macd_ratio > 0.001 and price_ma233_ratio > 0.96:
-                        if open_time_current == open_time_latest:
-                            logger.info(f"{trading_pair}: 條件11觸發 - 空方回測續弱（基於長空記錄 at {record_open_time}），索引: {global_idx}, 時間: {timestamp_to_taipei(open_time_current)}, MACD: {macd_value:.6f}, MACD/收盤價: {macd_ratio:.6f}, 收盤價/MA233: {price_ma233_ratio:.6f}")
-                            signal = f"{datetime.now(taipei_tz).strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 空方回測續弱"
-                            signals.append(signal)
-                            signal_types_out.append("空方回測續弱")
-                            return signals, signal_types_out
-                        else:
-                            logger.info(f"{trading_pair}: 條件11未觸發，滿足 MACD/收盤價 > 0.001 且 收盤價/MA233 > 0.96，但開盤時間不匹配，索引: {global_idx}, 時間: {timestamp_to_taipei(open_time_current)}, MACD: {macd_value:.6f}, 收盤價: {close_price:.6f}, 收盤價/MA233: {price_ma233_ratio:.6f}")
-                except Exception as e:
-                    logger.error(f"{trading_pair}: 條件11檢查索引 {global_idx} 發生錯誤: {e}")
+            # 翻轉之後 MACD 未再反向，且最新一根 K 線滿足門檻才觸發
+            reversed_at = None
+            for global_idx in indices_from_open[crossing:]:
+                close_price = float(klines.close[global_idx])
+                if close_price == 0 or ma233[global_idx] is None or ma233[global_idx] == 0:
                     continue
-
-    # 條件12：多方回測續強（檢查每一筆長多記錄）
-    long_multi_records = [r for r in temporary_db if r["trading_pair"] == trading_pair and "長多" in r["signal_types"]]
-    if long_multi_records:
-        logger.info(f"{trading_pair}: 找到 {len(long_multi_records)} 筆長多記錄，開始逐一檢查條件12")
-        for record in long_multi_records:
-            record_open_time = record["open_time"]
-            record_open_time_ms = int(record_open_time.astimezone(pytz.UTC).timestamp() * 1000)
-            logger.info(f"{trading_pair}: 檢查長多記錄，開盤時間: {record_open_time}")
-            
-            has_signal, subsequent_record = has_subsequent_signals(
-                trading_pair, record_open_time, ["多方回測續強", "長多", "長空"]
-            )
-            if has_signal:
-                logger.info(f"{trading_pair}: 找到後續觸發記錄（{subsequent_record['signal_types']} at {subsequent_record['open_time']}），跳過條件12檢查")
-                continue
-            
-            logger.info(f"{trading_pair}: 無後續觸發記錄，執行條件12檢查")
-            dif, dea, macd = calculate_macd(klines)
-            if not macd or macd[-1] is None:
-                logger.error(f"{trading_pair}: MACD 計算結果無效（長度: {len(macd) if macd else 0}, 最新值: {macd[-1] if macd and macd[-1] is not None else None}），跳過條件12檢查，K線數量: {len(klines)}, 最新K線時間: {timestamp_to_taipei(klines[-1][0]) if klines else '無'}")
-                continue
-            logger.info(f"{trading_pair}: MACD 計算成功，數據長度: {len(macd)}, 最新值: {macd[-1]:.6f}")
-            
-            ma233 = calculate_indicators(klines, 233)
-            if not ma233 or ma233[-1] is None:
-                logger.error(f"{trading_pair}: MA233 計算結果無效（長度: {len(ma233) if ma233 else 0}, 最新值: {ma233[-1] if ma233 and ma233[-1] is not None else None}），跳過條件12檢查")
-                continue
-            
-            macd_from_open = []
-            indices_from_open = []
-            for i, k in enumerate(klines):
-                if int(k[0]) >= record_open_time_ms and macd[i] is not None:
-                    macd_from_open.append(macd[i])
-                    indices_from_open.append(i)
-            
-            if len(macd_from_open) < 2:
-                logger.error(f"{trading_pair}: 從開盤時間 {record_open_time} 起的 MACD 數據不足（數量: {len(macd_from_open)}），無法檢查條件12")
-                continue
-            logger.info(f"{trading_pair}: 篩選到 {len(macd_from_open)} 筆從開盤時間 {record_open_time} 起的 MACD 數據")
-            
-            positive_to_negative_idx = None
-            for i in range(1, len(macd_from_open)):
-                if macd_from_open[i-1] > 0 and macd_from_open[i] < 0:
-                    positive_to_negative_idx = indices_from_open[i]
-                    logger.info(f"{trading_pair}: 找到 MACD 正值轉負值，索引: {positive_to_negative_idx}, 時間: {timestamp_to_taipei(klines[positive_to_negative_idx][0])}, MACD[{i-1}]: {macd_from_open[i-1]:.6f}, MACD[{i}]: {macd_from_open[i]:.6f}")
+                if (macd[global_idx] < 0) if rule.side > 0 else (macd[global_idx] > 0):
+                    reversed_at = global_idx
                     break
-            
-            if positive_to_negative_idx is None:
-                logger.info(f"{trading_pair}: 未找到 MACD 正值轉負值，條件12未觸發（開盤時間: {record_open_time}）")
+            if reversed_at is not None:
+                logger.info(f"{trading_pair}: {rule.name}檢查終止，MACD 再次反向，時間: {timestamp_to_taipei(int(klines.open_time[reversed_at]))}, MACD: {macd[reversed_at]:.6f}")
                 continue
             
-            logger.info(f"{trading_pair}: 從索引 {positive_to_negative_idx} 開始檢查 MACD/收盤價 < -0.001 且 收盤價/MA233 < 1.04")
-            for i in range(indices_from_open.index(positive_to_negative_idx), len(macd_from_open)):
-                global_idx = indices_from_open[i]
-                try:
-                    close_price = float(klines[global_idx][4])
-                    ma233_value = ma233[global_idx]
-                    macd_value = macd[global_idx]
-                    
-                    if (macd_value is None or close_price == 0 or 
-                        ma233_value is None or ma233_value == 0):
-                        logger.debug(f"{trading_pair}: 條件12檢查索引 {global_idx} 跳過，MACD: {macd_value}, 收盤價: {close_price}, MA233: {ma233_value}")
-                        continue
-                    
-                    if macd_value > 0:
-                        price_ma233_ratio = close_price / ma233_value
-                        logger.info(f"{trading_pair}: 條件12檢查終止，MACD 再次轉正，索引: {global_idx}, 時間: {timestamp_to_taipei(klines[global_idx][0])}, MACD: {macd_value:.6f}, 收盤價: {close_price:.6f}, 收盤價/MA233: {price_ma233_ratio:.6f}")
-                        break
-                    
-                    macd_ratio = macd_value / close_price
-                    price_ma233_ratio = close_price / ma233_value
-                    open_time_current = klines[global_idx][0]
-                    open_time_latest = klines[-1][0]
-                    
-                    logger.debug(f"{trading_pair}: 條件12檢查索引 {global_idx}, MACD: {macd_value:.6f}, 收盤價: {close_price:.6f}, MA233: {ma233_value:.6f}, MACD/收盤價: {macd_ratio:.6f}, 收盤價/MA233: {price_ma233_ratio:.6f}, 開盤時間: {timestamp_to_taipei(open_time_current)}")
-                    
-                    if macd_ratio < -0.001 and price_ma233_ratio < 1.04:
-                        if open_time_current == open_time_latest:
-                            logger.info(f"{trading_pair}: 條件12觸發 - 多方回測續強（基於長多記錄 at {record_open_time}），索引: {global_idx}, 時間: {timestamp_to_taipei(open_time_current)}, MACD: {macd_value:.6f}, MACD/收盤價: {macd_ratio:.6f}, 收盤價/MA233: {price_ma233_ratio:.6f}")
-                            signal = f"{datetime.now(taipei_tz).strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: 多方回測續強"
-                            signals.append(signal)
-                            signal_types_out.append("多方回測續強")
-                            return signals, signal_types_out
-                        else:
-                            logger.info(f"{trading_pair}: 條件12未觸發，滿足 MACD/收盤價 < -0.001 且 收盤價/MA233 < 1.04，但開盤時間不匹配，索引: {global_idx}, 時間: {timestamp_to_taipei(open_time_current)}, MACD: {macd_value:.6f}, 收盤價: {close_price:.6f}, 收盤價/MA233: {price_ma233_ratio:.6f}")
-                except Exception as e:
-                    logger.error(f"{trading_pair}: 條件12檢查索引 {global_idx} 發生錯誤: {e}")
-                    continue
+            close_price = float(klines.close[-1])
+            if close_price == 0 or ma233[-1] == 0:
+                continue
+            features = scalar_features({"close": close_price, "MACD": macd[-1], "MA233": ma233[-1]})
+            if rule.evaluate(features)[0]:
+                logger.info(f"{trading_pair}: {rule.name}觸發（基於{record_type}記錄 at {record_open_time}），時間: {timestamp_to_taipei(open_time_latest)}, MACD: {macd[-1]:.6f}, MACD/收盤價: {macd[-1] / close_price:.6f}, 收盤價/MA233: {close_price / ma233[-1]:.6f}")
+                signal = f"{datetime.now(taipei_tz).strftime('%Y-%m-%d %H:%M:%S')} - {trading_pair}: {rule.name}"
+                signals.append(signal)
+                signal_types_out.append(rule.name)
+                return signals, signal_types_out
+            logger.info(f"{trading_pair}: {rule.name}未觸發，最新一根 K 線未滿足門檻（基於{record_type}記錄 at {record_open_time}）")
 
     return signals, signal_types_out
 
-def process_trading_pair(trading_pair, sheet_client):
-    """處理單個交易對（條件1-10）"""
+def get_cached_klines(symbol, interval="15m", limit=500):
+    """經由本地 K 線快取獲取 K 線，只抓取上次保存之後的新 K 線"""
+    return kline_store.update(symbol, interval, get_klines, limit)
+
+def sync_indicator_state(trading_pair, klines):
+    """以 K 線更新交易對的增量指標狀態（只套用狀態最後一根之後的 K 線），回傳狀態"""
+    state = indicator_states.get(trading_pair)
+    if state is None or state.open_time is None or not int(klines.open_time[0]) <= state.open_time <= int(klines.open_time[-1]):
+        # 新交易對或狀態與 K 線視窗之間有缺口時，以目前的視窗一次重新建立
+        state = indicator_states[trading_pair] = IndicatorState.from_klines(klines)
+        return state
+    for index in range(int(np.searchsorted(klines.open_time, state.open_time)), len(klines)):
+        state.update(klines.row(index))
+    return state
+
+def evaluate_indicator_state(state, klines):
+    """以增量指標狀態判斷最新一根 K 線的條件1-10，回傳與 evaluate_universe 相同格式的結果"""
+    values = state.rounded_values()
+    features = scalar_features({
+        "open": float(klines.open[-1]),
+        "high": float(klines.high[-1]),
+        "low": float(klines.low[-1]),
+        "close": float(klines.close[-1]),
+        "quote_volume": float(klines.quote_volume[-1]),
+        **{key: value for key, value in values.items() if key != "previous_day_amplitude"}
+    })
+    with metrics.timer("rules", 1):
+        signal_types = triggered(evaluate_rules(features))
+    return {
+        "signal_types": signal_types,
+        **{key: values[key] for key in ("MA21", "MA34", "MA34_prev", "MA233", "MA233_prev", "VOL8", "VOL21")}
+    }
+
+def save_checkpoint(klines_by_pair):
+    """寫入暖啟動檢查點：K 線、近期訊號與串流模式維護的增量指標狀態"""
+    since_ms = int((time.time() - CHECKPOINT_SIGNAL_HOURS * 3600) * 1000)
+    return checkpoint.save(klines_by_pair, indicator_states, signal_store.query(since_ms, TRIGGER_SIGNAL_TYPES), "15m")
+
+def restore_checkpoint():
+    """
+    啟動時以記憶體映射載入暖啟動檢查點：K 線交給 K 線快取（之後只抓取缺少的 K 線）、還原近期訊號，
+    指標狀態供串流模式接續更新（重啟後第一根收盤的 K 線只需套用缺少的幾根）
+    """
+    data = checkpoint.load()
+    if data is None:
+        logger.info("沒有可用的暖啟動檢查點，第一次掃描將完整抓取 K 線")
+        return False
+    for trading_pair, klines in data["klines"].items():
+        kline_store.preload(trading_pair, data["interval"], lambda klines=klines: frame_rows(klines))
+    indicator_states.update(data["indicator_states"])
+    if data["signals"] and signal_store.is_empty():
+        signal_store.record_many([
+            (record["trading_pair"], record["open_time"], record["signal_types"]) for record in data["signals"]
+        ])
+        # 檢查點的訊號來自已匯入工作表的資料庫，不必再下載工作表
+        signal_store.set_meta(SHEET_IMPORTED_META, data["saved_at"])
+    logger.info(f"已載入暖啟動檢查點（{timestamp_to_taipei(data['saved_at'])}）：{len(data['klines'])} 個交易對，{len(data['signals'])} 筆近期訊號")
+    return True
+
+def fetch_trading_pair_klines(trading_pair):
+    """抓取單個交易對掃描所需的 15m K 線並解析為 KlineFrame（供並行掃描使用）"""
+    with metrics.timer("kline_fetch", 1):
+        return KlineFrame.from_klines(get_cached_klines(trading_pair, "15m", 500))
+
+def describe_scan_signals(klines, latest, signal_types, interval="15m"):
+    """依截面計算的最新指標值補齊訊號列的附加欄位（與 check_signals 回傳的角度、價差比與前日振幅相同）"""
+    ma233_angle = None
+    ma_angle = None
+    price_change_pct = None
+    if latest["MA34"] is not None and latest["MA34"] != 0:
+        price_change_pct = round((float(klines.close[-1]) - latest["MA34"]) / latest["MA34"] * 100, 2)
+    previous_day_amplitude = calculate_previous_day_amplitude(klines, datetime.now(pytz.timezone('Asia/Taipei')))
+    if "長空" in signal_types or "長多" in signal_types:
+        ma34 = [latest["MA34_prev"], latest["MA34"]]
+        ma233 = [latest["MA233_prev"], latest["MA233"]]
+        ma233_angle = calculate_ma233_angle(ma233, int(klines.open_time[-1]), interval)
+        ma_angle = calculate_ma_angle(ma34, ma233, int(klines.open_time[-1]), interval)
+    return ma233_angle, ma_angle, price_change_pct, previous_day_amplitude
+
+def process_trading_pair(trading_pair, sheet_writer, klines_15m=None, write_record=True, evaluation=None):
+    """處理單個交易對（條件1-10），若未提供 K 線則自行抓取；evaluation 為截面計算的結果時直接使用，不再逐一計算指標"""
     global new_entries
     logger.info(f"開始處理交易對: {trading_pair}")
-    klines_15m = get_klines(trading_pair, "15m", 500)
+    if klines_15m is None:
+        klines_15m = fetch_trading_pair_klines(trading_pair)
     
     if not klines_15m:
         logger.warning(f"無法獲取 {trading_pair} 的 15m K 線數據，跳過此交易對")
         return
     
-    if len(klines_15m) < 234:
-        logger.info(f"{trading_pair} 的 K 線數量 {len(klines_15m)} < 234，跳過此交易對")
-        return
-    
-    current_quote_volume = float(klines_15m[-1][7])
-    if current_quote_volume < 10000:
-        logger.info(f"{trading_pair} 的成交額 {current_quote_volume} < 10000，跳過此交易對")
+    if len(klines_15m) < MIN_KLINE_COUNT:
+        logger.info(f"{trading_pair} 的 K 線數量 {len(klines_15m)} < {MIN_KLINE_COUNT}，跳過此交易對")
         return
     
-    price_indicators_15m = {
-        "close": [float(k[4]) for k in klines_15m],
-        "MA21": calculate_indicators(klines_15m, 21),
-        "MA34": calculate_indicators(klines_15m, 34),
-        "MA233": calculate_indicators(klines_15m, 233)
-    }
-    volume_indicators_15m = {
-        "quote_volume": [float(k[7]) for k in klines_15m],
-        "VOL8": calculate_indicators(klines_15m, 8, index=7),
-        "VOL21": calculate_indicators(klines_15m, 21, index=7)
-    }
-    
-    if not volume_indicators_15m["quote_volume"]:
-        logger.warning(f"{trading_pair} 的成交額數據為空，跳過此交易對")
+    current_quote_volume = float(klines_15m.quote_volume[-1])
+    if current_quote_volume < MIN_QUOTE_VOLUME:
+        logger.info(f"{trading_pair} 的成交額 {current_quote_volume} < {MIN_QUOTE_VOLUME}，跳過此交易對")
         return
     
-    current_price_15m = float(klines_15m[-1][4])
+    current_price_15m = float(klines_15m.close[-1])
     
-    signals, signal_types, ma233_angle, ma_angle, price_change_pct, previous_day_amplitude = check_signals(
-        trading_pair, price_indicators_15m, volume_indicators_15m, current_price_15m, klines_15m, interval="15m"
-    )
+    if evaluation is None:
+        indicators_15m = get_indicator_bundle(trading_pair, klines_15m, "15m")
+        price_indicators_15m = {
+            "close": indicators_15m["close"],
+            "MA21": indicators_15m["MA21"],
+            "MA34": indicators_15m["MA34"],
+            "MA233": indicators_15m["MA233"]
+        }
+        volume_indicators_15m = {
+            "quote_volume": indicators_15m["quote_volume"],
+            "VOL8": indicators_15m["VOL8"],
+            "VOL21": indicators_15m["VOL21"]
+        }
+        
+        if len(volume_indicators_15m["quote_volume"]) == 0:
+            logger.warning(f"{trading_pair} 的成交額數據為空，跳過此交易對")
+            return
+        
+        signals, signal_types, ma233_angle, ma_angle, price_change_pct, previous_day_amplitude = check_signals(
+            trading_pair, price_indicators_15m, volume_indicators_15m, current_price_15m, klines_15m, interval="15m"
+        )
+        latest = {
+            "MA21": price_indicators_15m["MA21"][-1],
+            "MA34": price_indicators_15m["MA34"][-1],
+            "MA34_prev": price_indicators_15m["MA34"][-2] if len(price_indicators_15m["MA34"]) >= 2 else None,
+            "MA233": price_indicators_15m["MA233"][-1],
+            "MA233_prev": price_indicators_15m["MA233"][-2] if len(price_indicators_15m["MA233"]) >= 2 else None,
+            "VOL8": volume_indicators_15m["VOL8"][-1],
+            "VOL21": volume_indicators_15m["VOL21"][-1]
+        }
+    else:
+        latest = evaluation
+        signal_types = evaluation["signal_types"]
+        if signal_types:
+            logger.info(f"{trading_pair}: 截面計算觸發 {', '.join(signal_types)}")
+            ma233_angle, ma_angle, price_change_pct, previous_day_amplitude = describe_scan_signals(klines_15m, latest, signal_types)
     
     if signal_types:
-        open_time_15m = timestamp_to_taipei(klines_15m[-1][0])
+        open_time_15m = timestamp_to_taipei(int(klines_15m.open_time[-1]))
         if not ("長空" in signal_types or "長多" in signal_types):
             ma233_angle = ""
             ma_angle = ""
@@ -854,20 +925,21 @@ def process_trading_pair(trading_pair, sheet_client):
             trading_pair,
             ", ".join(signal_types),
             current_price_15m,
-            price_indicators_15m["MA21"][-1],
-            price_indicators_15m["MA34"][-1],
-            price_indicators_15m["MA233"][-1],
-            volume_indicators_15m["quote_volume"][-1],
-            volume_indicators_15m["VOL8"][-1],
-            volume_indicators_15m["VOL21"][-1],
+            latest["MA21"],
+            latest["MA34"],
+            latest["MA233"],
+            current_quote_volume,
+            latest["VOL8"],
+            latest["VOL21"],
             ma233_angle if ma233_angle is not None else "",
             ma_angle if ma_angle is not None else "",
             price_change_pct if price_change_pct is not None else "",
             previous_day_amplitude if previous_day_amplitude is not None else "",
-            price_indicators_15m["MA34"][-2] if len(price_indicators_15m["MA34"]) >= 2 and price_indicators_15m["MA34"][-2] is not None else "",
-            price_indicators_15m["MA233"][-2] if len(price_indicators_15m["MA233"]) >= 2 and price_indicators_15m["MA233"][-2] is not None else ""
+            latest["MA34_prev"] if latest["MA34_prev"] is not None else "",
+            latest["MA233_prev"] if latest["MA233_prev"] is not None else ""
         ]
-        update_sheet_with_retry(sheet_client, SPREADSHEET_ID, "15min", row_data_15m)
+        sheet_writer.append("15min", row_data_15m)
+        signal_store.record(trading_pair, int(klines_15m.open_time[-1]), signal_types)
         new_entries += 1
         
         signal_message = f"{open_time_15m} - {trading_pair}: {', '.join(signal_types)}"
@@ -878,24 +950,81 @@ def process_trading_pair(trading_pair, sheet_client):
             signal_message += f"\n價差比: {price_change_pct}%"
         if previous_day_amplitude is not None:
             signal_message += f"\n前日振幅: {previous_day_amplitude}%"
-        send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, signal_message)
+        telegram_notifier.add(signal_message)
     
-    latest_kline = klines_15m[-1]
+    if not write_record:
+        return
+    
+    latest_kline = klines_15m.row(-1)
     row_data_record = [
         trading_pair,
         timestamp_to_taipei(latest_kline[0]),
-        float(latest_kline[1]),
-        float(latest_kline[2]),
-        float(latest_kline[3]),
-        float(latest_kline[4]),
-        float(latest_kline[5]),
+        latest_kline[1],
+        latest_kline[2],
+        latest_kline[3],
+        latest_kline[4],
+        latest_kline[5],
         timestamp_to_taipei(latest_kline[6]),
-        float(latest_kline[7]),
+        latest_kline[7],
         latest_kline[8],
-        float(latest_kline[9]),
-        float(latest_kline[10])
+        latest_kline[9],
+        latest_kline[10]
     ]
-    update_sheet_with_retry(sheet_client, SPREADSHEET_ID, "record", row_data_record)
+    sheet_writer.append("record", row_data_record)
+
+def process_retest_pair(trading_pair, klines_15m, signal_index, sheet_writer):
+    """檢查單個交易對的條件11和12，觸發時寫入 15min 工作表、訊號資料庫並加入 Telegram 通知"""
+    global new_entries
+    with metrics.timer("rules", 1):
+        signals, macd_signal_types = check_macd_conditions(trading_pair, klines_15m, signal_index)
+    if macd_signal_types:
+        current_price_15m = float(klines_15m.close[-1])
+        indicators_15m = get_indicator_bundle(trading_pair, klines_15m, "15m")
+        price_indicators_15m = {
+            "MA21": indicators_15m["MA21"],
+            "MA34": indicators_15m["MA34"],
+            "MA233": indicators_15m["MA233"]
+        }
+        volume_indicators_15m = {
+            "quote_volume": indicators_15m["quote_volume"],
+            "VOL8": indicators_15m["VOL8"],
+            "VOL21": indicators_15m["VOL21"]
+        }
+        taipei_time = datetime.now(pytz.timezone('Asia/Taipei'))
+        price_change_pct = None
+        if price_indicators_15m["MA34"][-1] is not None and price_indicators_15m["MA34"][-1] != 0:
+            price_change_pct = (current_price_15m - price_indicators_15m["MA34"][-1]) / price_indicators_15m["MA34"][-1] * 100
+            price_change_pct = round(price_change_pct, 2)
+        previous_day_amplitude = calculate_previous_day_amplitude(klines_15m, taipei_time)
+        
+        open_time_15m = timestamp_to_taipei(int(klines_15m.open_time[-1]))
+        row_data_15m = [
+            open_time_15m,
+            trading_pair,
+            ", ".join(macd_signal_types),
+            current_price_15m,
+            price_indicators_15m["MA21"][-1],
+            price_indicators_15m["MA34"][-1],
+            price_indicators_15m["MA233"][-1],
+            float(volume_indicators_15m["quote_volume"][-1]),
+            volume_indicators_15m["VOL8"][-1],
+            volume_indicators_15m["VOL21"][-1],
+            "", "",
+            price_change_pct if price_change_pct is not None else "",
+            previous_day_amplitude if previous_day_amplitude is not None else "",
+            price_indicators_15m["MA34"][-2] if len(price_indicators_15m["MA34"]) >= 2 and price_indicators_15m["MA34"][-2] is not None else "",
+            price_indicators_15m["MA233"][-2] if len(price_indicators_15m["MA233"]) >= 2 and price_indicators_15m["MA233"][-2] is not None else ""
+        ]
+        sheet_writer.append("15min", row_data_15m)
+        signal_store.record(trading_pair, int(klines_15m.open_time[-1]), macd_signal_types)
+        new_entries += 1
+        
+        signal_message = f"{open_time_15m} - {trading_pair}: {', '.join(macd_signal_types)}"
+        if price_change_pct is not None:
+            signal_message += f"\n價差比: {price_change_pct}%"
+        if previous_day_amplitude is not None:
+            signal_message += f"\n前日振幅: {previous_day_amplitude}%"
+        telegram_notifier.add(signal_message)
 
 def main_task():
     """主要任務"""
@@ -903,130 +1032,188 @@ def main_task():
     run_count += 1
     new_entries = 0
     start_time = datetime.now(pytz.timezone('Asia/Taipei'))
+    metrics.begin_run(run_count)
     logger.info(f"開始執行 main_task (Run {run_count}, artifact_id: {ARTIFACT_ID}, version: {ARTIFACT_VERSION}): {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     run_message = f"Run {run_count} started at {start_time.strftime('%Y-%m-%d %H:%M:%S')} (artifact_id: {ARTIFACT_ID}, version: {ARTIFACT_VERSION})"
-    send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, run_message)
+    telegram_notifier.notify(run_message)
     
     sheet_client = setup_sheet_client(GOOGLE_SHEET_CREDS_JSON)
     if not sheet_client:
         logger.error("無法設置 Google Sheet 客戶端，任務終止")
+        write_report(metrics.end_run({"error": "無法設置 Google Sheet 客戶端"}), RUN_REPORT_FILE)
         return
+    sheet_writer = BufferedSheetWriter(sheet_client, SPREADSHEET_ID, fallback=save_rows_to_local_file)
     
-    clear_record_sheet(sheet_client, SPREADSHEET_ID)
+    # record 工作表在掃描結束後以單次更新整表覆寫，執行期間保留上一次的完整快照
+    sheet_writer.snapshot("record", RECORD_HEADERS)
     
     logger.info("開始檢查條件11和12（空方回測續弱和多方回測續強）")
-    temporary_db = get_triggered_pairs(sheet_client, SPREADSHEET_ID)
-    logger.info(f"臨時資料庫篩選到 {len(temporary_db)} 筆記錄")
+    signal_index = SignalIndex(get_triggered_pairs(sheet_writer))
+    logger.info(f"臨時資料庫篩選到 {len(signal_index)} 筆記錄，共 {len(signal_index.pairs())} 個交易對")
     
-    for pair_info in temporary_db:
-        trading_pair = pair_info["trading_pair"]
-        open_time = pair_info["open_time"]
-        signal_types = pair_info["signal_types"]
-        logger.info(f"檢查交易對 {trading_pair} 的MACD條件，開盤時間: {open_time}, 訊號類型: {signal_types}")
-        klines_15m = get_klines(trading_pair, "15m", 500)
+    # 本次已抓取的 K 線，後續掃描同一交易對時直接重用
+    fetched_klines = {}
+    for trading_pair in signal_index.pairs():
+        logger.info(f"檢查交易對 {trading_pair} 的MACD條件，共 {len(signal_index.records(trading_pair))} 筆記錄")
+        klines_15m = fetch_trading_pair_klines(trading_pair)
         if not klines_15m:
             logger.warning(f"無法獲取 {trading_pair} 的 15m K 線數據，跳過MACD條件檢查")
             continue
+        fetched_klines[trading_pair] = klines_15m
         
-        signals, macd_signal_types = check_macd_conditions(trading_pair, klines_15m, open_time, signal_types, temporary_db)
-        if macd_signal_types:
-            current_price_15m = float(klines_15m[-1][4])
-            price_indicators_15m = {
-                "MA21": calculate_indicators(klines_15m, 21),
-                "MA34": calculate_indicators(klines_15m, 34),
-                "MA233": calculate_indicators(klines_15m, 233)
-            }
-            volume_indicators_15m = {
-                "quote_volume": [float(k[7]) for k in klines_15m],
-                "VOL8": calculate_indicators(klines_15m, 8, index=7),
-                "VOL21": calculate_indicators(klines_15m, 21, index=7)
-            }
-            taipei_time = datetime.now(pytz.timezone('Asia/Taipei'))
-            price_change_pct = None
-            if price_indicators_15m["MA34"][-1] is not None and price_indicators_15m["MA34"][-1] != 0:
-                price_change_pct = (current_price_15m - price_indicators_15m["MA34"][-1]) / price_indicators_15m["MA34"][-1] * 100
-                price_change_pct = round(price_change_pct, 2)
-            previous_day_amplitude = calculate_previous_day_amplitude(klines_15m, taipei_time)
-            
-            open_time_15m = timestamp_to_taipei(klines_15m[-1][0])
-            row_data_15m = [
-                open_time_15m,
-                trading_pair,
-                ", ".join(macd_signal_types),
-                current_price_15m,
-                price_indicators_15m["MA21"][-1],
-                price_indicators_15m["MA34"][-1],
-                price_indicators_15m["MA233"][-1],
-                volume_indicators_15m["quote_volume"][-1],
-                volume_indicators_15m["VOL8"][-1],
-                volume_indicators_15m["VOL21"][-1],
-                "", "",
-                price_change_pct if price_change_pct is not None else "",
-                previous_day_amplitude if previous_day_amplitude is not None else "",
-                price_indicators_15m["MA34"][-2] if len(price_indicators_15m["MA34"]) >= 2 and price_indicators_15m["MA34"][-2] is not None else "",
-                price_indicators_15m["MA233"][-2] if len(price_indicators_15m["MA233"]) >= 2 and price_indicators_15m["MA233"][-2] is not None else ""
-            ]
-            update_sheet_with_retry(sheet_client, SPREADSHEET_ID, "15min", row_data_15m)
-            new_entries += 1
-            
-            signal_message = f"{open_time_15m} - {trading_pair}: {', '.join(macd_signal_types)}"
-            if price_change_pct is not None:
-                signal_message += f"\n價差比: {price_change_pct}%"
-            if previous_day_amplitude is not None:
-                signal_message += f"\n前日振幅: {previous_day_amplitude}%"
-            send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, signal_message)
-        
-        logger.info(f"完成交易對 {trading_pair} 的 MACD 檢查，等待 0.5 秒")
-        time.sleep(0.5)
+        process_retest_pair(trading_pair, klines_15m, signal_index, sheet_writer)
+        logger.info(f"完成交易對 {trading_pair} 的 MACD 檢查")
     
     trading_pairs = get_trading_pairs()
+    trading_pairs = prefilter_trading_pairs(trading_pairs, get_24hr_tickers(), symbol_metadata.onboard_dates(), int(time.time() * 1000))
     total_pairs = len(trading_pairs)
-    logger.info(f"開始處理 {total_pairs} 個交易對，預估耗時 {total_pairs * 2 // 60} 分鐘")
+    logger.info(f"開始處理 {total_pairs} 個交易對，並行上限 {SCAN_CONCURRENCY}")
+    
+    # 先並行抓取所有交易對的 K 線，再以截面計算一次檢查整個交易對集合的條件1-10
+    scanned_klines = {}
+    scan_pairs(
+        trading_pairs,
+        lambda trading_pair: fetched_klines.pop(trading_pair, None) or fetch_trading_pair_klines(trading_pair),
+        scanned_klines.__setitem__,
+        max_workers=SCAN_CONCURRENCY
+    )
+    evaluations = {}
+    try:
+        evaluations = evaluate_universe({
+            trading_pair: klines_15m for trading_pair, klines_15m in scanned_klines.items()
+            if klines_15m and len(klines_15m) >= MIN_KLINE_COUNT
+        })
+    except Exception as e:
+        logger.error(f"截面計算失敗，改為逐一檢查交易對: {e}")
+    for trading_pair, klines_15m in scanned_klines.items():
+        try:
+            process_trading_pair(trading_pair, sheet_writer, klines_15m, evaluation=evaluations.get(trading_pair))
+        except Exception as e:
+            logger.error(f"處理 {trading_pair} 時發生錯誤: {e}")
     
-    batch_size = 60
-    for batch_start in range(0, total_pairs, batch_size):
-        batch_end = min(batch_start + batch_size, total_pairs)
-        logger.info(f"處理批次 {batch_start + 1} 到 {batch_end} / {total_pairs}")
-        for i, trading_pair in enumerate(trading_pairs[batch_start:batch_end], batch_start + 1):
-            logger.info(f"處理進度: {i}/{total_pairs} 交易對")
-            process_trading_pair(trading_pair, sheet_client)
-            time.sleep(0.5)
-        time.sleep(10)
+    # 暖啟動檢查點已包含本次所有 K 線，寫入失敗時才改寫逐交易對的 JSON 快取
+    if not save_checkpoint({**fetched_klines, **scanned_klines}):
+        kline_store.save()
+    sheet_writer.flush()
+    logger.info(f"本次 Google Sheet API 呼叫次數: {sheet_writer.api_calls}")
+    telegram_notifier.flush()
+    signal_store.prune(int((start_time - timedelta(days=SIGNAL_RETENTION_DAYS)).timestamp() * 1000))
     
     if new_entries > 0:
         try:
-            cleanup_old_data(sheet_client, SPREADSHEET_ID, "15min", new_entries)
+            cleanup_old_data(sheet_writer, "15min", new_entries)
         except Exception as e:
             logger.error(f"清理 '15min' 舊數據失敗: {e}")
     
     end_time = datetime.now(pytz.timezone('Asia/Taipei'))
+    metrics.observe("run", (end_time - start_time).total_seconds(), len(scanned_klines))
     logger.info(f"完成 main_task (Run {run_count}): {end_time.strftime('%Y-%m-%d %H:%M:%S')}, 耗時 {(end_time - start_time).total_seconds()} 秒, 新增 {new_entries} 筆記錄")
+    logger.info(f"本次請求權重狀態: {rate_limiter.snapshot()}")
+    logger.info(f"HTTP 連線重用狀態: {connection_stats.snapshot()}")
+    report = metrics.end_run({
+        "new_entries": new_entries,
+        "pairs": total_pairs,
+        "sheet_api_calls": sheet_writer.api_calls,
+        "rate_limiter": rate_limiter.snapshot(),
+        "connections": connection_stats.snapshot()
+    })
+    write_report(report, RUN_REPORT_FILE)
+    logger.info(f"本次各階段耗時（總耗時最長的前 5 名）: {summarize_report(report)}")
 
-if __name__ == "__main__":
-    logger.info(f"程式啟動，artifact_id: {ARTIFACT_ID}, version: {ARTIFACT_VERSION}")
+def run_streaming():
+    """
+    串流模式：訂閱 15m K 線串流，每根 K 線收盤時立即檢查訊號：條件11和12、以增量指標狀態（每根 O(1) 更新）檢查條件1-10
+    record 工作表的整表覆寫只在排程掃描（main_task）執行
+    """
+    global new_entries
+    logger.info("以串流模式啟動")
+    sheet_client = setup_sheet_client(GOOGLE_SHEET_CREDS_JSON)
+    if not sheet_client:
+        logger.error("無法設置 Google Sheet 客戶端，串流模式終止")
+        return
+    sheet_writer = BufferedSheetWriter(sheet_client, SPREADSHEET_ID, fallback=save_rows_to_local_file)
+    
+    trading_pairs = get_trading_pairs()
+    if not trading_pairs:
+        logger.error("無法獲取交易對，串流模式終止")
+        return
+    
+    # 先以 REST 建立各交易對的 K 線歷史，之後由串流持續更新
+    scan_pairs(trading_pairs, fetch_trading_pair_klines, lambda trading_pair, klines_15m: None, max_workers=SCAN_CONCURRENCY)
+    kline_store.save()
+    
+    stream = KlineStream(trading_pairs, "15m", kline_store)
+    stream.start()
+    
+    checkpoint_open_time = None
+    signal_index, signal_index_open_time = None, None
+    while True:
+        trading_pair, open_time_ms = stream.closed_bars.get()
+        if stream.pop_stale(trading_pair):
+            logger.info(f"{trading_pair} 串流資料不連續，以 REST 補齊 K 線")
+            get_cached_klines(trading_pair, "15m", 500)
+        klines = [k for k in kline_store.get(trading_pair, "15m") if int(k[0]) <= open_time_ms]
+        logger.info(f"{trading_pair} K 線收盤（開盤時間 {timestamp_to_taipei(open_time_ms)}），檢查訊號")
+        try:
+            klines_15m = KlineFrame.from_klines(klines)
+            # 同一根 K 線收盤的交易對共用一次查詢的長空/長多記錄
+            if open_time_ms != signal_index_open_time:
+                signal_index, signal_index_open_time = SignalIndex(get_triggered_pairs(sheet_writer)), open_time_ms
+            if klines_15m and signal_index.records(trading_pair):
+                process_retest_pair(trading_pair, klines_15m, signal_index, sheet_writer)
+            evaluation = None
+            if klines_15m:
+                with metrics.timer("indicators", 1):
+                    evaluation = evaluate_indicator_state(sync_indicator_state(trading_pair, klines_15m), klines_15m)
+            process_trading_pair(trading_pair, sheet_writer, klines_15m, write_record=False, evaluation=evaluation)
+        except Exception as e:
+            logger.error(f"串流模式處理 {trading_pair} 時發生錯誤: {e}")
+        if stream.closed_bars.empty():
+            sheet_writer.flush()
+            telegram_notifier.flush()
+            kline_store.save()
+            # 每根 K 線收盤後寫入一次檢查點，重啟時指標狀態只需補上缺少的 K 線
+            if checkpoint_open_time is None or open_time_ms > checkpoint_open_time:
+                checkpoint_open_time = open_time_ms
+                save_checkpoint({pair: KlineFrame.from_klines(kline_store.get(pair, "15m")) for pair in trading_pairs})
+
+def run_startup_checks():
+    """啟動測試（Telegram 發送與 Google Sheet 寫入），在背景執行以免延遲第一次掃描"""
     test_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID)
     sheet_client = setup_sheet_client(GOOGLE_SHEET_CREDS_JSON)
     if sheet_client:
         test_google_sheet_update(sheet_client, SPREADSHEET_ID)
     else:
         logger.error("無法設置 Google Sheet 客戶端，無法進行更新測試")
+
+if __name__ == "__main__":
+    logger.info(f"程式啟動，artifact_id: {ARTIFACT_ID}, version: {ARTIFACT_VERSION}")
+    start_metrics_server(metrics, METRICS_PORT)
+    restore_checkpoint()
+    threading.Thread(target=run_startup_checks, name="startup-checks", daemon=True).start()
+    
+    sheet_write_log.import_legacy(LOCAL_DATA_FILE)
+    threading.Thread(target=run_sheet_replayer, name="sheet-replayer", daemon=True).start()
     
-    schedule.every().hour.at(":05").do(main_task)
-    schedule.every().hour.at(":20").do(main_task)
-    schedule.every().hour.at(":35").do(main_task)
-    schedule.every().hour.at(":50").do(main_task)
+    if STREAMING_MODE:
+        run_streaming()
+    else:
+        schedule.every().hour.at(":05").do(main_task)
+        schedule.every().hour.at(":20").do(main_task)
+        schedule.every().hour.at(":35").do(main_task)
+        schedule.every().hour.at(":50").do(main_task)
     
-    main_task()
+        main_task()
     
-    last_heartbeat = time.time()
-    while True:
-        try:
-            schedule.run_pending()
-            time.sleep(1)
-            if time.time() - last_heartbeat >= 60:
-                logger.info("程式運行中，心跳檢查")
-                last_heartbeat = time.time()
-        except Exception as e:
-            logger.error(f"排程執行錯誤: {e}")
-            time.sleep(60)
+        last_heartbeat = time.time()
+        while True:
+            try:
+                schedule.run_pending()
+                time.sleep(1)
+                if time.time() - last_heartbeat >= 60:
+                    logger.info("程式運行中，心跳檢查")
+                    last_heartbeat = time.time()
+            except Exception as e:
+                logger.error(f"排程執行錯誤: {e}")
+                time.sleep(60)
@@ -0,0 +1,220 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+# 延遲分桶上限（秒），涵蓋毫秒級的本地計算到數十秒的 API 重試
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 記錄的階段（stage 標籤）：run（main_task 整體）、exchange_info、kline_fetch（單一交易對取得 K 線，含快取）、
+# kline_connect/kline_ttfb/kline_download/kline_parse（K 線請求的連線/TLS、首位元組、下載與 JSON 解析）、
+# indicators、rules、sheet_write、telegram_send、rate_limit_wait
+
+def _format_labels(labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+def _percentile(samples, ratio):
+    """最近排名法的百分位數，samples 需已排序"""
+    if not samples:
+        return None
+    index = max(0, min(len(samples) - 1, math.ceil(ratio * len(samples)) - 1))
+    return samples[index]
+
+class MetricsRegistry:
+    """
+    各階段的延遲直方圖與計數器（多執行緒共用）：
+    累計值以 Prometheus 文字格式輸出，begin_run/end_run 之間的觀測值另外保留，彙整為每次執行的 JSON 報告
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, clock=time.perf_counter):
+        self.buckets = tuple(sorted(buckets))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._errors = {}
+        self._items = {}
+        self._gauges = {}
+        self._run = None
+        self.last_report = None
+
+    def observe(self, stage, seconds, items=0):
+        """記錄一次階段耗時（秒），items 為本次處理的單位數（K 線數、寫入列數、訊息數或請求權重）"""
+        seconds = max(0.0, float(seconds))
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+            if items:
+                self._items[stage] = self._items.get(stage, 0) + items
+            if self._run is not None:
+                run_stage = self._run["stages"].setdefault(stage, {"samples": [], "errors": 0, "items": 0})
+                run_stage["samples"].append(seconds)
+                run_stage["items"] += items
+
+    def error(self, stage, count=1):
+        """記錄階段失敗次數（包含會重試的失敗）"""
+        with self._lock:
+            self._errors[stage] = self._errors.get(stage, 0) + count
+            if self._run is not None:
+                self._run["stages"].setdefault(stage, {"samples": [], "errors": 0, "items": 0})["errors"] += count
+
+    @contextmanager
+    def timer(self, stage, items=0):
+        """計時區塊，區塊拋出例外時同時記錄一次失敗"""
+        start = self._clock()
+        try:
+            yield
+        except Exception:
+            self.error(stage)
+            raise
+        finally:
+            self.observe(stage, self._clock() - start, items)
+
+    def gauge(self, name, description, func, metric_type="gauge"):
+        """註冊在輸出 /metrics 時才讀取的數值（func 回傳 None 時略過），累計值以 metric_type="counter" 註冊"""
+        with self._lock:
+            self._gauges[name] = (description, func, metric_type)
+
+    def begin_run(self, run_id):
+        with self._lock:
+            self._run = {"run_id": run_id, "started_at": time.time(), "start": self._clock(), "stages": {}}
+
+    def end_run(self, extra=None):
+        """結束本次執行並回傳報告：每個階段的次數、失敗、總耗時、平均、p50/p95/最大值與占整體耗時的比例"""
+        with self._lock:
+            run, self._run = self._run, None
+        if run is None:
+            return None
+        elapsed = self._clock() - run["start"]
+        stages = {}
+        for stage, data in run["stages"].items():
+            samples = sorted(data["samples"])
+            total = sum(samples)
+            stages[stage] = {
+                "count": len(samples),
+                "errors": data["errors"],
+                "items": data["items"],
+                "total_seconds": round(total, 4),
+                "mean_seconds": round(total / len(samples), 4) if samples else None,
+                "p50_seconds": round(_percentile(samples, 0.5), 4) if samples else None,
+                "p95_seconds": round(_percentile(samples, 0.95), 4) if samples else None,
+                "max_seconds": round(samples[-1], 4) if samples else None,
+                # 並行的階段（例如 K 線抓取）總耗時可能超過整體耗時
+                "share_of_run": round(total / elapsed, 4) if elapsed > 0 else None
+            }
+        report = {
+            "run_id": run["run_id"],
+            "started_at": run["started_at"],
+            "elapsed_seconds": round(elapsed, 4),
+            "stages": dict(sorted(stages.items(), key=lambda item: -item[1]["total_seconds"]))
+        }
+        if extra:
+            report.update(extra)
+        self.last_report = report
+        return report
+
+    def render(self):
+        """以 Prometheus 文字格式輸出累計的直方圖、計數器與註冊的數值"""
+        with self._lock:
+            histograms = {stage: (list(h["buckets"]), h["sum"], h["count"]) for stage, h in self._histograms.items()}
+            errors = dict(self._errors)
+            items = dict(self._items)
+            gauges = dict(self._gauges)
+        lines = [
+            "# HELP trading_stage_duration_seconds Duration of each pipeline stage in seconds.",
+            "# TYPE trading_stage_duration_seconds histogram"
+        ]
+        for stage, (buckets, total, count) in sorted(histograms.items()):
+            for bound, value in zip(self.buckets, buckets):
+                lines.append(f"trading_stage_duration_seconds_bucket{_format_labels([('stage', stage), ('le', _format_value(bound))])} {value}")
+            lines.append(f"trading_stage_duration_seconds_bucket{_format_labels([('stage', stage), ('le', '+Inf')])} {count}")
+            lines.append(f"trading_stage_duration_seconds_sum{_format_labels([('stage', stage)])} {total!r}")
+            lines.append(f"trading_stage_duration_seconds_count{_format_labels([('stage', stage)])} {count}")
+        for name, description, values in (
+            ("trading_stage_errors_total", "Failed attempts of each pipeline stage.", errors),
+            ("trading_stage_items_total", "Units processed by each stage (klines, sheet rows, messages, request weight).", items)
+        ):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels([('stage', stage)])} {value}")
+        for name, (description, func, metric_type) in sorted(gauges.items()):
+            try:
+                value = func()
+            except Exception as e:
+                logger.warning(f"讀取指標 {name} 失敗: {e}")
+                continue
+            if value is None:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def write_report(report, path):
+    """將執行報告寫入 JSON 檔（先寫暫存檔再取代）"""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error(f"寫入執行報告 {path} 失敗: {e}")
+
+def summarize_report(report, limit=5):
+    """報告中總耗時最長的幾個階段，供日誌輸出"""
+    return ", ".join(
+        f"{stage} {data['total_seconds']}s/{data['count']}次" + (f"/失敗{data['errors']}" if data["errors"] else "")
+        for stage, data in list(report["stages"].items())[:limit]
+    )
+
+def start_metrics_server(registry, port, host="0.0.0.0"):
+    """在背景執行緒提供 /metrics（Prometheus 文字格式）與 /report（最近一次執行報告），回傳 server"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body = registry.render().encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/report":
+                body = json.dumps(registry.last_report, ensure_ascii=False).encode("utf-8")
+                content_type = "application/json; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"指標服務請求: {format % args}")
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.error(f"啟動指標服務（port {port}）失敗: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"指標服務已啟動：http://{host}:{port}/metrics")
+    return server
+
+# 行程內共用的指標登錄（所有模組記錄到同一份直方圖與計數器）
+registry = MetricsRegistry()
@@ -1,9 +1,17 @@
 import logging
+import os
+import queue
+import threading
+import time
 import requests
+from binance_api import get_session
+from metrics import registry as metrics
 
 # 設定日誌記錄
 logger = logging.getLogger(__name__)
 
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+
 def send_telegram_message(token, chat_id, message):
     """
     發送訊息到Telegram
@@ -11,14 +19,14 @@ def send_telegram_message(token, chat_id, message):
     try:
         logger.info(f"準備發送Telegram訊息: {message[:50]}...")
 
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
+        url = f"{TELEGRAM_API_URL.rstrip('/')}/bot{token}/sendMessage"
         data = {
             "chat_id": chat_id,
             "text": message,
             "parse_mode": "HTML"
         }
 
-        response = requests.post(url, data=data, timeout=10)
+        response = get_session().post(url, data=data, timeout=10)
         response.raise_for_status()
 
         if 'application/json' not in response.headers.get('Content-Type', ''):
@@ -40,3 +48,157 @@ def send_telegram_message(token, chat_id, message):
         logger.error(f"發送Telegram訊息時發生錯誤: {e}")
         return False
 
+# Telegram 單則訊息長度上限
+MAX_MESSAGE_LENGTH = 4096
+DIGEST_SEPARATOR = "\n\n"
+
+def pack_messages(messages, max_length=MAX_MESSAGE_LENGTH, separator=DIGEST_SEPARATOR):
+    """將多則訊息依序合併為數則不超過 max_length 的摘要訊息，單則過長的訊息會被切開"""
+    digests = []
+    current = ""
+    for message in messages:
+        pieces = [message[i:i + max_length] for i in range(0, len(message), max_length)] or [""]
+        for piece in pieces:
+            if current and len(current) + len(separator) + len(piece) <= max_length:
+                current += separator + piece
+            else:
+                if current:
+                    digests.append(current)
+                current = piece
+    if current:
+        digests.append(current)
+    return digests
+
+class TelegramNotifier:
+    """
+    非同步 Telegram 通知：訊息放入佇列後由背景執行緒發送，不阻塞掃描
+    add() 暫存的訊號在 flush() 時合併為摘要訊息；同一聊天室的發送間隔至少 min_interval 秒，
+    遇到 429 時依回應中的 retry_after 等待後重試；5xx 與連線錯誤/逾時以指數退避重試，其他 4xx（例如 token 或 chat_id 錯誤）不重試
+    """
+
+    def __init__(self, token, chat_id, api_url=TELEGRAM_API_URL, session=None, max_length=MAX_MESSAGE_LENGTH,
+                 min_interval=1.0, max_retries=5, timeout=10, clock=time.monotonic, sleep=time.sleep):
+        self.token = token
+        self.chat_id = chat_id
+        self.api_url = api_url.rstrip("/")
+        self.session = session
+        self.max_length = max_length
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._clock = clock
+        self._sleep = sleep
+        self._queue = queue.Queue()
+        self._digest = []
+        self._digest_lock = threading.Lock()
+        self._last_sent = {}
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def notify(self, message, chat_id=None):
+        """將單則訊息放入發送佇列"""
+        self._ensure_worker()
+        self._queue.put((chat_id or self.chat_id, message))
+
+    def add(self, message):
+        """暫存一則訊號訊息，待 flush 時合併發送"""
+        with self._digest_lock:
+            self._digest.append(message)
+
+    def flush(self):
+        """將暫存的訊號合併為摘要訊息放入發送佇列，回傳摘要訊息數量"""
+        with self._digest_lock:
+            messages, self._digest = self._digest, []
+        digests = pack_messages(messages, self.max_length)
+        for digest in digests:
+            self.notify(digest)
+        if messages:
+            logger.info(f"已將 {len(messages)} 則訊號合併為 {len(digests)} 則 Telegram 摘要訊息")
+        return len(digests)
+
+    def join(self, timeout=None):
+        """等待佇列中的訊息全部處理完畢，逾時回傳 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="telegram-notifier", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            chat_id, message = self._queue.get()
+            try:
+                self._send_with_retry(chat_id, message)
+            except Exception as e:
+                logger.error(f"Telegram 通知執行緒發生錯誤: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _wait_for_slot(self, chat_id):
+        last_sent = self._last_sent.get(chat_id)
+        if last_sent is not None:
+            wait = self.min_interval - (self._clock() - last_sent)
+            if wait > 0:
+                self._sleep(wait)
+
+    def _send_with_retry(self, chat_id, message):
+        url = f"{self.api_url}/bot{self.token}/sendMessage"
+        session = self.session or get_session()
+        for attempt in range(self.max_retries):
+            self._wait_for_slot(chat_id)
+            start = time.perf_counter()
+            try:
+                response = session.post(url, json={"chat_id": chat_id, "text": message}, timeout=self.timeout)
+                self._last_sent[chat_id] = self._clock()
+                if response.status_code == 429:
+                    metrics.observe("telegram_send", time.perf_counter() - start)
+                    metrics.error("telegram_send")
+                    retry_after = self._retry_after(response)
+                    self.retried += 1
+                    logger.warning(f"Telegram 回應 429，{retry_after} 秒後重試")
+                    self._sleep(retry_after)
+                    continue
+                response.raise_for_status()
+                metrics.observe("telegram_send", time.perf_counter() - start, 1)
+                self.sent += 1
+                logger.info(f"Telegram 訊息發送成功: {message[:50]}")
+                return True
+            except requests.exceptions.RequestException as e:
+                metrics.observe("telegram_send", time.perf_counter() - start)
+                metrics.error("telegram_send")
+                self._last_sent[chat_id] = self._clock()
+                status_code = e.response.status_code if e.response is not None else None
+                if status_code is not None and 400 <= status_code < 500:
+                    # 請求本身有誤，重試也不會成功
+                    self.failed += 1
+                    logger.error(f"Telegram 訊息發送失敗（HTTP {status_code}，不重試）: {e}")
+                    return False
+                self.retried += 1
+                logger.error(f"Telegram 訊息發送失敗 (嘗試 {attempt + 1}/{self.max_retries}): {e}")
+                if attempt < self.max_retries - 1:
+                    self._sleep(min(2 ** attempt, 30))
+        self.failed += 1
+        logger.error(f"Telegram 訊息發送失敗，已達最大重試次數: {message[:50]}")
+        return False
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            retry_after = response.json().get("parameters", {}).get("retry_after")
+        except ValueError:
+            retry_after = None
+        if retry_after is None:
+            retry_after = response.headers.get("Retry-After", 1)
+        return max(float(retry_after), 0)
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+USED_WEIGHT_HEADER = "X-MBX-USED-WEIGHT-1M"
+
+class WeightRateLimiter:
+    """
+    以請求權重計算的令牌桶限速器（多執行緒共用）
+    令牌以 weight_limit * safety_ratio / 60 每秒的速度回補，
+    並依幣安回應標頭 X-MBX-USED-WEIGHT-1M 校正剩餘額度
+    """
+
+    def __init__(self, weight_limit=2400, safety_ratio=0.9, window_seconds=60,
+                 clock=time.monotonic, wall_clock=time.time, sleep=time.sleep):
+        self.weight_limit = weight_limit
+        self.capacity = max(1, int(weight_limit * safety_ratio))
+        self.window_seconds = window_seconds
+        self._rate = self.capacity / window_seconds
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(self.capacity)
+        self._last_refill = clock()
+        self._blocked_until = 0.0
+        self.used_weight = None
+        self.total_weight = 0
+        self.total_wait = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self._rate)
+            self._last_refill = now
+
+    def _seconds_to_next_window(self):
+        return self.window_seconds - (self._wall_clock() % self.window_seconds)
+
+    def acquire(self, weight=1):
+        """取得指定權重的額度，額度不足時阻塞等待，回傳等待秒數"""
+        weight = min(max(weight, 0), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                elif self._tokens >= weight:
+                    self._tokens -= weight
+                    self.total_weight += weight
+                    self.total_wait += waited
+                    return waited
+                else:
+                    delay = (weight - self._tokens) / self._rate
+            if waited == 0.0:
+                logger.info(f"請求權重額度不足，等待 {delay:.2f} 秒（需求權重 {weight}）")
+            self._sleep(delay)
+            waited += delay
+
+    def update_from_headers(self, headers):
+        """依回應標頭中的已用權重校正剩餘額度（只會調降）"""
+        if headers is None:
+            return
+        used = headers.get(USED_WEIGHT_HEADER) or headers.get(USED_WEIGHT_HEADER.lower())
+        if used is None:
+            return
+        try:
+            used = int(used)
+        except (TypeError, ValueError):
+            logger.warning(f"無法解析 {USED_WEIGHT_HEADER} 標頭: {used}")
+            return
+
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self.used_weight = used
+            remaining = self.capacity - used
+            if remaining <= 0:
+                # 已用權重達到安全上限，暫停到下一個時間窗口重置
+                self._tokens = 0.0
+                self._blocked_until = max(self._blocked_until, now + self._seconds_to_next_window())
+                logger.warning(f"已用權重 {used} 達到安全上限 {self.capacity}，暫停至下一個時間窗口")
+            else:
+                # 只向下校正：標頭只反映伺服器已處理的請求，已預留但仍在途中的權重不可退回額度
+                self._tokens = min(self._tokens, float(remaining))
+
+    def penalize(self, retry_after=None):
+        """收到 429/418 時清空額度，並暫停到 Retry-After 指定的時間（未提供則到下一個時間窗口）"""
+        with self._lock:
+            now = self._clock()
+            try:
+                delay = float(retry_after) if retry_after is not None else self._seconds_to_next_window()
+            except (TypeError, ValueError):
+                delay = self._seconds_to_next_window()
+            self._tokens = 0.0
+            self._last_refill = now
+            self._blocked_until = max(self._blocked_until, now + delay)
+        logger.warning(f"觸發幣安限速，暫停 {delay:.2f} 秒")
+
+    def update_from_response(self, response):
+        """依回應狀態碼與標頭更新限速狀態"""
+        if response is None:
+            return
+        self.update_from_headers(response.headers)
+        if response.status_code in (418, 429):
+            self.penalize(response.headers.get("Retry-After"))
+
+    def snapshot(self):
+        """回傳目前限速狀態"""
+        with self._lock:
+            self._refill(self._clock())
+            return {
+                "capacity": self.capacity,
+                "tokens": round(self._tokens, 2),
+                "used_weight": self.used_weight,
+                "total_weight": self.total_weight,
+                "total_wait": round(self.total_wait, 3)
+            }
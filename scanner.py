@@ -0,0 +1,48 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+def scan_pairs(trading_pairs, fetch_func, process_func, max_workers=10):
+    """
+    並行掃描交易對：以有上限的執行緒池同時抓取資料，
+    並在結果到達時依原始順序逐一交給 process_func 處理，輸出順序與序列掃描一致
+    """
+    total_pairs = len(trading_pairs)
+    if total_pairs == 0:
+        return 0
+
+    max_workers = max(1, int(max_workers))
+    # 限制同時在途的請求數量，避免一次持有全部交易對的 K 線資料
+    max_in_flight = max_workers * 4
+    processed = 0
+
+    logger.info(f"開始並行掃描 {total_pairs} 個交易對，並行上限 {max_workers}")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan") as executor:
+        pending = deque()
+        next_index = 0
+
+        while next_index < total_pairs or pending:
+            while next_index < total_pairs and len(pending) < max_in_flight:
+                trading_pair = trading_pairs[next_index]
+                pending.append((next_index, trading_pair, executor.submit(fetch_func, trading_pair)))
+                next_index += 1
+
+            index, trading_pair, future = pending.popleft()
+            try:
+                data = future.result()
+            except Exception as e:
+                logger.error(f"抓取 {trading_pair} 資料時發生錯誤: {e}")
+                continue
+
+            try:
+                process_func(trading_pair, data)
+                processed += 1
+            except Exception as e:
+                logger.error(f"處理 {trading_pair} 時發生錯誤: {e}")
+            logger.debug(f"處理進度: {index + 1}/{total_pairs} 交易對")
+
+    logger.info(f"並行掃描完成，成功處理 {processed}/{total_pairs} 個交易對")
+    return processed
@@ -1,9 +1,12 @@
 import logging
 import json
+import re
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
 from datetime import datetime
 import time
+from metrics import registry as metrics
 
 # 設定日誌記錄
 logger = logging.getLogger(__name__)
@@ -106,3 +109,215 @@ def cleanup_old_data(client, spreadsheet_id, sheet_name, max_rows=10000):
 
     logger.error("清理舊數據失敗，已達最大重試次數")
     return False
+
+class BufferedSheetWriter:
+    """
+    批次寫入 Google Sheet：執行期間依工作表暫存資料列，flush 時每個工作表只呼叫一次 append_rows
+    以 snapshot 註冊的工作表則在 flush 時以單次範圍 update 整表覆寫（標題列 + 本次資料）
+    Spreadsheet 與 Worksheet 物件會被快取重複使用；寫入失敗時整批資料交給 fallback 保存
+    """
+
+    def __init__(self, client, spreadsheet_id, fallback=None, max_retries=3, retry_delay=2):
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.fallback = fallback
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._buffers = {}
+        self._snapshots = {}
+        self._last_rows = {}
+        self._written = {}
+        self.api_calls = 0
+
+    def spreadsheet(self):
+        if self._spreadsheet is None:
+            self._spreadsheet = self.client.open_by_key(self.spreadsheet_id)
+            self.api_calls += 1
+        return self._spreadsheet
+
+    def worksheet(self, sheet_name, create=True, rows=1000, cols=20):
+        """取得快取的工作表物件，不存在時依 create 決定是否建立"""
+        if sheet_name not in self._worksheets:
+            spreadsheet = self.spreadsheet()
+            try:
+                worksheet = spreadsheet.worksheet(sheet_name)
+                self.api_calls += 1
+            except gspread.exceptions.WorksheetNotFound:
+                if not create:
+                    raise
+                logger.warning(f"{sheet_name} 工作表不存在，創建新工作表")
+                worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=rows, cols=cols)
+                self.api_calls += 1
+            self._worksheets[sheet_name] = worksheet
+        return self._worksheets[sheet_name]
+
+    def forget(self, sheet_name):
+        """移除快取的工作表物件（例如工作表被刪除或重新建立後）"""
+        self._worksheets.pop(sheet_name, None)
+        self._last_rows.pop(sheet_name, None)
+
+    def row_count(self, sheet_name):
+        """
+        取得工作表目前的資料列數（含標題列）
+        優先使用本次 append_rows 回應中的寫入範圍，未知時只讀取 A 欄計算
+        """
+        if sheet_name not in self._last_rows:
+            worksheet = self.worksheet(sheet_name, create=False)
+            self._last_rows[sheet_name] = len(worksheet.col_values(1))
+            self.api_calls += 1
+        return self._last_rows[sheet_name]
+
+    def read_values(self, sheet_name, a1_range):
+        """以單次讀取取得工作表指定範圍的值（例如 "A:C"），工作表不存在時拋出 WorksheetNotFound"""
+        worksheet = self.worksheet(sheet_name, create=False)
+        values = worksheet.get_values(a1_range)
+        self.api_calls += 1
+        return values
+
+    def average_row_bytes(self, sheet_name):
+        """本次寫入該工作表的平均每列大小（JSON 位元組），沒有寫入時回傳 None"""
+        rows, size = self._written.get(sheet_name, (0, 0))
+        return size / rows if rows else None
+
+    def delete_rows(self, sheet_name, start_index, end_index):
+        """以單次範圍刪除移除第 start_index~end_index 列（含），其餘資料不會被搬移重寫"""
+        worksheet = self.worksheet(sheet_name, create=False)
+        with metrics.timer("sheet_write"):
+            worksheet.delete_rows(start_index, end_index)
+        self.api_calls += 1
+        if sheet_name in self._last_rows:
+            self._last_rows[sheet_name] -= end_index - start_index + 1
+
+    def snapshot(self, sheet_name, headers):
+        """
+        將工作表設為快照模式：本次 append 的資料在 flush 時連同標題列一次覆寫整個工作表
+        覆寫前不清空工作表，讀取者在執行期間看到的始終是上一次完整的快照
+        """
+        self._snapshots[sheet_name] = list(headers)
+        self._buffers[sheet_name] = []
+
+    def append(self, sheet_name, row):
+        """暫存一列資料，待 flush 時一次寫入"""
+        self._buffers.setdefault(sheet_name, []).append(list(row))
+
+    def pending(self, sheet_name=None):
+        if sheet_name is not None:
+            return len(self._buffers.get(sheet_name, []))
+        return sum(len(rows) for rows in self._buffers.values())
+
+    def flush(self, sheet_name=None):
+        """
+        將暫存資料寫入工作表，每個工作表一次 append_rows
+        單一工作表的寫入為全有或全無：重試失敗後整批交給 fallback，回傳是否全部成功
+        """
+        sheet_names = [sheet_name] if sheet_name is not None else list(self._buffers)
+        success = True
+        for name in sheet_names:
+            rows = self._buffers.pop(name, [])
+            if name in self._snapshots:
+                # 快照寫入失敗時保留上一次的完整快照，不交給 fallback 重播
+                with metrics.timer("sheet_write", len(rows)):
+                    replaced = self._replace_with_retry(name, [self._snapshots.pop(name)] + rows)
+                if not replaced:
+                    success = False
+                continue
+            if not rows:
+                continue
+            with metrics.timer("sheet_write", len(rows)):
+                appended = self._append_rows_with_retry(name, rows)
+            if not appended:
+                success = False
+                if self.fallback:
+                    self.fallback(rows, name)
+        return success
+
+    def _append_rows_with_retry(self, sheet_name, rows):
+        for attempt in range(self.max_retries):
+            try:
+                worksheet = self.worksheet(sheet_name)
+                response = worksheet.append_rows(rows)
+                self.api_calls += 1
+                self._track_append(sheet_name, rows, response)
+                logger.info(f"成功批次寫入 Google Sheet {sheet_name}，共 {len(rows)} 列")
+                return True
+            except Exception as e:
+                logger.error(f"批次寫入 Google Sheet {sheet_name} 時發生錯誤 (嘗試 {attempt + 1}/{self.max_retries}): {e}")
+                metrics.error("sheet_write")
+                self.forget(sheet_name)
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.retry_delay)
+        logger.error(f"批次寫入 Google Sheet {sheet_name} 失敗，已達最大重試次數")
+        return False
+
+    def _replace_with_retry(self, sheet_name, values, rows=1200, cols=20):
+        width = max(len(row) for row in values)
+        for attempt in range(self.max_retries):
+            try:
+                worksheet = self.worksheet(sheet_name, rows=max(rows, len(values)), cols=max(cols, width))
+                if worksheet.row_count < len(values):
+                    worksheet.resize(rows=len(values))
+                    self.api_calls += 1
+                # 以空白列補滿整個工作表，同一次 update 覆蓋上一次快照多出來的列
+                padded = [list(row) + [""] * (width - len(row)) for row in values]
+                padded += [[""] * width for _ in range(worksheet.row_count - len(values))]
+                worksheet.update(values=padded, range_name=f"A1:{rowcol_to_a1(len(padded), width)}")
+                self.api_calls += 1
+                self._last_rows[sheet_name] = len(values)
+                logger.info(f"成功以單次更新覆寫 Google Sheet {sheet_name}，共 {len(values) - 1} 列")
+                return True
+            except Exception as e:
+                logger.error(f"覆寫 Google Sheet {sheet_name} 時發生錯誤 (嘗試 {attempt + 1}/{self.max_retries}): {e}")
+                metrics.error("sheet_write")
+                self.forget(sheet_name)
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.retry_delay)
+        logger.error(f"覆寫 Google Sheet {sheet_name} 失敗，已達最大重試次數")
+        return False
+
+    def _track_append(self, sheet_name, rows, response):
+        count, size = self._written.get(sheet_name, (0, 0))
+        self._written[sheet_name] = (count + len(rows), size + len(json.dumps(rows, ensure_ascii=False).encode("utf-8")))
+        last_row = range_end_row(response.get("updates", {}).get("updatedRange") if isinstance(response, dict) else None)
+        if last_row is not None:
+            self._last_rows[sheet_name] = last_row
+        else:
+            self._last_rows.pop(sheet_name, None)
+
+def range_end_row(a1_range):
+    """從 A1 表示法的範圍（例如 '15min'!A3201:P3205）取得最後一列的列號"""
+    if not a1_range:
+        return None
+    match = re.search(r"(\d+)$", a1_range)
+    return int(match.group(1)) if match else None
+
+def trim_oldest_rows(sheet_writer, sheet_name, rows_to_delete, max_rows):
+    """
+    工作表總列數（含標題列）超過 max_rows 時，以單次範圍刪除移除標題列之後最舊的 rows_to_delete 列
+    保留的資料不會被下載或重寫，回傳本次清理的統計（含相較整表下載/清空/重寫所節省的 API 呼叫與估計位元組）
+    """
+    calls_before = sheet_writer.api_calls
+    total_rows = sheet_writer.row_count(sheet_name)
+    deleted = 0
+    if total_rows > max_rows:
+        deleted = min(rows_to_delete, total_rows - 1)
+        if deleted > 0:
+            sheet_writer.delete_rows(sheet_name, 2, deleted + 1)
+    api_calls = sheet_writer.api_calls - calls_before
+
+    # 舊做法：get_all_values 下載整表，超過上限時再 clear + append_row 標題 + append_rows 保留的資料
+    kept_rows = total_rows - 1 - deleted
+    legacy_calls = 1 + ((3 if kept_rows else 2) if total_rows > max_rows else 0)
+    average_bytes = sheet_writer.average_row_bytes(sheet_name)
+    saved_bytes = None
+    if average_bytes is not None:
+        transferred = total_rows + (kept_rows + 1 if total_rows > max_rows else 0)
+        saved_bytes = int(transferred * average_bytes)
+    return {
+        "total_rows": total_rows,
+        "deleted_rows": deleted,
+        "api_calls": api_calls,
+        "saved_api_calls": legacy_calls - api_calls,
+        "saved_bytes": saved_bytes
+    }
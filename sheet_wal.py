@@ -0,0 +1,242 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+# .done 檔中寫入前的意圖記錄前綴；確認寫入成功的冪等鍵則不加前綴
+INTENT_PREFIX = "? "
+
+def row_key(sheet_name, row, sequence):
+    """
+    以工作表名稱、日誌序號與資料內容產生冪等鍵，同一筆記錄重播時只會寫入一次
+    序號在每次 append 時遞增，內容相同的兩筆記錄（例如同一訊號在不同時間各失敗一次）仍各自寫入
+    """
+    payload = json.dumps([sheet_name, sequence, row], ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+class SheetWriteLog:
+    """
+    未能寫入 Google Sheet 的資料列的 append-only 預寫日誌（JSONL，每列一筆）
+    寫入只在檔案結尾附加，fsync 依 fsync_interval 批次執行；重播狀態另記在 .done 檔：
+    每批寫入前先記錄其冪等鍵的意圖（"? <key>"），寫入成功後再記錄確認（"<key>"）
+    只有意圖而沒有確認的項目表示上次在寫入 Google Sheet 後、確認前中斷，可能已經寫入，
+    重播時先交給 exists_func 比對工作表，未提供時仍會重新寫入（至少一次）並記錄警告
+    """
+
+    def __init__(self, path, fsync_interval=1.0):
+        self.path = path
+        self.done_path = f"{path}.done"
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_fsync = 0.0
+        self._unsynced = False
+        self._sequence = 0
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def append(self, sheet_name, rows, timestamp=None):
+        """附加多列資料到日誌，回傳寫入筆數"""
+        timestamp = timestamp or time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            # 序號以納秒時間起算並嚴格遞增，重新啟動或日誌清空後也不會與先前的項目重複
+            entries = []
+            for row in rows:
+                self._sequence = max(self._sequence + 1, time.time_ns())
+                entries.append({"key": row_key(sheet_name, row, self._sequence), "seq": self._sequence,
+                                "timestamp": timestamp, "sheet_name": sheet_name, "data": row})
+            lines = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in entries)
+            f = self._open()
+            f.write(lines)
+            f.flush()
+            self._unsynced = True
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._sync_locked()
+        return len(rows)
+
+    def sync(self):
+        """將尚未 fsync 的日誌寫入磁碟"""
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = False
+        self._last_fsync = time.monotonic()
+
+    def _read_lines(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def _done_locked(self):
+        """讀取 .done 檔，回傳 (已確認的冪等鍵, 只有寫入意圖尚未確認的冪等鍵)"""
+        confirmed, intents = set(), set()
+        for line in self._read_lines(self.done_path):
+            if line.startswith(INTENT_PREFIX):
+                intents.add(line[len(INTENT_PREFIX):])
+            elif line:
+                confirmed.add(line)
+        return confirmed, intents - confirmed
+
+    def _pending_locked(self):
+        done, _ = self._done_locked()
+        pending = []
+        seen = set()
+        for line in self._read_lines(self.path):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 寫入中斷造成的不完整列直接略過
+                logger.warning(f"略過 {self.path} 中無法解析的日誌列")
+                continue
+            if entry["key"] in done or entry["key"] in seen:
+                continue
+            seen.add(entry["key"])
+            pending.append(entry)
+        return pending
+
+    def pending(self):
+        """回傳尚未重播的日誌項目（依寫入順序，冪等鍵重複者只保留第一筆）"""
+        with self._lock:
+            return self._pending_locked()
+
+    def has_pending(self):
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def in_doubt(self):
+        """回傳已記錄寫入意圖但尚未確認的冪等鍵（上次重播可能已寫入 Google Sheet）"""
+        with self._lock:
+            return self._done_locked()[1]
+
+    def _append_done(self, lines):
+        with self._lock:
+            with open(self.done_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{line}\n" for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def mark_intent(self, keys):
+        """在寫入 Google Sheet 之前記錄這批冪等鍵的寫入意圖"""
+        self._append_done(f"{INTENT_PREFIX}{key}" for key in keys)
+
+    def mark_done(self, keys):
+        """確認這批冪等鍵已寫入 Google Sheet"""
+        self._append_done(keys)
+
+    def compact(self):
+        """
+        以尚未重播的項目重寫日誌，全部重播完成時刪除日誌
+        .done 檔只保留仍在日誌中的項目的記錄（尚未確認的寫入意圖），在日誌改寫完成後才重寫
+        """
+        with self._lock:
+            pending = self._pending_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if pending:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in pending))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+            keys = {entry["key"] for entry in pending}
+            kept = [line for line in self._read_lines(self.done_path)
+                    if line.startswith(INTENT_PREFIX) and line[len(INTENT_PREFIX):] in keys]
+            if kept:
+                tmp_path = f"{self.done_path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write("".join(f"{line}\n" for line in kept))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.done_path)
+            elif os.path.exists(self.done_path):
+                os.remove(self.done_path)
+            return len(pending)
+
+    def replay(self, append_func, batch_size=500, exists_func=None):
+        """
+        依工作表分批重播尚未寫入的資料列，append_func(sheet_name, rows) 成功時回傳 True
+        每批寫入前記錄寫入意圖、成功後確認；遇到失敗（API 尚未恢復）即停止，剩餘項目留待下次重播
+        上次中斷而尚未確認的項目先以 exists_func(sheet_name, rows) 比對（回傳每列是否已在工作表中，
+        無法讀取工作表時回傳 None），已存在者直接確認而不再寫入；回傳本次重播成功的筆數（不含比對後略過的項目）
+        """
+        pending = self.pending()
+        if not pending:
+            return 0
+        in_doubt = self.in_doubt()
+        by_sheet = {}
+        for entry in pending:
+            by_sheet.setdefault(entry["sheet_name"], []).append(entry)
+        if in_doubt:
+            by_sheet = self._resolve_in_doubt(by_sheet, in_doubt, exists_func)
+
+        replayed = 0
+        for sheet_name, entries in by_sheet.items():
+            for i in range(0, len(entries), batch_size):
+                batch = entries[i:i + batch_size]
+                self.mark_intent([entry["key"] for entry in batch])
+                if not append_func(sheet_name, [entry["data"] for entry in batch]):
+                    logger.warning(f"重播 {sheet_name} 失敗，剩餘 {len(pending) - replayed} 筆留待下次重播")
+                    self.compact()
+                    return replayed
+                self.mark_done([entry["key"] for entry in batch])
+                replayed += len(batch)
+        self.compact()
+        logger.info(f"已從 {self.path} 重播 {replayed} 筆資料列到 Google Sheet")
+        return replayed
+
+    def _resolve_in_doubt(self, by_sheet, in_doubt, exists_func):
+        """比對上次中斷而尚未確認的項目，已在工作表中的直接確認並自待重播項目中移除"""
+        resolved = {}
+        for sheet_name, entries in by_sheet.items():
+            doubtful = [entry for entry in entries if entry["key"] in in_doubt]
+            if not doubtful:
+                resolved[sheet_name] = entries
+                continue
+            if exists_func is None:
+                logger.warning(f"{sheet_name} 有 {len(doubtful)} 筆上次重播中斷的資料列無法比對，將重新寫入，可能重複")
+                resolved[sheet_name] = entries
+                continue
+            exists = exists_func(sheet_name, [entry["data"] for entry in doubtful])
+            if exists is None:
+                # 無法讀取工作表（API 尚未恢復），整個工作表留待下次重播
+                logger.warning(f"無法比對 {sheet_name} 中上次重播中斷的 {len(doubtful)} 筆資料列，留待下次重播")
+                continue
+            written = {entry["key"] for entry, found in zip(doubtful, exists) if found}
+            if written:
+                self.mark_done(written)
+                logger.info(f"{sheet_name} 有 {len(written)} 筆上次重播中斷的資料列已在工作表中，不再重複寫入")
+            resolved[sheet_name] = [entry for entry in entries if entry["key"] not in written]
+        return resolved
+
+    def import_legacy(self, json_path):
+        """將舊版 failed_sheet_updates.json（整個檔案為一個 JSON 陣列）匯入日誌，匯入後改名保留"""
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, "r") as f:
+                entries = json.load(f)
+        except Exception as e:
+            logger.error(f"讀取舊版本地備份 {json_path} 失敗: {e}")
+            return 0
+        imported = 0
+        for entry in entries:
+            imported += self.append(entry["sheet_name"], [entry["data"]], timestamp=entry.get("timestamp"))
+        self.sync()
+        os.replace(json_path, f"{json_path}.imported")
+        logger.info(f"已將舊版本地備份 {json_path} 的 {imported} 筆資料匯入 {self.path}")
+        return imported
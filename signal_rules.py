@@ -0,0 +1,169 @@
+import logging
+from collections import namedtuple
+from functools import partial
+import numpy as np
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+# 訊號條件的宣告式定義：每個條件只宣告一次判斷式與參數，多空鏡像條件以 mirror 宣告，
+# 判斷時以方向（BULLISH/BEARISH）反轉所有大小比較。判斷式對整個陣列運算，
+# 同一組特徵可以是單一交易對的最新一根（check_signals）、整個交易對集合的最新一根（截面計算）
+# 或單一交易對的整段歷史（回測）
+
+BULLISH = 1
+BEARISH = -1
+
+# name/side/params 為主條件，mirror/mirror_params 為方向相反的鏡像條件，requires 為必須同時觸發的前置條件
+Rule = namedtuple("Rule", "name predicate side params mirror mirror_params requires", defaults=(None, None, None))
+
+def above(a, b, side):
+    """多方為 a > b，空方為 a < b"""
+    return a > b if side == BULLISH else a < b
+
+def at_least(a, b, side):
+    """多方為 a >= b，空方為 a <= b"""
+    return a >= b if side == BULLISH else a <= b
+
+class Features(dict):
+    """
+    判斷式共用的特徵陣列（形狀相同，NaN 代表指標尚未形成），衍生特徵（例如 MA21 連續上升）只計算一次
+    必要欄位：open/high/low/close/quote_volume、VOL21、MA21/MA34/MA233（含 _prev）、DIF/DEA、MACD/MACD_prev、
+    BOLL_UP/BOLL_MB/BOLL_DN，以及由舊到新排列的 MA21_history（最近 5 個）與 close_history（最近 3 個）
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._derived = {}
+
+    def derived(self, key, compute):
+        if key not in self._derived:
+            self._derived[key] = compute()
+        return self._derived[key]
+
+    def trend(self, name, side):
+        """{name}_history 由舊到新不遞減（多方）或不遞增（空方）"""
+        def compute():
+            history = self[f"{name}_history"]
+            return np.logical_and.reduce([at_least(later, earlier, side) for earlier, later in zip(history, history[1:])])
+        return self.derived(("trend", name, side), compute)
+
+    def dif_ratio(self):
+        def compute():
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return self["DIF"] / self["close"]
+        return self.derived("dif_ratio", compute)
+
+def volume_surge(features, side, params):
+    """條件1：成交額 > ratio * VOL21"""
+    return features["quote_volume"] > params["ratio"] * features["VOL21"]
+
+def wick_rejection(features, side, params):
+    """條件2/3：下影線（空方為上影線）> body_ratio * 實體，收盤價站上 MA21、MACD 與 DIF > DEA > 0 同向且 MA21 連續同向"""
+    o, h, l, c = features["open"], features["high"], features["low"], features["close"]
+    wick = np.minimum(o, c) - l if side == BULLISH else h - np.maximum(o, c)
+    return ((wick > params["body_ratio"] * np.abs(c - o)) & above(c, features["MA21"], side) &
+            above(features["MACD"], 0, side) & above(features["DIF"], features["DEA"], side) &
+            above(features["DEA"], 0, side) & features.trend("MA21", side))
+
+def ma_cross(features, side, params):
+    """條件4/5：MA34 穿越 MA233（黃金交叉/死亡交叉）且 DIF > DEA > 0 同向"""
+    return (at_least(features["MA233_prev"], features["MA34_prev"], side) &
+            above(features["MA34"], features["MA233"], side) &
+            above(features["DIF"], features["DEA"], side) & above(features["DEA"], 0, side))
+
+def macd_cross(features, side, params):
+    """條件6/7：MACD 穿越 0、DIF/收盤價介於 0 與 dif_ratio 之間、收盤價站上 MA21、收紅且最近 3 根收盤價連續同向"""
+    c = features["close"]
+    ratio = features.dif_ratio()
+    with np.errstate(invalid="ignore"):
+        return (above(0, features["MACD_prev"], side) & above(features["MACD"], 0, side) &
+                above(ratio, 0, side) & above(params["dif_ratio"], ratio, side) &
+                above(c, features["MA21"], side) & above(c, features["open"], side) & features.trend("close", side))
+
+def amplitude(features, side, params):
+    """條件8：(最高價 - 最低價) / 最低價 > threshold"""
+    h, l = features["high"], features["low"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (l > 0) & ((h - l) / l > params["threshold"])
+
+def bollinger_reversal(features, side, params):
+    """條件9/10：下軌 < 中軌 * factor（空方為上軌 > 中軌 * factor）、收紅且 MA21 連續反向"""
+    band = features["BOLL_DN"] if side == BULLISH else features["BOLL_UP"]
+    return (above(features["BOLL_MB"] * params["factor"], band, side) &
+            above(features["close"], features["open"], side) & features.trend("MA21", -side))
+
+def retest_confirmed(features, side, params):
+    """條件11/12 最新一根的門檻：MACD/收盤價 > macd_ratio 且 收盤價/MA233 > ma233_ratio（空方反向）"""
+    c = features["close"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (above(features["MACD"] / c, params["macd_ratio"], side) &
+                above(c / features["MA233"], params["ma233_ratio"], side))
+
+# 條件1-10，依 check_signals 的輸出順序宣告
+SCAN_RULES = (
+    Rule("量增", volume_surge, BULLISH, {"ratio": 3}),
+    Rule("短多", wick_rejection, BULLISH, {"body_ratio": 2}, "短空", {"body_ratio": 2}, requires="量增"),
+    Rule("長空", ma_cross, BEARISH, {}, "長多", {}),
+    Rule("MACD轉強", macd_cross, BULLISH, {"dif_ratio": 0.005}, "MACD轉弱", {"dif_ratio": -0.005}),
+    Rule("振幅", amplitude, BULLISH, {"threshold": 0.03}),
+    Rule("布林反轉向上", bollinger_reversal, BULLISH, {"factor": 0.86}, "布林反轉向下", {"factor": 1.14})
+)
+
+# 條件11（長空後 MACD 負轉正）/條件12（長多後 MACD 正轉負），record_type 為回溯的記錄類型
+RETEST_RULES = (
+    Rule("空方回測續弱", retest_confirmed, BULLISH, {"record_type": "長空", "macd_ratio": 0.001, "ma233_ratio": 0.96},
+         "多方回測續強", {"record_type": "長多", "macd_ratio": -0.001, "ma233_ratio": 1.04}),
+)
+
+CompiledRule = namedtuple("CompiledRule", "name side params evaluate requires")
+
+def compile_rules(rules):
+    """將宣告展開為依輸出順序排列的 CompiledRule（主條件後緊接鏡像條件），判斷式綁定方向與參數"""
+    compiled = []
+    for rule in rules:
+        variants = [(rule.name, rule.side, rule.params)]
+        if rule.mirror:
+            variants.append((rule.mirror, -rule.side, rule.mirror_params if rule.mirror_params is not None else rule.params))
+        for name, side, params in variants:
+            compiled.append(CompiledRule(name, side, params, partial(rule.predicate, side=side, params=params), rule.requires))
+    return tuple(compiled)
+
+COMPILED_SCAN_RULES = compile_rules(SCAN_RULES)
+COMPILED_RETEST_RULES = compile_rules(RETEST_RULES)
+
+def evaluate_rules(features, rules=COMPILED_SCAN_RULES):
+    """以共用特徵計算每個條件的布林遮罩，回傳依宣告順序排列的 {訊號類型: 遮罩}"""
+    if not isinstance(features, Features):
+        features = Features(features)
+    masks = {}
+    with np.errstate(invalid="ignore"):
+        for rule in rules:
+            mask = rule.evaluate(features)
+            if rule.requires:
+                mask = mask & masks[rule.requires]
+            masks[rule.name] = mask
+    return masks
+
+def retest_blockers(rule):
+    """記錄之後出現這些類型的訊號時不再檢查該記錄：本身的回測訊號與任何長空/長多"""
+    return (rule.name, "長多", "長空")
+
+def retest_crossing(macd, side):
+    """MACD 第一次由負轉正（空方為由正轉負）的位置，沒有則回傳 None"""
+    macd = np.asarray(macd, dtype=np.float64)
+    crossings = np.flatnonzero(above(0, macd[:-1], side) & above(macd[1:], 0, side))
+    return int(crossings[0]) + 1 if len(crossings) else None
+
+def scalar_features(values):
+    """將單一交易對的最新指標值（None 代表尚未形成）轉為長度 1 的特徵陣列"""
+    def to_array(value):
+        return np.array([np.nan if value is None else float(value)], dtype=np.float64)
+    return Features({
+        key: [to_array(item) for item in value] if isinstance(value, (list, tuple)) else to_array(value)
+        for key, value in values.items()
+    })
+
+def triggered(masks, index=0):
+    """回傳第 index 筆觸發的訊號類型（依宣告順序）"""
+    return [name for name, mask in masks.items() if mask[index]]
@@ -0,0 +1,186 @@
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS signal_rows (
+        row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        trading_pair TEXT NOT NULL,
+        open_time INTEGER NOT NULL,
+        signal_types TEXT NOT NULL,
+        recorded_at INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS signals (
+        trading_pair TEXT NOT NULL,
+        open_time INTEGER NOT NULL,
+        signal_type TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        PRIMARY KEY (trading_pair, open_time, signal_type, row_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_signals_type_time ON signals (signal_type, open_time)",
+    "CREATE INDEX IF NOT EXISTS idx_signal_rows_open_time ON signal_rows (open_time)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+)
+
+class SignalStore:
+    """
+    本地 SQLite 訊號資料庫，每寫入一列 15min 記錄就同步保存一筆
+    signals 表以 (交易對, 開盤時間, 訊號類型) 為索引，回溯查詢只需一次範圍查詢，不必下載整個工作表
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM signal_rows LIMIT 1").fetchone() is None
+
+    def get_meta(self, key, default=None):
+        """讀取 meta 表中的設定值（例如一次性遷移的完成標記）"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"寫入 {self.path} 設定 {key} 失敗: {e}")
+            return False
+
+    def _insert(self, trading_pair, open_time_ms, signal_types, recorded_at):
+        cursor = self._conn.execute(
+            "INSERT INTO signal_rows (trading_pair, open_time, signal_types, recorded_at) VALUES (?, ?, ?, ?)",
+            (trading_pair, int(open_time_ms), ", ".join(signal_types), recorded_at)
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO signals (trading_pair, open_time, signal_type, row_id) VALUES (?, ?, ?, ?)",
+            [(trading_pair, int(open_time_ms), signal_type, cursor.lastrowid) for signal_type in signal_types]
+        )
+
+    def record(self, trading_pair, open_time_ms, signal_types):
+        """保存一列訊號記錄（對應 15min 工作表的一列）"""
+        try:
+            with self._lock, self._conn:
+                self._insert(trading_pair, open_time_ms, signal_types, int(time.time() * 1000))
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"寫入 {trading_pair} 訊號記錄到 {self.path} 失敗: {e}")
+            return False
+
+    def record_many(self, records):
+        """以單一交易批次保存多筆 (交易對, 開盤時間毫秒, 訊號類型列表) 記錄，回傳保存筆數"""
+        recorded_at = int(time.time() * 1000)
+        try:
+            with self._lock, self._conn:
+                for trading_pair, open_time_ms, signal_types in records:
+                    self._insert(trading_pair, open_time_ms, signal_types, recorded_at)
+            return len(records)
+        except sqlite3.Error as e:
+            logger.error(f"批次寫入訊號記錄到 {self.path} 失敗: {e}")
+            return 0
+
+    def query(self, since_ms, signal_types):
+        """
+        取得開盤時間 >= since_ms 且包含任一指定訊號類型的記錄，依開盤時間與寫入順序排序
+        回傳 [{"trading_pair", "open_time"（毫秒）, "signal_types"}]
+        """
+        placeholders = ", ".join("?" for _ in signal_types)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT trading_pair, open_time, signal_types FROM signal_rows
+                WHERE row_id IN (
+                    SELECT row_id FROM signals WHERE signal_type IN ({placeholders}) AND open_time >= ?
+                )
+                ORDER BY open_time, row_id
+                """,
+                (*signal_types, int(since_ms))
+            ).fetchall()
+        return [
+            {"trading_pair": trading_pair, "open_time": open_time, "signal_types": signal_types_text.split(", ")}
+            for trading_pair, open_time, signal_types_text in rows
+        ]
+
+    def prune(self, before_ms):
+        """刪除開盤時間早於 before_ms 的記錄，回傳刪除筆數"""
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM signals WHERE row_id IN (SELECT row_id FROM signal_rows WHERE open_time < ?)", (int(before_ms),))
+                deleted = self._conn.execute("DELETE FROM signal_rows WHERE open_time < ?", (int(before_ms),)).rowcount
+            if deleted:
+                logger.info(f"已從 {self.path} 刪除 {deleted} 筆過期訊號記錄")
+            return deleted
+        except sqlite3.Error as e:
+            logger.error(f"清理 {self.path} 過期訊號記錄失敗: {e}")
+            return 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class SignalIndex:
+    """
+    本次執行的近期訊號記憶體索引：依交易對與訊號類型保存按開盤時間排序的陣列
+    以 bisect 查詢「某時間之後是否有指定類型的訊號」，不必每次線性掃描所有記錄
+    records 需為 [{"trading_pair", "open_time", "signal_types"}] 且已依開盤時間排序
+    """
+
+    def __init__(self, records):
+        self._records = {}
+        self._times = {}
+        self._positions = {}
+        for position, record in enumerate(records):
+            trading_pair = record["trading_pair"]
+            self._records.setdefault(trading_pair, []).append(record)
+            for signal_type in set(record["signal_types"]):
+                key = (trading_pair, signal_type)
+                self._times.setdefault(key, []).append(record["open_time"])
+                self._positions.setdefault(key, []).append(position)
+        self._all = list(records)
+
+    def __len__(self):
+        return len(self._all)
+
+    def pairs(self):
+        """依首次出現順序回傳不重複的交易對"""
+        return list(self._records)
+
+    def records(self, trading_pair, signal_type=None):
+        """回傳交易對的記錄（可限定包含指定訊號類型），依開盤時間排序"""
+        if signal_type is None:
+            return list(self._records.get(trading_pair, []))
+        return [self._all[position] for position in self._positions.get((trading_pair, signal_type), [])]
+
+    def first_after(self, trading_pair, open_time, signal_types):
+        """回傳開盤時間晚於 open_time 且包含任一指定訊號類型的第一筆記錄，沒有則回傳 None"""
+        first = None
+        for signal_type in signal_types:
+            key = (trading_pair, signal_type)
+            times = self._times.get(key)
+            if not times:
+                continue
+            index = bisect.bisect_right(times, open_time)
+            if index < len(times):
+                position = self._positions[key][index]
+                if first is None or position < first:
+                    first = position
+        return None if first is None else self._all[first]
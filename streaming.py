@@ -0,0 +1,134 @@
+import logging
+import os
+import json
+import queue
+import threading
+import websocket
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+STREAM_URL = os.environ.get("BINANCE_WS_URL", "wss://fstream.binance.com")
+# 幣安合約單一連線可訂閱的串流數量上限
+MAX_STREAMS_PER_CONNECTION = 200
+
+def kline_event_to_row(k):
+    """將 WebSocket kline 事件中的 k 物件轉換為與 REST /fapi/v1/klines 相同格式的列表"""
+    return [
+        int(k["t"]), k["o"], k["h"], k["l"], k["c"], k["v"],
+        int(k["T"]), k["q"], int(k["n"]), k["V"], k["Q"], k.get("B", "0")
+    ]
+
+class KlineStream:
+    """
+    訂閱幣安合約 <symbol>@kline_<interval> 組合串流，將推送的 K 線即時寫入 KlineStore，
+    並在 K 線收盤（x: true）時將 (交易對, 開盤時間) 放入 closed_bars 佇列供訊號檢查使用
+    """
+
+    def __init__(self, symbols, interval, kline_store, base_url=STREAM_URL, reconnect_delay=5):
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.kline_store = kline_store
+        self.base_url = base_url.rstrip("/")
+        self.reconnect_delay = reconnect_delay
+        self.closed_bars = queue.Queue()
+        self._stale = set()
+        self._stale_lock = threading.Lock()
+        # 各交易對最後一根已放入佇列的收盤 K 線（重送或重連後重複推送的收盤事件只檢查一次）
+        self._last_closed = {}
+        self._connected = set()
+        self._stop = threading.Event()
+        self._threads = []
+        self._apps = []
+
+    def stream_urls(self):
+        """依單一連線上限將交易對分組，回傳各連線的組合串流 URL"""
+        streams = [f"{symbol.lower()}@kline_{self.interval}" for symbol in self.symbols]
+        return [
+            f"{self.base_url}/stream?streams={'/'.join(streams[i:i + MAX_STREAMS_PER_CONNECTION])}"
+            for i in range(0, len(streams), MAX_STREAMS_PER_CONNECTION)
+        ]
+
+    def handle_message(self, raw):
+        """處理單筆串流訊息（可直接以錄製的訊息重播），收盤時回傳 (交易對, 開盤時間)，否則回傳 None"""
+        try:
+            message = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+            data = message.get("data", message)
+            if data.get("e") != "kline":
+                return None
+            k = data["k"]
+            symbol = data.get("s", k.get("s"))
+            kline = kline_event_to_row(k)
+        except Exception as e:
+            logger.warning(f"解析 K 線串流訊息失敗: {e}")
+            return None
+
+        if not self.kline_store.apply_kline(symbol, self.interval, kline):
+            self.mark_stale(symbol)
+        if k.get("x"):
+            with self._stale_lock:
+                if kline[0] <= self._last_closed.get(symbol, -1):
+                    return None
+                self._last_closed[symbol] = kline[0]
+            closed = (symbol, kline[0])
+            self.closed_bars.put(closed)
+            return closed
+        return None
+
+    def handle_open(self, url, symbols):
+        """連線建立時呼叫：同一連線重新連線時，期間可能漏掉 K 線，標記其交易對在收盤時先以 REST 補齊"""
+        logger.info(f"K 線串流已連線，訂閱 {len(symbols)} 個交易對")
+        if url in self._connected:
+            self.mark_stale(symbols)
+        self._connected.add(url)
+
+    def mark_stale(self, symbols):
+        """標記需要以 REST 補齊缺漏 K 線的交易對"""
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        with self._stale_lock:
+            self._stale.update(symbols)
+
+    def pop_stale(self, symbol):
+        """若交易對被標記為需要補齊則清除標記並回傳 True"""
+        with self._stale_lock:
+            if symbol in self._stale:
+                self._stale.discard(symbol)
+                return True
+            return False
+
+    def _run_connection(self, url, symbols):
+        while not self._stop.is_set():
+            app = websocket.WebSocketApp(
+                url,
+                on_open=lambda ws: self.handle_open(url, symbols),
+                on_message=lambda ws, message: self.handle_message(message),
+                on_error=lambda ws, error: logger.error(f"K 線串流發生錯誤: {error}"),
+                on_close=lambda ws, status, reason: logger.warning(f"K 線串流已關閉: {status} {reason}")
+            )
+            self._apps.append(app)
+            try:
+                app.run_forever(ping_interval=60, ping_timeout=20)
+            except Exception as e:
+                logger.error(f"K 線串流執行失敗: {e}")
+            finally:
+                self._apps.remove(app)
+            if not self._stop.is_set():
+                logger.info(f"{self.reconnect_delay} 秒後重新連線 K 線串流")
+                self._stop.wait(self.reconnect_delay)
+
+    def start(self):
+        """為每組交易對啟動一個背景連線執行緒"""
+        for i, url in enumerate(self.stream_urls()):
+            symbols = self.symbols[i * MAX_STREAMS_PER_CONNECTION:(i + 1) * MAX_STREAMS_PER_CONNECTION]
+            thread = threading.Thread(target=self._run_connection, args=(url, symbols), name=f"kline-stream-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"啟動 {len(self._threads)} 個 K 線串流連線，共 {len(self.symbols)} 個交易對")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for app in list(self._apps):
+            app.close()
+        for thread in self._threads:
+            thread.join(timeout)
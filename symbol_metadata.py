@@ -0,0 +1,101 @@
+import logging
+import os
+import json
+import threading
+import time
+
+# 設定日誌記錄
+logger = logging.getLogger(__name__)
+
+def parse_symbol(symbol):
+    """從 exchangeInfo 的單一交易對資料取出需要保存的欄位"""
+    filters = {f.get("filterType"): f for f in symbol.get("filters", [])}
+    return {
+        "status": symbol.get("status"),
+        "contract_type": symbol.get("contractType"),
+        "quote_asset": symbol.get("quoteAsset"),
+        "price_precision": symbol.get("pricePrecision"),
+        "quantity_precision": symbol.get("quantityPrecision"),
+        "tick_size": filters.get("PRICE_FILTER", {}).get("tickSize"),
+        "step_size": filters.get("LOT_SIZE", {}).get("stepSize"),
+        "onboard_date": int(symbol["onboardDate"]) if symbol.get("onboardDate") else None
+    }
+
+class SymbolMetadataCache:
+    """
+    交易對資訊快取（tick size、精度、上架時間、合約類型），保存在磁碟並依 TTL 更新
+    過期時先回傳舊資料並在背景更新，冷啟動時從磁碟載入，只有完全沒有資料時才同步抓取
+    fetch_func() 需回傳 /fapi/v1/exchangeInfo 的 JSON，失敗時回傳 None
+    """
+
+    def __init__(self, path, fetch_func, ttl=3600, clock=time.time):
+        self.path = path
+        self.fetch_func = fetch_func
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._symbols = None
+        self._fetched_at = 0.0
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self._symbols = data["symbols"]
+            self._fetched_at = float(data["fetched_at"])
+            logger.info(f"從 {self.path} 載入 {len(self._symbols)} 個交易對資訊")
+        except Exception as e:
+            logger.warning(f"讀取交易對資訊快取 {self.path} 失敗: {e}")
+
+    def _save(self, symbols, fetched_at):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"fetched_at": fetched_at, "symbols": symbols}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"寫入交易對資訊快取 {self.path} 失敗: {e}")
+
+    def refresh(self):
+        """同步抓取 exchangeInfo 並更新快取，成功回傳 True"""
+        with self._refreshing:
+            data = self.fetch_func()
+            if not data or "symbols" not in data:
+                logger.warning("更新交易對資訊失敗，沿用快取資料")
+                return False
+            symbols = {symbol["symbol"]: parse_symbol(symbol) for symbol in data["symbols"]}
+            fetched_at = self._clock()
+            with self._lock:
+                self._symbols = symbols
+                self._fetched_at = fetched_at
+            self._save(symbols, fetched_at)
+            logger.info(f"已更新 {len(symbols)} 個交易對資訊")
+            return True
+
+    def _refresh_in_background(self):
+        if self._refreshing.locked():
+            return
+        threading.Thread(target=self.refresh, name="symbol-metadata-refresh", daemon=True).start()
+
+    def symbols(self):
+        """回傳 {交易對: 資訊}（依 exchangeInfo 順序），過期時在背景更新"""
+        with self._lock:
+            if self._symbols is None:
+                self._load()
+            symbols, fetched_at = self._symbols, self._fetched_at
+        if symbols is None:
+            self.refresh()
+            with self._lock:
+                return self._symbols or {}
+        if self._clock() - fetched_at >= self.ttl:
+            self._refresh_in_background()
+        return symbols
+
+    def get(self, symbol):
+        return self.symbols().get(symbol)
+
+    def onboard_dates(self):
+        return {symbol: info["onboard_date"] for symbol, info in self.symbols().items() if info.get("onboard_date")}
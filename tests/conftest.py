@@ -0,0 +1,34 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INTERVAL_MS = 15 * 60 * 1000
+
+def generate_klines(seed, count, start_ms=1_700_000_000_000):
+    """產生幣安格式的 15m K 線（隨機漫步，價格精度依 seed 而不同）"""
+    rng = random.Random(seed)
+    digits = rng.choice([2, 4, 6])
+    price = rng.uniform(1, 10) * 10 ** rng.choice([-2, 0, 3])
+    klines = []
+    for i in range(count):
+        open_time = start_ms + i * INTERVAL_MS
+        close = max(price * (1 + rng.gauss(0, 0.006)), 10 ** -digits)
+        high = max(price, close) * (1 + abs(rng.gauss(0, 0.004)))
+        low = min(price, close) * (1 - abs(rng.gauss(0, 0.004)))
+        volume = rng.uniform(100, 1000)
+        quote_volume = rng.uniform(2e4, 2e5) * (6 if rng.random() < 0.08 else 1)
+        fmt = lambda value: f"{value:.{digits}f}"
+        klines.append([
+            open_time, fmt(price), fmt(high), fmt(low), fmt(close), f"{volume:.3f}", open_time + INTERVAL_MS - 1,
+            f"{quote_volume:.4f}", rng.randint(10, 999), f"{volume / 2:.3f}", f"{quote_volume / 2:.4f}", "0"
+        ])
+        price = float(fmt(close))
+    return klines
+
+@pytest.fixture
+def make_klines():
+    return generate_klines
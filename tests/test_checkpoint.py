@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+
+from calculator import IndicatorState
+from checkpoint import CHECKPOINT_VERSION, Checkpoint, frame_rows
+from kline_frame import KlineFrame
+
+def test_save_load_round_trip(tmp_path, make_klines):
+    klines = {"BTCUSDT": make_klines(1, 520)[-500:], "ETHUSDT": make_klines(2, 300)}
+    frames = {symbol: KlineFrame.from_klines(rows) for symbol, rows in klines.items()}
+    states = {symbol: IndicatorState.from_klines(frame) for symbol, frame in frames.items()}
+    signals = [{"trading_pair": "BTCUSDT", "open_time": int(frames["BTCUSDT"].open_time[-1]), "signal_types": ["長多"]}]
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint"))
+    assert checkpoint.save(frames, states, signals, "15m")
+
+    data = checkpoint.load()
+    assert data["interval"] == "15m"
+    assert data["signals"] == signals
+    for symbol, rows in klines.items():
+        restored = frame_rows(data["klines"][symbol])
+        assert [int(row[0]) for row in restored] == [row[0] for row in rows]
+        np.testing.assert_array_equal(KlineFrame.from_klines(restored).close, frames[symbol].close)
+        assert data["indicator_states"][symbol].to_state() == states[symbol].to_state()
+
+def test_state_behind_forming_bar(tmp_path, make_klines):
+    # 串流模式的 K 線視窗最後一根仍在形成中，指標狀態只更新到前一根已收盤的 K 線
+    rows = make_klines(3, 520)
+    state = IndicatorState.from_klines(KlineFrame.from_klines(rows[:519]))
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint"))
+    assert checkpoint.save({"BTCUSDT": KlineFrame.from_klines(rows[-500:])}, {"BTCUSDT": state}, [], "15m")
+    restored = checkpoint.load()["indicator_states"]["BTCUSDT"]
+    assert restored.to_state() == state.to_state()
+    assert restored.rounded_values() == state.rounded_values()
+
+def test_load_rejects_other_versions(tmp_path, make_klines):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint"))
+    assert checkpoint.load() is None
+    frames = {"BTCUSDT": KlineFrame.from_klines(make_klines(4, 50))}
+    assert checkpoint.save(frames, {}, [], "15m")
+    with open(checkpoint.meta_path) as f:
+        meta = json.load(f)
+    meta["version"] = CHECKPOINT_VERSION + 1
+    with open(checkpoint.meta_path, "w") as f:
+        json.dump(meta, f)
+    assert checkpoint.load() is None
@@ -0,0 +1,73 @@
+import json
+import math
+
+import pytest
+
+from calculator import IndicatorState
+from cross_section import latest_indicators, stack_klines
+from kline_frame import KlineFrame
+
+KEYS = ("MA34", "MA34_prev", "MA233", "MA233_prev", "VOL8", "VOL21", "DIF", "DEA", "MACD", "MACD_prev",
+        "BOLL_UP", "BOLL_MB", "BOLL_DN")
+
+def batch_values(klines):
+    """以批次（截面）計算取得最新一根 K 線的指標，NaN 轉為 None"""
+    indicators = latest_indicators(stack_klines([KlineFrame.from_klines(klines[-500:])]))
+    to_value = lambda value: None if math.isnan(value) else float(value)
+    values = {key: to_value(indicators[key][0]) for key in KEYS}
+    values["MA21_history"] = [to_value(value) for value in indicators["MA21"][0]]
+    values["MA21"] = values["MA21_history"][-1]
+    return values
+
+def assert_matches_batch(state, klines):
+    values = state.rounded_values()
+    expected = batch_values(klines)
+    assert {key: values[key] for key in expected} == expected
+
+@pytest.mark.parametrize("seed", range(4))
+def test_update_matches_batch(make_klines, seed):
+    klines = make_klines(seed, 650)
+    state = IndicatorState()
+    for i, kline in enumerate(klines):
+        if i % 5 == 0:
+            # 形成中的 K 線先以另一個收盤價更新，再以收盤後的數值修正
+            forming = list(kline)
+            forming[4] = str(float(kline[4]) * 1.01)
+            state.update(forming)
+        state.update(kline)
+        if i >= 250 and i % 7 == 0:
+            assert_matches_batch(state, klines[:i + 1])
+
+@pytest.mark.parametrize("seed", range(4, 6))
+def test_from_klines_then_update_matches_batch(make_klines, seed):
+    klines = make_klines(seed, 600)
+    state = IndicatorState.from_klines(KlineFrame.from_klines(klines[:300]))
+    assert_matches_batch(state, klines[:300])
+    for i in range(300, len(klines)):
+        state.update(klines[i])
+        if i % 50 == 0:
+            state = IndicatorState.from_state(json.loads(json.dumps(state.to_state())))
+        if i % 7 == 0:
+            assert_matches_batch(state, klines[:i + 1])
+
+def test_update_ignores_older_bars(make_klines):
+    klines = make_klines(6, 40)
+    state = IndicatorState.from_klines(KlineFrame.from_klines(klines))
+    before = state.to_state()
+    assert state.update(klines[10]) is False
+    assert state.to_state() == before
+
+def test_window_macd_fallback_matches_batch(make_klines):
+    # 捨入單位 < 收盤價 1e-9 時 MACD 改以視窗重新遞推；形成中的 K 線修正後不可沿用快取
+    klines = make_klines(7, 560)
+    for i, kline in enumerate(klines):
+        kline[4] = f"{12345 + float(kline[4]) / 1000 + i * 1e-6:.6f}"
+    state = IndicatorState.from_klines(KlineFrame.from_klines(klines[:500]))
+    for i in range(500, len(klines)):
+        forming = list(klines[i])
+        forming[4] = f"{float(klines[i][4]) + 0.000123:.6f}"
+        state.update(forming)
+        state.rounded_values()
+        state.update(klines[i])
+        if i % 6 == 0:
+            assert_matches_batch(state, klines[:i + 1])
@@ -0,0 +1,118 @@
+import pytest
+import requests
+
+from notification import MAX_MESSAGE_LENGTH, TelegramNotifier, pack_messages
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self._body = body or {"ok": status_code == 200}
+        self.headers = headers or {}
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"HTTP {self.status_code}", response=self)
+
+class FakeBotApi:
+    """依序回傳預先設定的回應（"timeout" 代表逾時），並記錄每次請求"""
+
+    def __init__(self, responses=None):
+        self.responses = list(responses or [])
+        self.posts = []
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append((url, json))
+        response = self.responses.pop(0) if self.responses else FakeResponse(200)
+        if response == "timeout":
+            raise requests.exceptions.Timeout("timed out")
+        return response
+
+def make_notifier(api, clock, **kwargs):
+    return TelegramNotifier("TOKEN", "chat", api_url="http://bot.local/", session=api, clock=clock,
+                            sleep=clock.sleep, **kwargs)
+
+def test_429_sleeps_for_retry_after_and_retries():
+    clock = FakeClock()
+    api = FakeBotApi([FakeResponse(429, {"ok": False, "parameters": {"retry_after": 7}})])
+    notifier = make_notifier(api, clock, min_interval=0)
+    assert notifier._send_with_retry("chat", "hello")
+    assert clock.sleeps == [7.0]
+    assert len(api.posts) == 2
+    assert api.posts[0] == ("http://bot.local/botTOKEN/sendMessage", {"chat_id": "chat", "text": "hello"})
+    assert (notifier.sent, notifier.retried, notifier.failed) == (1, 1, 0)
+
+@pytest.mark.parametrize("status_code", [400, 401, 403])
+def test_client_errors_are_not_retried(status_code):
+    clock = FakeClock()
+    api = FakeBotApi([FakeResponse(status_code, {"ok": False})])
+    notifier = make_notifier(api, clock, min_interval=0)
+    assert not notifier._send_with_retry("chat", "hello")
+    assert len(api.posts) == 1
+    assert clock.sleeps == []
+    assert (notifier.sent, notifier.retried, notifier.failed) == (0, 0, 1)
+
+@pytest.mark.parametrize("failure", [FakeResponse(502), "timeout"])
+def test_server_errors_and_timeouts_are_retried(failure):
+    clock = FakeClock()
+    api = FakeBotApi([failure, failure])
+    notifier = make_notifier(api, clock, min_interval=0)
+    assert notifier._send_with_retry("chat", "hello")
+    assert len(api.posts) == 3
+    assert clock.sleeps == [1, 2]
+
+def test_retries_stop_after_max_retries():
+    clock = FakeClock()
+    api = FakeBotApi([FakeResponse(500)] * 3)
+    notifier = make_notifier(api, clock, min_interval=0, max_retries=3)
+    assert not notifier._send_with_retry("chat", "hello")
+    assert len(api.posts) == 3
+    assert notifier.failed == 1
+
+def test_min_interval_is_enforced_per_chat():
+    clock = FakeClock()
+    api = FakeBotApi()
+    notifier = make_notifier(api, clock, min_interval=1.0)
+    notifier._send_with_retry("a", "1")
+    clock.now += 0.25
+    notifier._send_with_retry("b", "2")
+    assert clock.sleeps == []
+    notifier._send_with_retry("a", "3")
+    assert clock.sleeps == [pytest.approx(0.75)]
+    notifier._send_with_retry("b", "4")
+    assert clock.sleeps[-1] == pytest.approx(0.25)
+    assert [body["chat_id"] for _, body in api.posts] == ["a", "b", "a", "b"]
+
+def test_flush_sends_digest_through_worker():
+    clock = FakeClock()
+    api = FakeBotApi()
+    notifier = make_notifier(api, clock, min_interval=0)
+    notifier.add("first")
+    notifier.add("second")
+    assert notifier.flush() == 1
+    assert notifier.join(timeout=5)
+    assert api.posts[0][1]["text"] == "first\n\nsecond"
+
+def test_pack_messages_respects_limit():
+    messages = [f"訊號 {i} " + "x" * (i * 37 % 900) for i in range(200)] + ["y" * 10000, "z"]
+    digests = pack_messages(messages)
+    assert all(len(digest) <= MAX_MESSAGE_LENGTH for digest in digests)
+    # 過長的單則訊息被切開，內容與順序保留
+    assert "".join(digests).replace("\n\n", "") == "".join(messages)
+    assert pack_messages([]) == []
+    assert pack_messages(["a" * MAX_MESSAGE_LENGTH]) == ["a" * MAX_MESSAGE_LENGTH]
+    assert pack_messages(["a" * 9, "b" * 9], max_length=10) == ["a" * 9, "b" * 9]
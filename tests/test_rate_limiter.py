@@ -0,0 +1,115 @@
+import importlib
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rate_limiter import USED_WEIGHT_HEADER, WeightRateLimiter
+
+class FakeClock:
+    """以 sleep 推進的假時鐘（同時作為 monotonic 與 wall clock）"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def make_limiter(clock, **kwargs):
+    # weight_limit=2400、safety_ratio=0.9：容量 2160，每秒回補 36
+    return WeightRateLimiter(clock=clock, wall_clock=clock, sleep=clock.sleep, **kwargs)
+
+class FakeResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+def test_acquire_blocks_until_tokens_refill():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    assert limiter.acquire(2160) == 0.0
+    assert limiter.acquire(72) == pytest.approx(2.0)
+    assert clock.now == pytest.approx(2.0)
+    assert limiter.snapshot()["tokens"] == 0
+
+def test_headers_only_lower_the_budget():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    limiter.acquire(2000)
+    # 較早請求的回應只回報 10，仍在途中的 2000 不可退回
+    limiter.update_from_headers({USED_WEIGHT_HEADER: "10"})
+    assert limiter.snapshot()["tokens"] == 160
+    limiter.update_from_headers({USED_WEIGHT_HEADER: "2100"})
+    assert limiter.snapshot()["tokens"] == 60
+    assert limiter.snapshot()["used_weight"] == 2100
+
+def test_used_weight_at_capacity_blocks_until_next_window():
+    clock = FakeClock(now=15.0)
+    limiter = make_limiter(clock)
+    limiter.update_from_headers({USED_WEIGHT_HEADER: "2160"})
+    # 時間窗口在第 60 秒重置
+    assert limiter.acquire(1) == pytest.approx(45.0)
+    assert clock.now == pytest.approx(60.0)
+
+def test_penalize_honors_retry_after():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    limiter.update_from_response(FakeResponse(429, {"Retry-After": "7"}))
+    assert limiter.acquire(36) == pytest.approx(7.0)
+    limiter.update_from_response(FakeResponse(418, {}))
+    # 沒有 Retry-After 時暫停到下一個時間窗口
+    assert limiter.acquire(1) == pytest.approx(60.0 - 7.0)
+
+class StubBinanceHandler(BaseHTTPRequestHandler):
+    """第一次回應 429（Retry-After: 0），之後回應 K 線與已用權重標頭"""
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(self.path)
+        if len(type(self).requests) == 1:
+            body, status, headers = b'{"code":-1003}', 429, {"Retry-After": "0", USED_WEIGHT_HEADER: "2100"}
+        else:
+            klines = [[1700000000000, "1.0", "1.1", "0.9", "1.05", "10", 1700000899999, "10.5", 3, "5", "5.2", "0"]]
+            body, status, headers = json.dumps(klines).encode(), 200, {USED_WEIGHT_HEADER: "12"}
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    StubBinanceHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBinanceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_get_klines_retries_after_throttle(stub_server, monkeypatch):
+    monkeypatch.setenv("BINANCE_FUTURES_API_URL", stub_server)
+    if "main" in sys.modules:
+        monkeypatch.setattr(sys.modules["main"], "FUTURES_API_URL", stub_server)
+        main = sys.modules["main"]
+    else:
+        importlib.reload(importlib.import_module("binance_api"))
+        main = importlib.import_module("main")
+    assert main.FUTURES_API_URL == stub_server
+
+    klines = main.get_klines("BTCUSDT", "15m", 99, 1700000000000)
+    assert klines and klines[0][0] == 1700000000000
+    assert len(StubBinanceHandler.requests) == 2
+    assert all("symbol=BTCUSDT" in path and "startTime=1700000000000" in path for path in StubBinanceHandler.requests)
+    assert main.rate_limiter.snapshot()["used_weight"] == 12
@@ -0,0 +1,137 @@
+import json
+
+from sheet_wal import SheetWriteLog, row_key
+
+def test_append_keeps_identical_rows(tmp_path):
+    log = SheetWriteLog(str(tmp_path / "sheet_wal.jsonl"), fsync_interval=0)
+    assert not log.has_pending()
+    assert log.append("15min", [["a", 1], ["b", 2]], timestamp="2024-01-01 00:00:00") == 2
+    # 內容相同的列在不同時間各失敗一次，兩筆都要保留
+    log.append("15min", [["a", 1]])
+    log.append("record", [["a", 1]])
+    assert log.has_pending()
+    pending = log.pending()
+    assert [(entry["sheet_name"], entry["data"]) for entry in pending] == [
+        ("15min", ["a", 1]), ("15min", ["b", 2]), ("15min", ["a", 1]), ("record", ["a", 1])
+    ]
+    assert len({entry["key"] for entry in pending}) == 4
+    assert [entry["seq"] for entry in pending] == sorted({entry["seq"] for entry in pending})
+    assert pending[0]["key"] == row_key("15min", ["a", 1], pending[0]["seq"])
+    assert pending[0]["timestamp"] == "2024-01-01 00:00:00"
+
+def test_sequence_survives_restart(tmp_path):
+    path = str(tmp_path / "sheet_wal.jsonl")
+    SheetWriteLog(path, fsync_interval=0).append("15min", [["a"]])
+    SheetWriteLog(path, fsync_interval=0).append("15min", [["a"]])
+    assert len({entry["key"] for entry in SheetWriteLog(path).pending()}) == 2
+
+def test_replay_writes_each_row_once(tmp_path):
+    log = SheetWriteLog(str(tmp_path / "sheet_wal.jsonl"), fsync_interval=0)
+    log.append("15min", [[i] for i in range(5)])
+    log.append("record", [["x"]])
+    written = []
+    assert log.replay(lambda sheet_name, rows: written.append((sheet_name, rows)) or True, batch_size=2) == 6
+    assert written == [("15min", [[0], [1]]), ("15min", [[2], [3]]), ("15min", [[4]]), ("record", [["x"]])]
+    assert not log.has_pending()
+    assert log.replay(lambda sheet_name, rows: True) == 0
+
+def test_failed_replay_keeps_remaining_rows(tmp_path):
+    path = tmp_path / "sheet_wal.jsonl"
+    log = SheetWriteLog(str(path), fsync_interval=0)
+    log.append("15min", [[i] for i in range(4)])
+    calls = []
+
+    def append_func(sheet_name, rows):
+        calls.append(rows)
+        return len(calls) == 1
+
+    assert log.replay(append_func, batch_size=2) == 2
+    # 失敗後以未重播的項目重寫日誌
+    assert [entry["data"] for entry in log.pending()] == [[2], [3]]
+    # 失敗的批次保留寫入意圖（逾時的請求仍可能已寫入），已確認的記錄隨日誌改寫一併清除
+    done_lines = (tmp_path / "sheet_wal.jsonl.done").read_text(encoding="utf-8").splitlines()
+    assert done_lines == [f"? {entry['key']}" for entry in log.pending()]
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 2
+    assert SheetWriteLog(str(path)).replay(lambda sheet_name, rows: True) == 2
+
+def test_compact_skips_torn_lines_and_done_keys(tmp_path):
+    path = tmp_path / "sheet_wal.jsonl"
+    log = SheetWriteLog(str(path), fsync_interval=0)
+    log.append("15min", [["a"], ["b"], ["c"]])
+    log.mark_done([log.pending()[0]["key"]])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "torn"')
+    assert log.compact() == 2
+    assert [entry["data"] for entry in log.pending()] == [["b"], ["c"]]
+    log.mark_done([entry["key"] for entry in log.pending()])
+    assert log.compact() == 0
+    assert not path.exists()
+
+def crash_after_append(log, written):
+    """模擬重播在 append_func 成功之後、確認之前中斷"""
+    class Crash(Exception):
+        pass
+
+    def append_func(sheet_name, rows):
+        written.extend(rows)
+        raise Crash()
+
+    try:
+        log.replay(append_func)
+    except Crash:
+        pass
+
+def test_crash_before_confirm_is_resolved_by_exists_func(tmp_path):
+    path = str(tmp_path / "sheet_wal.jsonl")
+    log = SheetWriteLog(path, fsync_interval=0)
+    log.append("15min", [["a"], ["b"]])
+    sheet = []
+    crash_after_append(log, sheet)
+    assert sheet == [["a"], ["b"]]
+
+    restarted = SheetWriteLog(path, fsync_interval=0)
+    restarted.append("15min", [["a"]])
+    assert len(restarted.in_doubt()) == 2
+    checked = []
+
+    def exists_func(sheet_name, rows):
+        checked.append(rows)
+        return [row in sheet for row in rows]
+
+    assert restarted.replay(lambda sheet_name, rows: sheet.extend(rows) or True, exists_func=exists_func) == 1
+    # 只有中斷的兩列需要比對；之後新記錄的相同內容仍會寫入一次
+    assert checked == [[["a"], ["b"]]]
+    assert sheet == [["a"], ["b"], ["a"]]
+    assert not restarted.has_pending()
+    assert not (tmp_path / "sheet_wal.jsonl.done").exists()
+
+def test_in_doubt_rows_wait_when_sheet_unreadable(tmp_path):
+    path = str(tmp_path / "sheet_wal.jsonl")
+    log = SheetWriteLog(path, fsync_interval=0)
+    log.append("15min", [["a"]])
+    log.append("record", [["r"]])
+    crash_after_append(log, [])
+    written = []
+    append_func = lambda sheet_name, rows: written.append((sheet_name, rows)) or True
+    assert log.replay(append_func, exists_func=lambda sheet_name, rows: None) == 1
+    assert written == [("record", [["r"]])]
+    assert [entry["data"] for entry in log.pending()] == [["a"]]
+    assert len(log.in_doubt()) == 1
+    # 未提供 exists_func 時仍會重新寫入（至少一次）
+    assert log.replay(append_func) == 1
+    assert written[-1] == ("15min", [["a"]])
+    assert not log.has_pending()
+
+def test_import_legacy(tmp_path):
+    legacy = tmp_path / "failed_sheet_updates.json"
+    legacy.write_text(json.dumps([
+        {"timestamp": "2024-01-01 00:00:00", "sheet_name": "15min", "data": ["a"]},
+        {"timestamp": "2024-01-01 00:15:00", "sheet_name": "record", "data": ["b"]}
+    ]), encoding="utf-8")
+    log = SheetWriteLog(str(tmp_path / "sheet_wal.jsonl"), fsync_interval=0)
+    assert log.import_legacy(str(legacy)) == 2
+    assert not legacy.exists()
+    assert (tmp_path / "failed_sheet_updates.json.imported").exists()
+    assert [(entry["sheet_name"], entry["data"], entry["timestamp"]) for entry in log.pending()] == [
+        ("15min", ["a"], "2024-01-01 00:00:00"), ("record", ["b"], "2024-01-01 00:15:00")
+    ]
@@ -0,0 +1,68 @@
+from signal_store import SignalIndex, SignalStore
+
+HOUR_MS = 60 * 60 * 1000
+
+def make_store(tmp_path):
+    return SignalStore(str(tmp_path / "signals.db"))
+
+def test_record_and_query_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    assert store.is_empty()
+    assert store.record("BTCUSDT", 1 * HOUR_MS, ["長多", "量增"])
+    assert store.record("ETHUSDT", 2 * HOUR_MS, ["量增"])
+    assert store.record_many([
+        ("ETHUSDT", 3 * HOUR_MS, ["長空"]),
+        ("BTCUSDT", 3 * HOUR_MS, ["多方回測續強"])
+    ]) == 2
+    assert not store.is_empty()
+
+    records = store.query(0, ["長空", "長多", "多方回測續強"])
+    assert records == [
+        {"trading_pair": "BTCUSDT", "open_time": 1 * HOUR_MS, "signal_types": ["長多", "量增"]},
+        {"trading_pair": "ETHUSDT", "open_time": 3 * HOUR_MS, "signal_types": ["長空"]},
+        {"trading_pair": "BTCUSDT", "open_time": 3 * HOUR_MS, "signal_types": ["多方回測續強"]}
+    ]
+    assert store.query(2 * HOUR_MS, ["長多"]) == []
+    assert [record["trading_pair"] for record in store.query(0, ["量增"])] == ["BTCUSDT", "ETHUSDT"]
+
+def test_records_survive_reopen(tmp_path):
+    store = make_store(tmp_path)
+    store.record("BTCUSDT", HOUR_MS, ["長空"])
+    store.close()
+    assert make_store(tmp_path).query(0, ["長空"])[0]["trading_pair"] == "BTCUSDT"
+
+def test_prune_deletes_only_older_records(tmp_path):
+    store = make_store(tmp_path)
+    store.record_many([
+        ("BTCUSDT", 1 * HOUR_MS, ["長多"]),
+        ("BTCUSDT", 2 * HOUR_MS, ["長多"]),
+        ("BTCUSDT", 3 * HOUR_MS, ["長多"])
+    ])
+    assert store.prune(2 * HOUR_MS) == 1
+    assert [record["open_time"] for record in store.query(0, ["長多"])] == [2 * HOUR_MS, 3 * HOUR_MS]
+    assert store.prune(10 * HOUR_MS) == 2
+    assert store.is_empty()
+
+def test_meta_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    assert store.get_meta("sheet_imported_at") is None
+    assert store.get_meta("sheet_imported_at", "0") == "0"
+    assert store.set_meta("sheet_imported_at", 123)
+    store.close()
+    assert make_store(tmp_path).get_meta("sheet_imported_at") == "123"
+
+def test_signal_index_first_after():
+    records = [
+        {"trading_pair": "BTCUSDT", "open_time": 1, "signal_types": ["長多"]},
+        {"trading_pair": "ETHUSDT", "open_time": 2, "signal_types": ["長空"]},
+        {"trading_pair": "BTCUSDT", "open_time": 3, "signal_types": ["多方回測續強"]},
+        {"trading_pair": "BTCUSDT", "open_time": 4, "signal_types": ["長空"]}
+    ]
+    index = SignalIndex(records)
+    assert len(index) == 4
+    assert index.pairs() == ["BTCUSDT", "ETHUSDT"]
+    assert index.records("BTCUSDT", "長多") == [records[0]]
+    assert index.first_after("BTCUSDT", 1, ["長空", "多方回測續強"]) is records[2]
+    assert index.first_after("BTCUSDT", 3, ["長空", "多方回測續強"]) is records[3]
+    assert index.first_after("BTCUSDT", 4, ["長空"]) is None
+    assert index.first_after("ETHUSDT", 0, ["長多"]) is None
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from kline_store import INTERVAL_MS, KlineStore
+from streaming import KlineStream
+
+START_MS = 1_700_000_100_000 - 1_700_000_100_000 % INTERVAL_MS["15m"]
+
+def frame(symbol, bar, close, closed, trades):
+    """錄製格式的組合串流訊息（/stream?streams=...）"""
+    open_time = START_MS + bar * INTERVAL_MS["15m"]
+    return json.dumps({
+        "stream": f"{symbol.lower()}@kline_15m",
+        "data": {
+            "e": "kline", "E": open_time + 1000, "s": symbol,
+            "k": {
+                "t": open_time, "T": open_time + INTERVAL_MS["15m"] - 1, "s": symbol, "i": "15m",
+                "o": "100.0", "c": close, "h": "101.0", "l": "99.0", "v": "12.5", "n": trades, "x": closed,
+                "q": "1250.0", "V": "6.0", "Q": "600.0", "B": "0"
+            }
+        }
+    })
+
+@pytest.fixture
+def stream(tmp_path):
+    return KlineStream(["BTCUSDT", "ETHUSDT"], "15m", KlineStore(str(tmp_path)), base_url="ws://127.0.0.1:1")
+
+def test_forming_bars_revise_last_bar(stream):
+    for close, trades in (("100.1", 1), ("100.2", 5), ("100.3", 9)):
+        assert stream.handle_message(frame("BTCUSDT", 0, close, False, trades)) is None
+    klines = stream.kline_store.get("BTCUSDT", "15m")
+    assert len(klines) == 1
+    assert klines[0][4] == "100.3" and klines[0][8] == 9
+    assert stream.closed_bars.empty()
+
+def test_closed_bar_queues_one_evaluation(stream):
+    stream.handle_message(frame("BTCUSDT", 0, "100.1", False, 1))
+    # 快取中還沒有 REST 歷史，第一根串流 K 線會要求補齊
+    assert stream.pop_stale("BTCUSDT")
+    assert stream.handle_message(frame("BTCUSDT", 0, "100.2", True, 3)) == ("BTCUSDT", START_MS)
+    # 重複推送的收盤事件不再排入佇列
+    assert stream.handle_message(frame("BTCUSDT", 0, "100.2", True, 3)) is None
+    stream.handle_message(frame("BTCUSDT", 1, "100.5", False, 1))
+    assert stream.closed_bars.get_nowait() == ("BTCUSDT", START_MS)
+    assert stream.closed_bars.empty()
+    assert [k[4] for k in stream.kline_store.get("BTCUSDT", "15m")] == ["100.2", "100.5"]
+    assert not stream.pop_stale("BTCUSDT")
+
+def test_gap_marks_pair_stale(stream):
+    stream.handle_message(frame("ETHUSDT", 0, "100.1", True, 1))
+    assert stream.pop_stale("ETHUSDT")
+    stream.handle_message(frame("ETHUSDT", 1, "100.2", False, 1))
+    assert not stream.pop_stale("ETHUSDT")
+    stream.handle_message(frame("ETHUSDT", 3, "100.4", False, 1))
+    assert stream.pop_stale("ETHUSDT")
+    assert not stream.pop_stale("ETHUSDT")
+    assert not stream.pop_stale("BTCUSDT")
+
+def test_reconnect_marks_pairs_stale(stream):
+    url = stream.stream_urls()[0]
+    stream.handle_open(url, stream.symbols)
+    assert not stream.pop_stale("BTCUSDT")
+    stream.handle_open(url, stream.symbols)
+    assert stream.pop_stale("BTCUSDT") and stream.pop_stale("ETHUSDT")
+
+def test_malformed_and_other_events_are_ignored(stream):
+    assert stream.handle_message("not json") is None
+    assert stream.handle_message(json.dumps({"data": {"e": "aggTrade"}})) is None
+    assert stream.closed_bars.empty()
+
+class ReplayServer:
+    """
+    最小的本地 WebSocket 替身：每次連線依序送出一組錄製的訊息後關閉連線，
+    第二組之後的訊息在用戶端重新連線時送出
+    """
+
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+        self.paths = []
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.url = f"ws://127.0.0.1:{self.sock.getsockname()[1]}"
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while self.sessions:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                request = b""
+                while b"\r\n\r\n" not in request:
+                    request += conn.recv(4096)
+                lines = request.decode().split("\r\n")
+                self.paths.append(lines[0].split(" ")[1])
+                key = next(line.split(":", 1)[1].strip() for line in lines if line.lower().startswith("sec-websocket-key"))
+                accept = base64.b64encode(hashlib.sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest())
+                conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                             b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+                for message in self.sessions.pop(0):
+                    payload = message.encode()
+                    header = struct.pack("!BB", 0x81, len(payload)) if len(payload) < 126 else struct.pack("!BBH", 0x81, 126, len(payload))
+                    conn.sendall(header + payload)
+                conn.sendall(b"\x88\x02\x03\xe8")
+                time.sleep(0.2)
+
+    def close(self):
+        self.sock.close()
+
+def test_replay_through_local_websocket(tmp_path):
+    server = ReplayServer([
+        [frame("BTCUSDT", 0, "100.1", False, 1), frame("BTCUSDT", 0, "100.2", True, 2)],
+        [frame("BTCUSDT", 1, "100.3", True, 4)]
+    ])
+    stream = KlineStream(["BTCUSDT"], "15m", KlineStore(str(tmp_path)), base_url=server.url, reconnect_delay=0.1)
+    stream.start()
+    try:
+        assert stream.closed_bars.get(timeout=10) == ("BTCUSDT", START_MS)
+        assert stream.closed_bars.get(timeout=10) == ("BTCUSDT", START_MS + INTERVAL_MS["15m"])
+        # 第二次連線屬於重新連線，交易對需要以 REST 補齊
+        assert stream.pop_stale("BTCUSDT")
+    finally:
+        stream.stop(timeout=2)
+        server.close()
+    assert server.paths[0] == "/stream?streams=btcusdt@kline_15m"
+    assert [k[4] for k in stream.kline_store.get("BTCUSDT", "15m")] == ["100.2", "100.3"]